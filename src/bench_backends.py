@@ -0,0 +1,65 @@
+'''Compares the process and thread search backends of Search_Pool.
+
+Searches the same positions with each backend for a range of worker counts and prints
+the time taken and the speedup over a single worker. Threads only search in parallel on
+a free-threaded build of python (3.13t or later), on a normal build they are limited by
+the GIL and are included as a baseline.
+
+usage: python3 bench_backends.py [--depth N] [--workers 1,2,4] [--lazy-smp]
+'''
+import argparse
+import multiprocessing
+import time as time
+from ordinary_engine import Chess_Board, Search_Pool, gil_disabled
+
+POSITIONS = ['r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3',
+             'r1bqk2r/pppp1ppp/2n2n2/2b1p3/2B1P3/3P1N2/PPP2PPP/RNBQK2R w KQkq - 1 5',
+             'rnbqkb1r/pp3ppp/4pn2/2pp4/3P4/2P1PN2/PP3PPP/RNBQKB1R w KQkq - 0 5',
+             'r2q1rk1/ppp2ppp/2np1n2/2b1p1B1/2B1P1b1/2NP1N2/PPP2PPP/R2QK2R w KQ - 6 7',
+             '8/5pk1/6p1/3P4/2K5/6P1/5P2/8 w - - 0 40']
+
+
+def bench(backend, num_workers, depth, lazy_smp):
+    '''Returns the seconds taken to search every position with a new pool'''
+    search_pool = Search_Pool(num_workers, lazy_smp, backend=backend)
+    chess_board = Chess_Board()
+    total = 0
+    for fen in POSITIONS:
+        chess_board.load_fen(fen)
+        color = 'w' if chess_board.turn else 'b'
+        moves = chess_board.list_moves(color)
+        start = time.time()
+        search_pool.search(chess_board, color, depth, moves)
+        total += time.time() - start
+    search_pool.close()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the process and thread search backends')
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--workers', default=None,
+                        help='comma separated worker counts, default 1, 2, 4... up to the cores')
+    parser.add_argument('--lazy-smp', action='store_true')
+    args = parser.parse_args()
+
+    if args.workers != None:
+        counts = [int(count) for count in args.workers.split(',')]
+    else:
+        counts = [1]
+        while counts[-1] * 2 <= multiprocessing.cpu_count():
+            counts.append(counts[-1] * 2)
+
+    print('GIL disabled:', gil_disabled())
+    print('backend  workers  seconds  speedup')
+    for backend in ('process', 'thread'):
+        single = None
+        for num_workers in counts:
+            seconds = bench(backend, num_workers, args.depth, args.lazy_smp)
+            if single == None:
+                single = seconds
+            print('%-8s %7d %8.2f %8.2f' % (backend, num_workers, seconds, single / seconds))
+
+
+if __name__ == '__main__':
+    main()
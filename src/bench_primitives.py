@@ -0,0 +1,271 @@
+'''Times the engine's hot functions one at a time over the positions of bench.py.
+
+Each primitive is run over every position once to warm up, which also works out how
+many passes over the positions make a repetition of at least --min-time seconds, and
+is then timed for --repeat repetitions. The median time of a single call and the
+interquartile range of the repetitions are printed and the run is added to a JSON
+history file, so runs from before and after a change can be compared with the compare
+command, which flags every primitive that got slower by more than --threshold.
+
+usage: python3 bench_primitives.py run [--repeat N] [--min-time S] [--only NAMES]
+                                       [--label TEXT] [--history FILE]
+       python3 bench_primitives.py compare [OLD] [NEW] [--threshold T] [--history FILE]
+'''
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from ordinary_engine import Chess_Board, Pawn
+from bench import POSITIONS
+
+HISTORY_PATH = 'bench_history.json'
+
+
+def corpus():
+    '''A board for each position, with the color to move'''
+    boards = []
+    for fen in POSITIONS:
+        chess_board = Chess_Board()
+        chess_board.load_fen(fen)
+        boards.append((chess_board, 'w' if chess_board.turn else 'b'))
+    return boards
+
+
+def own_king(chess_board, color):
+    return chess_board.get_white_king() if color == 'w' else chess_board.get_black_king()
+
+
+# Each primitive takes the corpus and returns a function doing one pass over it, along
+# with the number of calls of the primitive in a pass
+
+def make_undo(boards):
+    '''provisional_move of a legal move made as trusted, as the search does, and undo_move'''
+    work = [(chess_board, chess_board.list_moves(color)) for chess_board, color in boards]
+    def run():
+        for chess_board, moves in work:
+            for move in moves:
+                chess_board.provisional_move(move[0], move[1], move[3], move[4], 2, True)
+                chess_board.undo_move()
+    return run, sum(len(moves) for chess_board, moves in work)
+
+
+def make_undo_checked(boards):
+    '''provisional_move checking the move, and undo_move'''
+    work = [(chess_board, chess_board.list_moves(color)) for chess_board, color in boards]
+    def run():
+        for chess_board, moves in work:
+            for move in moves:
+                chess_board.provisional_move(move[0], move[1], move[3], move[4])
+                chess_board.undo_move()
+    return run, sum(len(moves) for chess_board, moves in work)
+
+
+def list_moves(boards):
+    def run():
+        for chess_board, color in boards:
+            chess_board.list_moves(color)
+    return run, len(boards)
+
+
+def in_check(boards):
+    '''King.in_check of the king of the side to move'''
+    work = [(chess_board, own_king(chess_board, color)) for chess_board, color in boards]
+    def run():
+        for chess_board, king in work:
+            king.in_check(chess_board.board, chess_board.move_num)
+    return run, len(work)
+
+
+def evaluate(boards):
+    def run():
+        for chess_board, color in boards:
+            chess_board.evaluate(color)
+    return run, len(boards)
+
+
+def valid_move(boards):
+    '''valid_move of every piece of the side to move to every square'''
+    work = []
+    for chess_board, color in boards:
+        board = chess_board.board
+        pieces = [board[x][y] for x in range(8) for y in range(8) if board[x][y].color == color]
+        targets = [board[x][y] for x in range(8) for y in range(8)]
+        work.append((chess_board, pieces, targets))
+    def run():
+        for chess_board, pieces, targets in work:
+            board = chess_board.board
+            move_num = chess_board.move_num
+            for piece in pieces:
+                for target in targets:
+                    piece.valid_move(target, board, move_num)
+    return run, sum(len(pieces) * 64 for chess_board, pieces, targets in work)
+
+
+def check_promote(boards):
+    '''check_promote of every piece on the board, which is what every move pays for,
+    as almost none of them promote'''
+    work = []
+    for chess_board, color in boards:
+        board = chess_board.board
+        work.append((chess_board, [board[x][y] for x in range(8) for y in range(8)
+                                   if board[x][y].type != 7]))
+    def run():
+        for chess_board, pieces in work:
+            for piece in pieces:
+                chess_board.check_promote(piece)
+    return run, sum(len(pieces) for chess_board, pieces in work)
+
+
+def check_promote_promoting(boards):
+    '''check_promote of a pawn that has reached the last rank, put back after each call'''
+    chess_board = Chess_Board()
+    chess_board.load_fen('4k3/8/8/8/8/8/8/4K3 w - - 0 1')
+    pawns = ([Pawn('w', x, 0, 5) for x in range(8) if x != 4] +
+             [Pawn('b', x, 7, 5) for x in range(8) if x != 4])
+    board = chess_board.board
+    phase = chess_board.phase
+    def run():
+        for pawn in pawns:
+            empty = board[pawn.x][pawn.y]
+            board[pawn.x][pawn.y] = pawn
+            chess_board.check_promote(pawn)
+            board[pawn.x][pawn.y] = empty
+        chess_board.phase = phase
+    return run, len(pawns)
+
+
+PRIMITIVES = {'make_undo': make_undo, 'make_undo_checked': make_undo_checked,
+              'list_moves': list_moves, 'in_check': in_check, 'evaluate': evaluate,
+              'valid_move': valid_move, 'check_promote': check_promote,
+              'check_promote_promoting': check_promote_promoting}
+
+
+def time_primitive(setup, repeat, min_time):
+    '''Returns the seconds a call took in each repetition and the calls in a pass'''
+    run, calls = setup(corpus())
+    start = time.perf_counter()
+    run() # warm up
+    single = max(time.perf_counter() - start, 1e-9)
+    passes = max(int(min_time / single), 1)
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        for j in range(passes):
+            run()
+        samples.append((time.perf_counter() - start) / (passes * calls))
+    return samples, calls
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as file:
+        return json.load(file)
+
+
+def run_command(args):
+    names = args.only.split(',') if args.only != None else list(PRIMITIVES)
+    for name in names:
+        if name not in PRIMITIVES:
+            sys.exit('unknown primitive %s, one of %s' % (name, ', '.join(PRIMITIVES)))
+    results = {}
+    print('primitive                  median us    iqr us     calls')
+    for name in names:
+        samples, calls = time_primitive(PRIMITIVES[name], args.repeat, args.min_time)
+        median = statistics.median(samples) * 1e6
+        if len(samples) > 1:
+            quartiles = statistics.quantiles(samples, n=4)
+            iqr = (quartiles[2] - quartiles[0]) * 1e6
+        else:
+            iqr = 0.0
+        results[name] = {'median_us': round(median, 4), 'iqr_us': round(iqr, 4),
+                         'calls': calls, 'repeat': args.repeat}
+        print('%-24s %11.3f %9.3f %9d' % (name, median, iqr, calls))
+
+    history = load_history(args.history)
+    history.append({'label': args.label,
+                    'time': datetime.datetime.now().isoformat(timespec='seconds'),
+                    'commit': git_commit(), 'python': platform.python_version(),
+                    'results': results})
+    with open(args.history, 'w') as file:
+        json.dump(history, file, indent=1)
+    print('run %d added to %s' % (len(history) - 1, args.history))
+
+
+def find_run(history, which):
+    '''A run of history by its index, negative from the end, or by its label'''
+    try:
+        return history[int(which)]
+    except ValueError:
+        for run in reversed(history):
+            if run['label'] == which:
+                return run
+    except IndexError:
+        pass
+    sys.exit('no run %s in the history' % which)
+
+
+def compare_command(args):
+    history = load_history(args.history)
+    old = find_run(history, args.old)
+    new = find_run(history, args.new)
+    print('old: %s %s %s' % (old['time'], old['commit'], old['label'] or ''))
+    print('new: %s %s %s' % (new['time'], new['commit'], new['label'] or ''))
+    print('primitive                   old us     new us   change')
+    regressions = 0
+    for name, result in new['results'].items():
+        if name not in old['results']:
+            continue
+        before = old['results'][name]['median_us']
+        after = result['median_us']
+        change = after / before - 1 if before > 0 else 0.0
+        flag = ''
+        if change > args.threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print('%-24s %9.3f %10.3f %+7.1f%%%s' % (name, before, after, change * 100, flag))
+    if regressions > 0:
+        print('%d primitive(s) slower by more than %.0f%%' % (regressions, args.threshold * 100))
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the engine primitives')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='time the primitives and add them to the history')
+    run_parser.add_argument('--repeat', type=int, default=9, help='timed repetitions')
+    run_parser.add_argument('--min-time', type=float, default=0.2,
+                            help='seconds each repetition runs for at least')
+    run_parser.add_argument('--only', default=None, help='comma separated primitives to time')
+    run_parser.add_argument('--label', default=None, help='name for the run in the history')
+    run_parser.add_argument('--history', default=HISTORY_PATH)
+    compare_parser = commands.add_parser('compare', help='compare two runs of the history')
+    compare_parser.add_argument('old', nargs='?', default='-2', help='index or label, default -2')
+    compare_parser.add_argument('new', nargs='?', default='-1', help='index or label, default -1')
+    compare_parser.add_argument('--threshold', type=float, default=0.05,
+                                help='slowdown flagged as a regression, 0.05 is 5%%')
+    compare_parser.add_argument('--history', default=HISTORY_PATH)
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        run_command(args)
+    else:
+        compare_command(args)
+
+
+if __name__ == '__main__':
+    main()
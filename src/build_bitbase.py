@@ -0,0 +1,341 @@
+'''Builds endgame bitbases for the engine by retrograde analysis.
+
+Each table holds the distance to mate of every position of a set of material, such as
+KRvK or KQvKR, with up to 4 pieces. Mates are found first, then the positions they
+can be reached from, working backwards one ply at a time, and every position left at
+the end is a draw. Captures and promotions lead to smaller tables, which are built
+first when missing. The tables go in the engine's res/bitbases directory by default,
+where the search probes them, see Bitbases.
+
+En passant and castling are left out of the tables, and the engine does not probe
+positions where either is possible. Three piece tables take seconds to build, four
+piece tables several minutes each, ex. about 4 minutes for KBNvK.
+
+usage: python3 build_bitbase.py KQvK KRvK KPvK [--output DIR]
+'''
+import argparse
+import os
+import time
+from ordinary_engine import (Bitbases, BITBASE_DIR, BITBASE_ORDER, BITBASE_MAX_PIECES,
+                             BITBASE_TRIANGLE, BITBASE_HALF, bitbase_index, bitbase_size)
+
+TYPES = {'K': 1, 'Q': 2, 'R': 6, 'B': 4, 'N': 3, 'P': 5}
+KING_STEPS = [(1,0),(1,1),(0,1),(-1,1),(-1,0),(-1,-1),(0,-1),(1,-1)]
+KNIGHT_STEPS = [(1,2),(2,1),(2,-1),(1,-2),(-1,-2),(-2,-1),(-2,1),(-1,2)]
+ORTHO_STEPS = [(0,1),(0,-1),(1,0),(-1,0)]
+DIAG_STEPS = [(1,1),(1,-1),(-1,1),(-1,-1)]
+SLIDES = {2: ORTHO_STEPS + DIAG_STEPS, 6: ORTHO_STEPS, 4: DIAG_STEPS}
+
+
+def steps(steps):
+    '''For each square, the squares one of steps away that are on the board'''
+    return [[(x + dx) * 8 + y + dy for dx, dy in steps if 0 <= x + dx < 8 and 0 <= y + dy < 8]
+            for x in range(8) for y in range(8)]
+
+
+def rays(steps):
+    '''For each square, the squares along each of steps in order out to the edge'''
+    table = []
+    for x in range(8):
+        for y in range(8):
+            square_rays = []
+            for dx, dy in steps:
+                ray = []
+                x2, y2 = x + dx, y + dy
+                while 0 <= x2 < 8 and 0 <= y2 < 8:
+                    ray.append(x2 * 8 + y2)
+                    x2, y2 = x2 + dx, y2 + dy
+                square_rays.append(ray)
+            table.append(square_rays)
+    return table
+
+
+KING_MOVES = steps(KING_STEPS)
+KNIGHT_MOVES = steps(KNIGHT_STEPS)
+RAYS = {type: rays(SLIDES[type]) for type in SLIDES}
+INSUFFICIENT = ['KvK', 'KBvK', 'KNvK'] # no mate is possible, so there is no table
+
+
+def table_name(white, black):
+    '''Name of the table for the piece letters of each side'''
+    return (''.join(sorted(white, key=BITBASE_ORDER.index)) + 'v' +
+            ''.join(sorted(black, key=BITBASE_ORDER.index)))
+
+
+class Table_Builder:
+
+    '''Builds the table name, white's pieces being the ones before the v. Pieces are
+    (color, type) in the order the table's squares are in, and positions lists of
+    squares in that order.'''
+
+    def __init__(self, name, bitbases):
+        white, black = name.split('v')
+        if white[0] != 'K' or black[0] != 'K' or 'K' in white[1:] + black[1:]:
+            raise ValueError('Each side needs one king: ' + name)
+        self.name = name
+        self.bitbases = bitbases
+        self.pieces = [('w', TYPES[letter]) for letter in white] + [('b', TYPES[letter]) for letter in black]
+        self.pawns = 'P' in name
+        self.region = BITBASE_HALF if self.pawns else BITBASE_TRIANGLE
+        self.size = bitbase_size(len(self.pieces), self.pawns)
+
+    def decode(self, index):
+        '''The squares and side to move of index'''
+        squares = []
+        for i in range(len(self.pieces) - 1):
+            squares.append(index % 64)
+            index //= 64
+        squares.append(self.region[index % len(self.region)])
+        squares.reverse()
+        return squares, index // len(self.region)
+
+    def attacked(self, squares, target, color):
+        '''True if a piece of color attacks target, squares being None where a piece
+        has been taken'''
+        occupied = set(sq for sq in squares if sq != None)
+        for (piece_color, type), sq in zip(self.pieces, squares):
+            if piece_color != color or sq == None:
+                continue
+            if type == 1:
+                if target in KING_MOVES[sq]:
+                    return True
+            elif type == 3:
+                if target in KNIGHT_MOVES[sq]:
+                    return True
+            elif type == 5:
+                dy = -1 if color == 'w' else 1
+                if (target & 7) == (sq & 7) + dy and abs((target >> 3) - (sq >> 3)) == 1:
+                    return True
+            else:
+                for ray in RAYS[type][sq]:
+                    for ray_sq in ray:
+                        if ray_sq == target:
+                            return True
+                        if ray_sq in occupied:
+                            break
+        return False
+
+    def in_check(self, squares, color):
+        king = 0 if color == 'w' else [c for c, t in self.pieces].index('b')
+        return self.attacked(squares, squares[king], 'b' if color == 'w' else 'w')
+
+    def valid(self, squares, stm):
+        if len(set(squares)) != len(squares):
+            return False
+        for (color, type), sq in zip(self.pieces, squares):
+            if type == 5 and (sq & 7) in (0, 7):
+                return False
+        return not self.in_check(squares, 'b' if stm == 0 else 'w')
+
+    def moves(self, squares, stm):
+        '''Yields (piece, to, promote_type) for the pseudo legal moves of the side to move'''
+        color = 'w' if stm == 0 else 'b'
+        occupied = {}
+        for (piece_color, type), sq in zip(self.pieces, squares):
+            occupied[sq] = piece_color
+        for i, ((piece_color, type), sq) in enumerate(zip(self.pieces, squares)):
+            if piece_color != color:
+                continue
+            if type == 1 or type == 3:
+                for to in (KING_MOVES if type == 1 else KNIGHT_MOVES)[sq]:
+                    if occupied.get(to) != color:
+                        yield i, to, None
+            elif type == 5:
+                dy = -1 if color == 'w' else 1
+                last = 0 if color == 'w' else 7
+                targets = []
+                ahead = sq + dy
+                if ahead not in occupied:
+                    targets.append(ahead)
+                    if (sq & 7) == (6 if color == 'w' else 1) and ahead + dy not in occupied:
+                        targets.append(ahead + dy)
+                for dx in (-8, 8):
+                    to = sq + dx + dy
+                    if 0 <= to < 64 and abs((to >> 3) - (sq >> 3)) == 1 and occupied.get(to, color) != color:
+                        targets.append(to)
+                for to in targets:
+                    if (to & 7) == last:
+                        for promote_type in (2, 6, 4, 3):
+                            yield i, to, promote_type
+                    else:
+                        yield i, to, None
+            else:
+                for ray in RAYS[type][sq]:
+                    for to in ray:
+                        if occupied.get(to) == color:
+                            break
+                        yield i, to, None
+                        if to in occupied:
+                            break
+
+    def unmoves(self, squares, stm):
+        '''Yields the positions, as squares, the side that just moved could have come
+        from without a capture or promotion'''
+        color = 'b' if stm == 0 else 'w' # the side that made the last move
+        occupied = set(squares)
+        for i, ((piece_color, type), sq) in enumerate(zip(self.pieces, squares)):
+            if piece_color != color:
+                continue
+            froms = []
+            if type == 1 or type == 3:
+                froms = [sq2 for sq2 in (KING_MOVES if type == 1 else KNIGHT_MOVES)[sq]
+                         if sq2 not in occupied]
+            elif type == 5:
+                dy = 1 if color == 'w' else -1 # backwards
+                back = sq + dy
+                if (back & 7) not in (0, 7) and back not in occupied:
+                    froms.append(back)
+                    if (sq & 7) == (4 if color == 'w' else 3) and back + dy not in occupied:
+                        froms.append(back + dy)
+            else:
+                for ray in RAYS[type][sq]:
+                    for sq2 in ray:
+                        if sq2 in occupied:
+                            break
+                        froms.append(sq2)
+            for sq2 in froms:
+                yield squares[:i] + [sq2] + squares[i + 1:]
+
+    def exit_value(self, squares, i, to, promote_type, stm):
+        '''(result, plies) for the side to move after a capture or promotion, which
+        leaves the table'''
+        pieces = []
+        for j, ((color, type), sq) in enumerate(zip(self.pieces, squares)):
+            if sq == to and j != i:
+                continue # taken
+            if j == i:
+                pieces.append((color, promote_type or type, to))
+            else:
+                pieces.append((color, type, sq))
+        white = ''.join(letter for color, type, sq in pieces for letter, t in TYPES.items()
+                        if color == 'w' and t == type)
+        black = ''.join(letter for color, type, sq in pieces for letter, t in TYPES.items()
+                        if color == 'b' and t == type)
+        if table_name(white, black) in INSUFFICIENT or table_name(black, white) in INSUFFICIENT:
+            return 0, 0
+        value = self.bitbases.probe_pieces(pieces, 'b' if stm == 0 else 'w')
+        if value == None:
+            raise ValueError('Missing table ' + table_name(white, black))
+        return value
+
+    def build(self, log=print):
+        '''Returns the table as a bytearray'''
+        size = self.size
+        values = bytearray(size)
+        state = bytearray(size) # 0 valid, 1 not a valid position, 2 solved
+        counts = bytearray(size) # successors in the table not yet known to be lost
+        longest = bytearray(size) # plies + 1 of the longest loss through a successor
+        can_draw = bytearray(size) # a move draws or wins by leaving the table
+        levels = [[] for i in range(256)] # positions solved at each number of plies
+
+        start = time.time()
+        for index in range(size):
+            squares, stm = self.decode(index)
+            if (not self.valid(squares, stm) or
+                bitbase_index(squares, stm, self.pawns) != index):
+                state[index] = 1 # positions mirrored into another index are not kept
+                continue
+            color = 'w' if stm == 0 else 'b'
+            successors = set()
+            legal = 0
+            win = None
+            for i, to, promote_type in self.moves(squares, stm):
+                after = squares[:i] + [to] + squares[i + 1:]
+                taken = None
+                if to in squares:
+                    taken = squares.index(to)
+                    after[taken] = None
+                if self.in_check(after, color):
+                    continue
+                legal += 1
+                if taken == None and promote_type == None:
+                    successors.add(bitbase_index(after, 1 - stm, self.pawns))
+                    continue
+                result, plies = self.exit_value(squares, i, to, promote_type, stm)
+                if result == -1: # the opponent is mated
+                    if win == None or plies + 1 < win:
+                        win = plies + 1
+                elif result == 1:
+                    longest[index] = max(longest[index], plies + 1)
+                else:
+                    can_draw[index] = 1
+            if legal == 0:
+                if self.in_check(squares, color):
+                    levels[0].append(index) # mated
+                else:
+                    state[index] = 2 # stalemate
+                continue
+            counts[index] = len(successors)
+            if win != None:
+                can_draw[index] = 1
+                levels[win].append(index)
+            elif counts[index] == 0 and not can_draw[index]:
+                levels[longest[index]].append(index) # every move leaves the table and loses
+        log('%s: %d positions looked at in %.0f seconds' % (self.name, size, time.time() - start))
+
+        for plies in range(255):
+            for index in levels[plies]:
+                if state[index] != 0:
+                    continue
+                state[index] = 2
+                values[index] = plies + 1
+                squares, stm = self.decode(index)
+                predecessors = set(bitbase_index(before, 1 - stm, self.pawns)
+                                   for before in self.unmoves(squares, stm))
+                for before in predecessors:
+                    if state[before] != 0:
+                        continue
+                    if plies % 2 == 0: # index is lost, so before wins by moving to it
+                        levels[plies + 1].append(before)
+                    else:
+                        counts[before] -= 1
+                        longest[before] = max(longest[before], plies + 1)
+                        if counts[before] == 0 and not can_draw[before]:
+                            levels[longest[before]].append(before)
+        log('%s: built in %.0f seconds' % (self.name, time.time() - start))
+        return values
+
+
+def build(name, path, built, log=print):
+    '''Builds the table name in path, after the tables it leads to that are missing'''
+    white, black = name.split('v')
+    if name in built or table_name(white, black) in INSUFFICIENT:
+        return
+    if len(name) - 1 > BITBASE_MAX_PIECES:
+        raise ValueError('Tables are for up to %d pieces: %s' % (BITBASE_MAX_PIECES, name))
+    # tables after a capture of each piece but a king, and after a promotion
+    subtables = set()
+    for side, other, flip in ((white, black, False), (black, white, True)):
+        for i in range(1, len(side)):
+            smaller = side[:i] + side[i + 1:]
+            subtables.add(table_name(other, smaller) if flip else table_name(smaller, other))
+            if side[i] == 'P':
+                for letter in 'QRBN':
+                    promoted = side[:i] + letter + side[i + 1:]
+                    subtables.add(table_name(other, promoted) if flip else
+                                  table_name(promoted, other))
+    for subtable in sorted(subtables):
+        sub_white, sub_black = subtable.split('v')
+        if (not os.path.exists(os.path.join(path, subtable + '.bin')) and
+            not os.path.exists(os.path.join(path, table_name(sub_black, sub_white) + '.bin'))):
+            build(subtable, path, built, log)
+    values = Table_Builder(name, Bitbases(path)).build(log)
+    with open(os.path.join(path, name + '.bin'), 'wb') as table:
+        table.write(values)
+    built.add(name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build endgame bitbases')
+    parser.add_argument('tables', nargs='+', help='material of each table, ex. KRvK or KQvKR')
+    parser.add_argument('-o', '--output', default=BITBASE_DIR)
+    args = parser.parse_args()
+    os.makedirs(args.output, exist_ok=True)
+    built = set()
+    for name in args.tables:
+        white, black = name.upper().split('V')
+        build(table_name(white, black), args.output, built)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+'''Builds an opening book for the engine from PGN files.
+
+The games are read as a stream, so the files can be any size, and replayed on the
+worker processes, each counting how often every move was played in every position and
+how it scored. The counts are gathered in memory up to --max-entries moves at a time
+and then written out as a sorted run to a temporary file. Once every game is read the
+runs are merged, moves that do not pass the filters are dropped and the rest are
+written as the engine's binary book, see Opening_Book. A move's weight in the book is
+the number of games it was played in.
+
+usage: python3 build_book.py games.pgn [more.pgn.gz ...] [-o book.bin] [--plies N]
+                             [--min-count N] [--min-score S] [--workers N]
+'''
+import argparse
+import bz2
+import gzip
+import heapq
+import multiprocessing
+import os
+import re
+import struct
+import tempfile
+import threading
+import time
+from ordinary_engine import Chess_Board, BOOK_RECORD, book_key, encode_book_move
+
+PIECE_LETTERS = {'K': 1, 'Q': 2, 'N': 3, 'B': 4, 'R': 6}
+RESULTS = {'1-0': 'w', '0-1': 'b', '1/2-1/2': None}
+# a move of the temporary runs: key, move, games played in and points scored by the
+# side that played it, 2 for a win and 1 for a draw
+RUN_RECORD = struct.Struct('>QHQQ')
+
+SAN_PATTERN = re.compile(r'([KQNBR])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([QNBR]))?')
+# comments, variations, numeric annotations and move numbers, none of which are moves
+NOT_MOVES = re.compile(r'\{[^}]*\}|;[^\n]*|\$\d+|\d+\.(\.\.)?')
+
+
+def open_pgn(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, encoding='utf-8', errors='replace')
+
+
+def read_games(paths):
+    '''Yields (fen, result, movetext) for each game of the PGN files, fen being None for
+    games from the usual starting position. Only one game is held in memory at a time.'''
+    for path in paths:
+        with open_pgn(path) as pgn:
+            headers = {}
+            movetext = []
+            for line in pgn:
+                line = line.strip()
+                if line.startswith('['):
+                    if len(movetext) > 0: # the next game's headers, without a blank line
+                        yield game_record(headers, movetext)
+                        headers = {}
+                        movetext = []
+                    match = re.match(r'\[(\w+)\s+"(.*)"\]', line)
+                    if match:
+                        headers[match.group(1)] = match.group(2)
+                elif len(line) > 0:
+                    movetext.append(line)
+                elif len(movetext) > 0: # the blank line after the moves ends the game
+                    yield game_record(headers, movetext)
+                    headers = {}
+                    movetext = []
+            if len(movetext) > 0:
+                yield game_record(headers, movetext)
+
+
+def game_record(headers, movetext):
+    if headers.get('Variant', 'Standard').lower() not in ('standard', 'chess', 'from position'):
+        return (None, None, '') # not chess as the engine plays it, skipped
+    return (headers.get('FEN'), headers.get('Result', '*'), ' '.join(movetext))
+
+
+def san_moves(movetext):
+    '''The moves of movetext, with comments, variations and annotations taken out'''
+    depth = 0
+    text = []
+    for part in re.split(r'([()])', NOT_MOVES.sub(' ', movetext)):
+        if part == '(':
+            depth += 1
+        elif part == ')':
+            depth -= 1
+        elif depth == 0:
+            text.append(part)
+    return [san for san in ' '.join(text).split() if san not in RESULTS and san != '*']
+
+
+def parse_san(chess_board, san):
+    '''The move san, ex. Nbd7 or exd8=Q, stands for on chess_board, as (x1, y1, x2, y2,
+    promote_type), or None if it is not a legal move'''
+    color = 'w' if chess_board.turn else 'b'
+    san = san.rstrip('+#!?')
+    if san in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        y = 7 if color == 'w' else 0
+        king = chess_board.board[4][y]
+        if king.type != 1 or king.color != color:
+            return None
+        return (4, y, 6 if len(san) == 3 else 2, y, 2)
+    match = SAN_PATTERN.fullmatch(san)
+    if match == None:
+        return None
+    letter, from_file, from_rank, square, promotion = match.groups()
+    type = PIECE_LETTERS[letter] if letter != None else 5
+    x2, y2 = ord(square[0]) - 97, 8 - int(square[1])
+    target = chess_board.board[x2][y2]
+    candidates = []
+    for x in range(8):
+        if from_file != None and x != ord(from_file) - 97:
+            continue
+        for y in range(8):
+            if from_rank != None and y != 8 - int(from_rank):
+                continue
+            piece = chess_board.board[x][y]
+            if (piece.type == type and piece.color == color and
+                piece.valid_move(target, chess_board.board, chess_board.move_num)):
+                candidates.append((x, y))
+    promote_type = PIECE_LETTERS[promotion] if promotion != None else 2
+    if len(candidates) > 1: # only one of them can move without leaving the king in check
+        legal = []
+        for x, y in candidates:
+            if chess_board.provisional_move(x, y, x2, y2, promote_type):
+                chess_board.undo_move()
+                legal.append((x, y))
+        candidates = legal
+    if len(candidates) != 1:
+        return None
+    return candidates[0] + (x2, y2, promote_type)
+
+
+def count_games(games, max_plies):
+    '''Counts the first max_plies moves of games, a list from read_games. Returns the
+    counts as a dict of (key, move) -> [games, points], and the number of games used'''
+    counts = {}
+    used = 0
+    for fen, result, movetext in games:
+        if result not in RESULTS:
+            continue # unfinished, or not standard chess
+        chess_board = Chess_Board()
+        if fen != None:
+            chess_board.load_fen(fen)
+        used += 1
+        for san in san_moves(movetext)[:max_plies]:
+            move = parse_san(chess_board, san)
+            if move == None:
+                break # the rest of the game cannot be followed
+            x1, y1, x2, y2, promote_type = move
+            color = 'w' if chess_board.turn else 'b'
+            promoting = chess_board.board[x1][y1].type == 5 and y2 in (0, 7)
+            entry = (book_key(chess_board), encode_book_move(x1, y1, x2, y2,
+                                                             promote_type if promoting else None))
+            points = 1 if RESULTS[result] == None else 2 if RESULTS[result] == color else 0
+            count = counts.get(entry)
+            if count == None:
+                counts[entry] = [1, points]
+            else:
+                count[0] += 1
+                count[1] += points
+            # the move was found among the legal moves, so it can be made as trusted
+            chess_board.provisional_move(x1, y1, x2, y2, promote_type, True)
+    return counts, used
+
+
+def count_chunk(args):
+    return count_games(*args)
+
+
+def chunks(games, chunk_size, max_plies, slots):
+    '''Groups games into lists of chunk_size for the workers. slots is acquired for
+    each chunk, so only so many are read ahead of the ones counted.'''
+    chunk = []
+    for game in games:
+        chunk.append(game)
+        if len(chunk) == chunk_size:
+            slots.acquire()
+            yield (chunk, max_plies)
+            chunk = []
+    if len(chunk) > 0:
+        slots.acquire()
+        yield (chunk, max_plies)
+
+
+def write_run(counts):
+    '''Writes counts to a temporary file sorted by key and move, returns its path'''
+    fd, path = tempfile.mkstemp(suffix='.run')
+    with os.fdopen(fd, 'wb') as run:
+        for key, move in sorted(counts):
+            run.write(RUN_RECORD.pack(key, move, *counts[(key, move)]))
+    return path
+
+
+def read_run(path):
+    with open(path, 'rb') as run:
+        while True:
+            data = run.read(RUN_RECORD.size)
+            if len(data) < RUN_RECORD.size:
+                return
+            yield RUN_RECORD.unpack(data)
+
+
+def merge_runs(paths):
+    '''Yields (key, move, games, points) in order of key and move from the sorted runs,
+    with the counts of the same move in different runs added together'''
+    last = None
+    for key, move, games, points in heapq.merge(*[read_run(path) for path in paths]):
+        if last != None and last[0] == key and last[1] == move:
+            last[2] += games
+            last[3] += points
+        else:
+            if last != None:
+                yield last
+            last = [key, move, games, points]
+    if last != None:
+        yield last
+
+
+def write_position(book, moves):
+    '''Writes the moves of one position, scaled down if the most played one has a weight
+    that does not fit in 16 bits'''
+    scale = max(max(games for key, move, games in moves) / 0xFFFF, 1)
+    for key, move, games in moves:
+        book.write(BOOK_RECORD.pack(key, move, max(int(games / scale), 1), 0))
+
+
+def build_book(paths, out_path, max_plies=20, min_count=3, min_score=0.0, workers=None,
+               chunk_size=500, max_entries=2000000):
+    '''Builds the book at out_path from the PGN files paths. A move is kept if it was
+    played at least min_count times in the first max_plies plies of the games and scored
+    at least min_score, 0 to 1, for the side that played it. Returns the number of
+    games used, positions and moves in the book.'''
+    runs = []
+    counts = {}
+    used = 0
+    slots = threading.BoundedSemaphore((workers or multiprocessing.cpu_count()) * 2)
+    try:
+        with multiprocessing.Pool(workers) as pool:
+            for chunk_counts, chunk_used in pool.imap_unordered(
+                    count_chunk, chunks(read_games(paths), chunk_size, max_plies, slots)):
+                slots.release()
+                used += chunk_used
+                for entry, (games, points) in chunk_counts.items():
+                    count = counts.get(entry)
+                    if count == None:
+                        counts[entry] = [games, points]
+                    else:
+                        count[0] += games
+                        count[1] += points
+                if len(counts) > max_entries:
+                    runs.append(write_run(counts))
+                    counts = {}
+        runs.append(write_run(counts))
+        counts = {}
+
+        positions = 0
+        moves_kept = 0
+        with open(out_path, 'wb') as book:
+            moves = []
+            for key, move, games, points in merge_runs(runs):
+                if len(moves) > 0 and moves[0][0] != key:
+                    write_position(book, moves)
+                    positions += 1
+                    moves = []
+                if games >= min_count and points / (2 * games) >= min_score:
+                    moves.append((key, move, games))
+                    moves_kept += 1
+            if len(moves) > 0:
+                write_position(book, moves)
+                positions += 1
+    finally:
+        for path in runs:
+            os.remove(path)
+    return used, positions, moves_kept
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build an opening book from PGN files')
+    parser.add_argument('pgn', nargs='+', help='PGN files, optionally .gz or .bz2')
+    parser.add_argument('-o', '--output', default='book.bin')
+    parser.add_argument('--plies', type=int, default=20, help='plies of each game counted')
+    parser.add_argument('--min-count', type=int, default=3,
+                        help='games a move has to be played in to be kept')
+    parser.add_argument('--min-score', type=float, default=0.0,
+                        help='score, 0 to 1, a move needs for the side that played it')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--chunk', type=int, default=500, help='games given to a worker at once')
+    parser.add_argument('--max-entries', type=int, default=2000000,
+                        help='moves counted in memory before they are written to a run')
+    args = parser.parse_args()
+
+    start = time.time()
+    used, positions, moves = build_book(args.pgn, args.output, args.plies, args.min_count,
+                                        args.min_score, args.workers, args.chunk,
+                                        args.max_entries)
+    seconds = time.time() - start
+    print('%d games, %d positions, %d moves written to %s' % (used, positions, moves,
+                                                               args.output))
+    print('%.1f seconds, %.0f games a second' % (seconds, used / max(seconds, 1e-9)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,439 @@
+'''A local stand-in for the lichess endpoints the bot uses, for testing it offline.
+
+Mock_Lichess can be passed to Bot_Server or Lichess_Game in place of a berserk.Client.
+It plays the opponents itself, by a script or random legal moves, keeps the clocks,
+can add latency to every request and event and can drop the game and event streams
+at random. In load test mode it challenges the bot to many games at once and reports
+how long the bot's moves took and how many games it can get through an hour.
+
+usage: python3 mock_lichess.py [--games N] [--concurrency N] [--workers N] [--depth N]
+                               [--clock SECONDS] [--latency SECONDS] [--drop-rate P]
+                               [--book FILE] [--stats-log FILE]
+'''
+import argparse
+import asyncio
+import collections
+import contextlib
+import heapq
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import random
+import tempfile
+import threading
+import time as time
+import ordinary_engine
+from ordinary_engine import Chess_Board, Search_Pool, Bot_Server, Opening_Book, index_to_lich
+
+
+def random_opponent(board, color):
+    '''Plays a random legal move'''
+    return index_to_lich(random.choice(board.list_moves(color)))
+
+
+def scripted_opponent(moves):
+    '''Plays moves, a list of lichess moves ex. ['e7e5', 'b8c6'], in order and resigns
+    once they run out'''
+    moves = list(moves)
+    def opponent(board, color):
+        if len(moves) == 0:
+            return None
+        return moves.pop(0)
+    return opponent
+
+
+class Mock_Game:
+
+    '''One game between the bot and a mock opponent. The opponent returns its move in
+    the lichess form for the board and color it is given, or None to resign.'''
+
+    def __init__(self, lichess, game_id, bot_color, opponent, clock, increment):
+        self.lichess = lichess
+        self.game_id = game_id
+        self.bot_color = bot_color
+        self.opponent = opponent
+        self.increment = increment
+        self.board = Chess_Board()
+        self.moves = []
+        self.status = 'started'
+        self.winner = None # 'w', 'b' or None for a draw, once the game is over
+        self.clocks = {'w': clock, 'b': clock}
+        self.turn_start = time.time()
+        self.streams = [] # event queue of each open game stream
+        self.lock = threading.RLock()
+
+    def state(self):
+        return {'type': 'gameState', 'moves': ' '.join(self.moves),
+                'wtime': int(self.clocks['w'] * 1000), 'btime': int(self.clocks['b'] * 1000),
+                'winc': int(self.increment * 1000), 'binc': int(self.increment * 1000),
+                'status': self.status}
+
+    def full(self):
+        bot = {'id': self.lichess.bot_name.lower(), 'name': self.lichess.bot_name}
+        opponent = {'id': 'opponent', 'name': 'Opponent'}
+        return {'type': 'gameFull', 'id': self.game_id,
+                'white': bot if self.bot_color == 'w' else opponent,
+                'black': opponent if self.bot_color == 'w' else bot,
+                'initialFen': 'startpos', 'state': self.state()}
+
+    def turn(self):
+        return 'w' if self.board.turn else 'b'
+
+    def push(self, move):
+        '''Makes move, in the lichess form, for the side to move. Returns False if it
+        is not legal'''
+        with self.lock:
+            if self.status != 'started':
+                return False
+            color = self.turn()
+            now = time.time()
+            self.clocks[color] -= now - self.turn_start
+            if self.clocks[color] < 0:
+                self.clocks[color] = 0
+                self.end('outoftime', 'b' if color == 'w' else 'w')
+                return False
+            index = ordinary_engine.lich_to_index(move[:4])
+            promote_type = ordinary_engine.PROMOTE_TYPES.get(move[4:], 2)
+            if not self.board.provisional_move(int(index[0]), int(index[1]), int(index[3]),
+                                               int(index[4]), promote_type):
+                return False
+            self.moves.append(move)
+            self.clocks[color] += self.increment
+            self.turn_start = now
+            opp_color = self.turn()
+            if len(self.board.list_moves(opp_color)) == 0:
+                if self.board.in_checkmate(opp_color):
+                    self.end('mate', color)
+                else:
+                    self.end('stalemate')
+            elif len(self.moves) >= self.lichess.max_plies:
+                self.end('draw')
+            else:
+                self.publish(self.state())
+                self.lichess.later(self.clocks[opp_color], self.check_flag, len(self.moves))
+                if opp_color != self.bot_color:
+                    self.lichess.later(self.lichess.think_time(), self.opponent_move)
+            return True
+
+    def check_flag(self, ply):
+        '''Ends the game on time if no move was made since ply'''
+        with self.lock:
+            if self.status == 'started' and len(self.moves) == ply:
+                color = self.turn()
+                self.clocks[color] = 0
+                self.end('outoftime', 'b' if color == 'w' else 'w')
+
+    def opponent_move(self):
+        with self.lock:
+            if self.status != 'started':
+                return
+            move = self.opponent(self.board, self.turn())
+            if move == None:
+                self.end('resign', self.bot_color)
+            elif not self.push(move):
+                raise ValueError('Opponent played an illegal move: ' + move)
+
+    def end(self, status, winner=None):
+        self.status = status
+        self.winner = winner
+        self.publish(self.state())
+        self.lichess.game_over(self)
+
+    def publish(self, event):
+        for events in self.streams:
+            self.lichess.deliver(events, event)
+
+
+class Mock_Bots:
+
+    '''The client.bots endpoints'''
+
+    def __init__(self, lichess):
+        self.lichess = lichess
+
+    def stream_incoming_events(self):
+        lichess = self.lichess
+        events = lichess.open_stream(lichess.incoming)
+        try:
+            # like lichess, the open challenges and every game being played are sent
+            # when the stream opens
+            for challenge_id in list(lichess.challenges):
+                yield lichess.challenge_event(challenge_id)
+            for game in list(lichess.played.values()):
+                if game.status == 'started':
+                    yield {'type': 'gameStart', 'game': {'id': game.game_id}}
+            while True:
+                yield lichess.next_event(events)
+        finally:
+            lichess.close_stream(lichess.incoming, events)
+
+    def stream_game_state(self, game_id):
+        lichess = self.lichess
+        game = lichess.played[game_id]
+        events = lichess.open_stream(game.streams)
+        try:
+            with game.lock:
+                full = game.full()
+            yield full
+            if full['state']['status'] != 'started':
+                return
+            while True:
+                event = lichess.next_event(events)
+                yield event
+                if event['status'] != 'started':
+                    return
+        finally:
+            lichess.close_stream(game.streams, events)
+
+    def make_move(self, game_id, move):
+        self.lichess.wait_latency()
+        if not self.lichess.played[game_id].push(move):
+            raise ValueError('Illegal move or game over: ' + move) # lichess answers 400
+
+    def accept_challenge(self, challenge_id):
+        self.lichess.wait_latency()
+        self.lichess.start_game(challenge_id)
+
+    def decline_challenge(self, challenge_id):
+        self.lichess.wait_latency()
+        self.lichess.challenges.pop(challenge_id, None)
+        self.lichess.declined += 1
+
+
+class Mock_Games:
+
+    '''The client.games endpoints'''
+
+    def __init__(self, lichess):
+        self.lichess = lichess
+
+    def export_by_player(self, username, since=None, until=None, max=None, finished=True):
+        games = [game for game in self.lichess.played.values()
+                 if finished or game.status == 'started']
+        for game in games[:max]:
+            yield {'id': game.game_id, 'status': game.status,
+                   'moves': ' '.join(game.moves)}
+
+
+class Mock_Lichess:
+
+    '''Takes the place of berserk.Client. latency, in seconds, is added to every request
+    and event with up to jitter more on top. Each event read from a stream drops the
+    connection with probability drop_rate. Opponents take think_range seconds a move.'''
+
+    def __init__(self, bot_name='Bot', latency=0.0, jitter=0.0, drop_rate=0.0,
+                 think_range=(0.05, 0.2), max_plies=200):
+        self.bot_name = bot_name
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.think_range = think_range
+        self.max_plies = max_plies
+        self.bots = Mock_Bots(self)
+        self.games = Mock_Games(self)
+        self.played = {} # game id: Mock_Game
+        self.challenges = {} # challenge id: (opponent, clock, increment, bot color, speed)
+        self.incoming = [] # event queue of each open incoming events stream
+        self.finished = [] # games over, in the order they ended
+        self.declined = 0
+        self.ids = itertools.count(1)
+        self.timers = [] # heap of (time due, count, function, args)
+        self.timer_cond = threading.Condition()
+        threading.Thread(target=self.run_timers, daemon=True).start()
+
+    def later(self, delay, function, *args):
+        with self.timer_cond:
+            heapq.heappush(self.timers, (time.time() + delay, next(self.ids), function, args))
+            self.timer_cond.notify()
+
+    def run_timers(self):
+        while True:
+            with self.timer_cond:
+                while len(self.timers) == 0 or self.timers[0][0] > time.time():
+                    timeout = None if len(self.timers) == 0 else self.timers[0][0] - time.time()
+                    self.timer_cond.wait(timeout)
+                due, count, function, args = heapq.heappop(self.timers)
+            function(*args)
+
+    def sample_latency(self):
+        return self.latency + random.random() * self.jitter
+
+    def wait_latency(self):
+        if self.latency > 0 or self.jitter > 0:
+            time.sleep(self.sample_latency())
+
+    def think_time(self):
+        return random.uniform(*self.think_range)
+
+    def open_stream(self, streams):
+        events = queue.Queue()
+        events.due = 0.0 # delivery time of the last event, to keep events in order
+        streams.append(events)
+        return events
+
+    def close_stream(self, streams, events):
+        if events in streams:
+            streams.remove(events)
+
+    def deliver(self, events, event):
+        due = max(time.time() + self.sample_latency(), events.due)
+        events.due = due
+        self.later(due - time.time(), events.put, event)
+
+    def next_event(self, events):
+        event = events.get()
+        if random.random() < self.drop_rate:
+            raise ConnectionError('Mock connection dropped')
+        return event
+
+    def challenge(self, opponent=random_opponent, clock=180, increment=2, bot_color=None,
+                  speed='blitz'):
+        '''Challenges the bot to a game, bot_color is random unless given'''
+        challenge_id = 'mock%d' % next(self.ids)
+        if bot_color == None:
+            bot_color = random.choice('wb')
+        self.challenges[challenge_id] = (opponent, clock, increment, bot_color, speed)
+        event = self.challenge_event(challenge_id)
+        for events in list(self.incoming):
+            self.deliver(events, event)
+        return challenge_id
+
+    def challenge_event(self, challenge_id):
+        speed = self.challenges[challenge_id][4]
+        return {'type': 'challenge',
+                'challenge': {'id': challenge_id, 'variant': {'key': 'standard'},
+                              'speed': speed, 'rated': False,
+                              'challenger': {'id': 'opponent', 'name': 'Opponent'}}}
+
+    def start_game(self, challenge_id):
+        opponent, clock, increment, bot_color, speed = self.challenges.pop(challenge_id)
+        game = Mock_Game(self, challenge_id, bot_color, opponent, clock, increment)
+        self.played[challenge_id] = game
+        for events in list(self.incoming):
+            self.deliver(events, {'type': 'gameStart', 'game': {'id': challenge_id}})
+        if bot_color == 'b':
+            self.later(self.think_time(), game.opponent_move)
+
+    def game_over(self, game):
+        self.finished.append(game)
+        for events in list(self.incoming):
+            self.deliver(events, {'type': 'gameFinish', 'game': {'id': game.game_id}})
+
+    def active_games(self):
+        return len(self.challenges) + sum(1 for game in self.played.values()
+                                          if game.status == 'started')
+
+
+def percentile(samples, percent):
+    '''Nearest rank percentile, as Move_Latency.percentile'''
+    samples = sorted(samples)
+    if len(samples) == 0:
+        return 0.0
+    return samples[max((len(samples) * percent + 99) // 100, 1) - 1]
+
+
+async def load_test(lichess, server, num_games, concurrency, clock, increment):
+    '''Plays num_games against server, keeping concurrency of them going at once, and
+    returns the seconds it took'''
+    server_task = asyncio.create_task(server.run())
+    while len(lichess.incoming) == 0: # challenges are only seen once the bot is listening
+        await asyncio.sleep(0.01)
+    start = time.time()
+    # declined challenges are not counted, another is sent in their place
+    while len(lichess.finished) < num_games:
+        while (len(lichess.played) + len(lichess.challenges) < num_games and
+               lichess.active_games() < concurrency):
+            lichess.challenge(clock=clock, increment=increment)
+        await asyncio.sleep(0.05)
+    seconds = time.time() - start
+    server_task.cancel()
+    while len(server.games) > 0: # let the games see the end and stop their searches
+        await asyncio.sleep(0.05)
+    return seconds
+
+
+def report(lichess, seconds, num_workers, latency_log):
+    '''Prints the outcomes, throughput and move latency of a load test'''
+    outcomes = collections.Counter()
+    for game in lichess.finished:
+        if game.winner == None:
+            result = 'draw'
+        elif game.winner == game.bot_color:
+            result = 'win'
+        else:
+            result = 'loss'
+        outcomes[result + ' by ' + game.status] += 1
+    games_per_hour = len(lichess.finished) * 3600 / seconds
+    print('games finished: %d in %.1f seconds, %d challenges declined' %
+          (len(lichess.finished), seconds, lichess.declined))
+    print('outcomes for the bot:', ', '.join('%s %d' % (outcome, count) for outcome, count
+                                             in sorted(outcomes.items())))
+    print('games per hour: %.0f, per core: %.0f' % (games_per_hour, games_per_hour / num_workers))
+
+    spans = collections.defaultdict(list)
+    with open(latency_log) as log:
+        for line in log:
+            record = json.loads(line)
+            for span in ordinary_engine.LATENCY_SPANS:
+                spans[span].append(record[span])
+    print('move latency over %d moves, seconds' % len(spans['total']))
+    print('span         p50      p95      p99      max')
+    for span in ordinary_engine.LATENCY_SPANS:
+        print('%-8s %8.3f %8.3f %8.3f %8.3f' %
+              (span, percentile(spans[span], 50), percentile(spans[span], 95),
+               percentile(spans[span], 99), percentile(spans[span], 100)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the bot against a local lichess')
+    parser.add_argument('--games', type=int, default=20, help='games to play in total')
+    parser.add_argument('--concurrency', type=int, default=4, help='games played at once')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--depth', type=int, default=2)
+    parser.add_argument('--lazy-smp', action='store_true')
+    parser.add_argument('--clock', type=float, default=60, help='seconds a side')
+    parser.add_argument('--increment', type=float, default=1)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every request and event')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='up to this many random seconds on top of the latency')
+    parser.add_argument('--drop-rate', type=float, default=0.0,
+                        help='chance of a stream dropping at each event')
+    parser.add_argument('--max-plies', type=int, default=200,
+                        help='games still going after this many plies are drawn')
+    parser.add_argument('--book', default=None, help='opening book file the bot plays from')
+    parser.add_argument('--verbose', action='store_true', help='show the output of the bot')
+    parser.add_argument('--stats-log', default=None,
+                        help='file the search statistics of every move are appended to')
+    args = parser.parse_args()
+
+    lichess = Mock_Lichess(latency=args.latency, jitter=args.jitter,
+                           drop_rate=args.drop_rate, max_plies=args.max_plies)
+    log_fd, latency_log = tempfile.mkstemp(suffix='.jsonl')
+    os.close(log_fd)
+    search_pool = Search_Pool(args.workers, args.lazy_smp,
+                              channels=min(args.concurrency, args.workers))
+    opening_book = Opening_Book(args.book) if args.book != None else None
+    server = Bot_Server(lichess, lichess.bot_name, search_pool, args.depth, 30, False,
+                        args.concurrency, ['blitz'], latency_log, opening_book, args.stats_log)
+    try:
+        if args.verbose:
+            seconds = asyncio.run(load_test(lichess, server, args.games, args.concurrency,
+                                            args.clock, args.increment))
+        else:
+            with contextlib.redirect_stdout(io.StringIO()):
+                seconds = asyncio.run(load_test(lichess, server, args.games, args.concurrency,
+                                                args.clock, args.increment))
+        report(lichess, seconds, args.workers, latency_log)
+    finally:
+        search_pool.close()
+        if opening_book != None:
+            opening_book.close()
+        os.remove(latency_log)
+
+
+if __name__ == '__main__':
+    main()
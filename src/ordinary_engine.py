@@ -1,18 +1,337 @@
-import berserk
+try:
+    import berserk
+except ImportError: # only needed to play on lichess, not to use the engine itself
+    berserk = None
 import pickle
 import multiprocessing
+import threading
+import queue
+import sys
+import asyncio
+import json
+import collections
+from multiprocessing import shared_memory, connection
 import time as time
 import random
 import datetime
+import os
+import mmap
+import struct
+
+# Game phase weight of each piece type, indexed by type. A full set of non-pawn 
+# material adds up to MAX_PHASE, which is treated as the pure middlegame
+PHASE_VALUES = [0, 0, 4, 1, 1, 0, 2, 0]
+MAX_PHASE = 24
+
+# Ray directions used by static exchange evaluation, orthogonal then diagonal
+ORTHO_DIRS = [(0,1),(0,-1),(1,0),(-1,0)]
+DIAG_DIRS = [(1,1),(1,-1),(-1,1),(-1,-1)]
+KNIGHT_JUMPS = [(1,2),(2,1),(2,-1),(1,-2),(-1,-2),(-2,-1),(-2,1),(-1,2)]
+
+# Zobrist keys. A fixed seed keeps the keys identical in every process, so hashes 
+# can be compared between search processes and across runs.
+zobrist_random = random.Random(2022)
+# indexed by piece type (+ 8 for black), then square (x * 8 + y)
+ZOBRIST_PIECES = [[zobrist_random.getrandbits(64) for sq in range(64)] for i in range(16)]
+ZOBRIST_TURN = zobrist_random.getrandbits(64) # black to move
+ZOBRIST_CASTLE = [zobrist_random.getrandbits(64) for i in range(16)]
+ZOBRIST_EP = [zobrist_random.getrandbits(64) for i in range(8)]
+# Scores in the transposition table are from the engine's point of view, so positions 
+# searched for the black engine are kept apart from ones searched for white
+ZOBRIST_VIEW = {'w': 0, 'b': zobrist_random.getrandbits(64)}
+
+# Castling rights bits: 1 white king side, 2 white queen side, 4 black king side, 
+# 8 black queen side. A move to or from a square ANDs the rights with its mask.
+CASTLE_MASKS = [15] * 64
+CASTLE_MASKS[4 * 8 + 7] = 12 # e1
+CASTLE_MASKS[7 * 8 + 7] = 14 # h1
+CASTLE_MASKS[0 * 8 + 7] = 13 # a1
+CASTLE_MASKS[4 * 8 + 0] = 3  # e8
+CASTLE_MASKS[7 * 8 + 0] = 11 # h8
+CASTLE_MASKS[0 * 8 + 0] = 7  # a8
+
+# transposition table entries are [depth, score, flag, move]
+TT_EXACT = 0
+TT_LOWER = 1 # score is a lower bound, the search failed high
+TT_UPPER = 2 # score is an upper bound, the search failed low
+TT_MAX_ENTRIES = 500000
+# A mate scores 1000000 less its plies from the root of the search, a bitbase win 
+# BITBASE_WIN less them. Scores past TT_MATE_BOUND are stored as plies from the node 
+# instead, so they stay right when the entry is found at another ply or in a later search.
+TT_MATE_BOUND = 800000
+
+# nodes searched between checks of the stop flag
+STOP_CHECK_NODES = 16
+
+# states of a position returned by Chess_Board.terminal_state
+GAME_ONGOING = 0
+GAME_CHECKMATE = 1
+GAME_STALEMATE = 2
+
+# Opening book records, sorted by key: the Zobrist key of the position (book_key), the
+# move and its weight, as in a Polyglot book, and 32 bits that are not used. The keys
+# are the engine's own, not Polyglot's, so Polyglot books cannot be read directly.
+# A move is to file | to row << 3 | from file << 6 | from row << 9 | promotion << 12,
+# rows counted from white's side and promotion 0 none, 1 knight, 2 bishop, 3 rook, 4 queen.
+BOOK_RECORD = struct.Struct('>QHHI')
+BOOK_KEY = struct.Struct('>Q')
+BOOK_PROMOTIONS = [0, 3, 4, 6, 2] # piece type of each promotion code
+BOOK_PATH = '../res/book.bin'
+
+# The lines res/book.bin is built from, see book_from_lines
+BOOK_LINES = ['e2e4 c7c5 g1f3 d7d6 b1c3', # sicilian
+              'e2e4 e7e5 g1f3 b8c6 f1c4 f8c5 e1g1 g8f6 f1e1', # 4 knights, bishop doesnt pin
+              'e2e4 e7e5 g1f3 b8c6 f1b5 g8f6 d2d3 f8c5 c2c3 e8g8 e1g1', # bishop pins
+              'e2e4 c7c6 d2d4 d7d5 e4d5 c6d5 f1d3 b8c6 c2c3 g8f6 c1f4', # karo kan
+              'd2d4 d7d5 c2c4 d5c4 e2e4 e7e6 f1c4 g8f6 e4e5 f6d5 b1c3', # queens gambit accepted
+              'd2d4 d7d5 c2c4 e7e6 b1c3 g8f6 c4d5 e6d5 c1g5', # declined, take with pawn
+              'd2d4 d7d5 c2c4 e7e6 b1c3 g8f6 c4d5 f6d5 g1f3', # declined, take with knight
+              'd2d4 d7d5 c2c4 c7c6 g1f3 g8f6 b1c3'] # slav
+
+
+def can_take_en_passant(chess_board):
+    '''True if the pawn that just moved two squares can be taken en passant.
+    chess_board.ep_file is set after every double pawn move, whether or not it can.'''
+    if chess_board.ep_file == -1:
+        return False
+    x = chess_board.ep_file
+    y, color = (3, 'w') if chess_board.turn else (4, 'b') # where the pawn landed
+    for x2 in (x - 1, x + 1):
+        if (0 <= x2 < 8 and chess_board.board[x2][y].type == 5 and
+            chess_board.board[x2][y].color == color):
+            return True
+    return False
+
+
+def book_key(chess_board):
+    '''The position's key in the opening book. chess_board.hash includes the en passant
+    file after every double pawn move, the book key only when the pawn can be taken,
+    so 1. d4 d5 2. c4 and 1. c4 d5 2. d4 have the same key.'''
+    key = chess_board.hash
+    if chess_board.ep_file != -1 and not can_take_en_passant(chess_board):
+        key ^= ZOBRIST_EP[chess_board.ep_file]
+    return key
+
+
+def encode_book_move(x1, y1, x2, y2, promote_type=None):
+    promotion = BOOK_PROMOTIONS.index(promote_type) if promote_type != None else 0
+    return x2 | (7 - y2) << 3 | x1 << 6 | (7 - y1) << 9 | promotion << 12
+
+
+def decode_book_move(code):
+    '''Returns the move in the engine's form and the type of piece it promotes to'''
+    return ([(code >> 6) & 7, 7 - ((code >> 9) & 7), ' ', code & 7, 7 - ((code >> 3) & 7)],
+            BOOK_PROMOTIONS[(code >> 12) & 7] or 2)
+
+
+def book_from_lines(lines):
+    '''Weights of the moves of lines, a list of games in the lichess form ex. 'e2e4 e7e5',
+    as a dict of (key, move) -> weight, each line counting 1 for each of its moves'''
+    weights = {}
+    for line in lines:
+        chess_board = Chess_Board()
+        for uci in line.split():
+            x1, y1, x2, y2 = ord(uci[0]) - 97, 8 - int(uci[1]), ord(uci[2]) - 97, 8 - int(uci[3])
+            promote_type = BOOK_PROMOTIONS[' nbrq'.index(uci[4])] if len(uci) > 4 else None
+            entry = (book_key(chess_board), encode_book_move(x1, y1, x2, y2, promote_type))
+            weights[entry] = weights.get(entry, 0) + 1
+            if not chess_board.provisional_move(x1, y1, x2, y2, promote_type or 2):
+                raise ValueError('Illegal move in book line: ' + uci)
+    return weights
+
+
+def write_book(path, weights):
+    '''Writes weights, a dict of (key, move) -> weight, as a book file. Weights over
+    what fits in 16 bits are capped.'''
+    with open(path, 'wb') as book:
+        for key, move in sorted(weights):
+            book.write(BOOK_RECORD.pack(key, move, min(weights[(key, move)], 0xFFFF), 0))
+
+
+class Opening_Book:
+
+    '''Book file of sorted BOOK_RECORDs, memory mapped so only the pages that are looked
+    up are read, and searched with a binary search on the key. Opened once and shared
+    by every game, Chess_Board does not load it.'''
+
+    def __init__(self, path=BOOK_PATH):
+        self.file = open(path, 'rb')
+        self.num_records = os.path.getsize(path) // BOOK_RECORD.size
+        if self.num_records > 0:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else: # an empty file cannot be mapped
+            self.data = b''
+
+    def find(self, key):
+        '''Index of the first record with key, or where it would be'''
+        low = 0
+        high = self.num_records
+        while low < high:
+            mid = (low + high) // 2
+            if BOOK_KEY.unpack_from(self.data, mid * BOOK_RECORD.size)[0] < key:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def entries(self, key):
+        '''[(move, promote_type, weight)] of the book for the position with key'''
+        entries = []
+        i = self.find(key)
+        while i < self.num_records:
+            record_key, code, weight, learn = BOOK_RECORD.unpack_from(self.data,
+                                                                      i * BOOK_RECORD.size)
+            if record_key != key:
+                break
+            entries.append(decode_book_move(code) + (weight,))
+            i += 1
+        return entries
+
+    def choose(self, chess_board):
+        '''A move for the side to move on chess_board picked at random in proportion to
+        the weights, or None if the position is not in the book. Moves are checked to be
+        legal, as two positions can share a key.'''
+        legal = []
+        for move, promote_type, weight in self.entries(book_key(chess_board)):
+            if weight > 0 and chess_board.provisional_move(move[0], move[1], move[3], move[4],
+                                                           promote_type):
+                chess_board.undo_move()
+                legal.append((move, weight))
+        if len(legal) == 0:
+            return None
+        return random.choices([move for move, weight in legal],
+                              [weight for move, weight in legal])[0]
+
+    def close(self):
+        if self.num_records > 0:
+            self.data.close()
+        self.file.close()
+
+
+# Endgame bitbases, built by build_bitbase.py. Each table is a file of one byte per
+# position of a set of material, named as ex. KRvKP with white's pieces before the v.
+# A byte is 0 for a draw, otherwise the plies to mate + 1, so odd for the side to move
+# being mated and even for it mating.
+BITBASE_DIR = '../res/bitbases'
+BITBASE_MAX_PIECES = 4
+BITBASE_WIN = 900000 # below a mate found by the search, above any evaluation
+BITBASE_ORDER = 'KQRBNP' # order of the pieces of a side in a table's name
+BITBASE_LETTERS = {1: 'K', 2: 'Q', 6: 'R', 4: 'B', 3: 'N', 5: 'P'}
+
+
+def bitbase_symmetry(x, y, t):
+    '''Square x, y mirrored by t, bit 1 flipping the files, bit 2 the ranks and bit 4
+    the a1-h8 diagonal'''
+    if t & 1:
+        x = 7 - x
+    if t & 2:
+        y = 7 - y
+    if t & 4:
+        x, y = 7 - y, 7 - x
+    return x * 8 + y
+
+# Squares are x * 8 + y as for ZOBRIST_PIECES. Tables without pawns are mirrored so the
+# white king is in the triangle a1-d1-d4, tables with pawns only across the files so it
+# is on files a to d.
+BITBASE_SYMMETRIES = [[bitbase_symmetry(sq >> 3, sq & 7, t) for sq in range(64)] 
+                      for t in range(8)]
+BITBASE_TRIANGLE = [sq for sq in range(64) if sq >> 3 <= 3 and sq & 7 >= 4 and 
+                    (sq >> 3) + (sq & 7) >= 7]
+BITBASE_HALF = list(range(32))
+# the mirrors that put a white king on each square in the triangle, 2 for the diagonal
+BITBASE_TRIANGLE_MIRRORS = [[t for t in range(8) if BITBASE_SYMMETRIES[t][sq] in BITBASE_TRIANGLE]
+                            for sq in range(64)]
+
+
+def bitbase_index(squares, stm, pawns):
+    '''Index in a table of the position with pieces on squares, in the order of the
+    table's name, and stm 0 for white to move or 1 for black. Positions that mirror 
+    into each other have the same index.'''
+    if pawns:
+        if squares[0] >> 3 > 3:
+            squares = [sq ^ 56 for sq in squares] # x = 7 - x
+        index = stm * 32 + squares[0]
+        for sq in squares[1:]:
+            index = index * 64 + sq
+        return index
+    best = None
+    for t in BITBASE_TRIANGLE_MIRRORS[squares[0]]:
+        mirror = BITBASE_SYMMETRIES[t]
+        index = stm * 10 + BITBASE_TRIANGLE.index(mirror[squares[0]])
+        for sq in squares[1:]:
+            index = index * 64 + mirror[sq]
+        if best == None or index < best:
+            best = index
+    return best
+
+
+def bitbase_size(num_pieces, pawns):
+    return 2 * (32 if pawns else 10) * 64 ** (num_pieces - 1)
+
+
+class Bitbases:
+
+    '''The tables in path, each memory mapped the first time a position with its
+    material is probed. Missing tables are simply not probed.'''
+
+    def __init__(self, path=BITBASE_DIR):
+        self.path = path
+        self.tables = {} # name: mmap, or None if there is no table for it
+
+    def table(self, name):
+        if name not in self.tables:
+            self.tables[name] = None
+            try:
+                with open(os.path.join(self.path, name + '.bin'), 'rb') as file:
+                    self.tables[name] = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                pass
+        return self.tables[name]
+
+    def probe_pieces(self, pieces, stm):
+        '''pieces is a list of (color, type, square), stm the color to move. Returns
+        (result, plies), result being 1 if the side to move mates in plies, -1 if it is
+        mated in plies and 0 for a draw, or None if there is no table for the material.'''
+        white = sorted([piece for piece in pieces if piece[0] == 'w'],
+                       key=lambda piece: BITBASE_ORDER.index(BITBASE_LETTERS[piece[1]]))
+        black = sorted([piece for piece in pieces if piece[0] == 'b'],
+                       key=lambda piece: BITBASE_ORDER.index(BITBASE_LETTERS[piece[1]]))
+        white_name = ''.join(BITBASE_LETTERS[piece[1]] for piece in white)
+        black_name = ''.join(BITBASE_LETTERS[piece[1]] for piece in black)
+        table = self.table(white_name + 'v' + black_name)
+        if table != None:
+            squares = [piece[2] for piece in white + black]
+            stm = 0 if stm == 'w' else 1
+        else: # the same table with the colors swapped and the board turned around
+            table = self.table(black_name + 'v' + white_name)
+            if table == None:
+                return None
+            squares = [piece[2] ^ 7 for piece in black + white] # y = 7 - y
+            stm = 1 if stm == 'w' else 0
+        value = table[bitbase_index(squares, stm, 'P' in white_name + black_name)]
+        if value == 0:
+            return 0, 0
+        return (1 if value % 2 == 0 else -1), value - 1
+
+    def probe(self, chess_board):
+        '''probe_pieces for the position on chess_board, None if it has too many pieces
+        or castling rights or an en passant capture, which the tables leave out'''
+        if (chess_board.num_pieces > BITBASE_MAX_PIECES or chess_board.castle_rights != 0 or
+            can_take_en_passant(chess_board)):
+            return None
+        pieces = []
+        for x in range(8):
+            for y in range(8):
+                piece = chess_board.board[x][y]
+                if piece.type != 7:
+                    pieces.append((piece.color, piece.type, x * 8 + y))
+        return self.probe_pieces(pieces, 'w' if chess_board.turn else 'b')
 
-class Node(): 
-
-    def __init__(self, data):
-        self.data = data
-        self.children = []
-    
-    def add_child(self, child):
-        self.children.append(child)
+    def close(self):
+        for table in self.tables.values():
+            if table != None:
+                table.close()
+        self.tables = {}
 
 
 class Piece:
@@ -501,146 +820,40 @@ class Chess_Board:
                                  [-30,-30,-10,-10,-10,-10,-20,-40],
                                  [-50,-30,-30,-30,-30,-30,-30,-50]]
 
+        # piece square tables indexed by piece type, kings are handled separately 
+        # in evaluate as they are tapered between the middlegame and endgame tables
+        self.w_tables = [None, None, self.w_queen_table, self.w_knight_table, self.w_bishop_table,
+                         self.w_pawn_table, self.w_rook_table]
+        self.b_tables = [None, None, self.b_queen_table, self.b_knight_table, self.b_bishop_table,
+                         self.b_pawn_table, self.b_rook_table]
+
         self.move_num = 0
         self.turn = True
         self.undo_list = [] 
-        self.opening_book = None
-        self.init_opening_book()
-
-    def init_opening_book(self):
-        e2e4 = Node([4,6,' ',4,4])
-
-        e7e5 = Node([4,1,' ',4,3]) # bishop doesnt pin
-        g1f3 = Node([6,7,' ',5,5])
-        b8c6 = Node([1,0,' ',2,2])
-        f1c4 = Node([5,7,' ',2,4])
-        f8c5 = Node([5,0,' ',2,3])
-        e1g1 = Node([4,7,' ',6,7])
-        g8f6 = Node([6,0,' ',5,2])
-        f1e1 = Node([5,7,' ',4,7])
-
-        f1b5 = Node([5,7,' ',1,3]) # bishop pins
-        g8f6_5 = Node([6,0,' ',5,2])
-        d2d3 = Node([3,6,' ',3,5])
-        f8c5_2 = Node([5,0,' ',2,3])
-        c2c3 = Node([2,6,' ',2,5])
-        e8g8 = Node([4,0,' ',6,0])
-        e1g1_2 = Node([4,7,' ',6,7])
-
-        c7c6 = Node([2,1,' ',2,2]) # karo kan
-        d2d4 = Node([3,6,' ',3,4])
-        d7d5 = Node([3,1,' ',3,3])
-        e4d5 = Node([4,4,' ',3,3])
-        c6d5 = Node([2,2,' ',3,3])
-        f1d3 = Node([5,7,' ',3,5])
-        b8c6_2 = Node([1,0,' ',2,2])
-        c2c3_2 = Node([2,6,' ',2,5])
-        g8f6_2 = Node([6,0,' ',5,2])
-        c1f4 = Node([2,7,' ',5,4])
-
-        d2d4_2 = Node([3,6,' ',3,4])  # queens gambit
-        d7d5_2 = Node([3,1,' ',3,3])
-        c2c4 = Node([2,6,' ',2,4])
-
-        d5c4 = Node([3,3,' ',2,4]) # queens gambit accepted
-        e2e4_2 = Node([4,6,' ',4,4])
-        e7e6 = Node([4,1,' ',4,2])
-        f1c4_2 = Node([5,7,' ',2,4])
-
-        g8f6_3 = Node([6,0,' ',5,2]) # queens gambit accepted with knight
-        e4e5 = Node([4,4,' ',4,3])
-        f6d5 = Node([5,2,' ',3,3])
-        b1c3_2 = Node([1,7,' ',2,5])
-
-        c7c6_2 = Node([2,1,' ',2,2]) # slav
-        g1f3_4 = Node([6,7,' ',5,5])
-        g8f6_6 = Node([6,0,' ',5,2])
-        b1c3_4 = Node([1,7,' ',2,5])
-
-        e7e6_2 = Node([4,1,' ',4,2]) # declined
-        b1c3 = Node([1,7,' ',2,5])
-        g8f6_4 = Node([6,0,' ',5,2])
-        c4d5 = Node([2,4,' ',3,3])
-
-        e6d5 = Node([4,2,' ',3,3]) # take with pawn
-        c1g5 = Node([2,7,' ',6,3])
-
-        f6d5_2 = Node([5,2,' ',3,3]) # take with knight
-        g1f3_2 = Node([6,7,' ',5,5])
-
-        c7c5 = Node([2,1,' ',2,3]) # sicilian
-        g1f3_3 = Node([6,7,' ',5,5])
-        d7d6 = Node([3,1,' ',3,2])
-        b1c3_3 = Node([1,7,' ',2,5])
-
-        e2e4.add_child(c7c5) # sicilian
-        c7c5.add_child(g1f3_3) 
-        g1f3_3.add_child(d7d6)
-        d7d6.add_child(b1c3_3)
-
-        d2d4.add_child(d7d5_2) # queens gambit accepted
-        d7d5_2.add_child(c2c4)
-        c2c4.add_child(d5c4)
-        d5c4.add_child(e2e4_2)
-        e2e4_2.add_child(e7e6)
-        e7e6.add_child(f1c4_2)
-        f1c4_2.add_child(g8f6_3)
-        g8f6_3.add_child(e4e5)
-        e4e5.add_child(f6d5)
-        f6d5.add_child(b1c3_2)
-
-        c2c4.add_child(e7e6_2) # queens gambit declined
-        e7e6_2.add_child(b1c3)
-        b1c3.add_child(g8f6_4)
-        g8f6_4.add_child(c4d5)
-
-        c4d5.add_child(e6d5) # take back with pawn
-        e6d5.add_child(c1g5)
-
-        c4d5.add_child(f6d5_2) # take back with knight
-        f6d5_2.add_child(g1f3_2)
-
-        c2c4.add_child(c7c6_2) # slav
-        c7c6_2.add_child(g1f3_4)
-        g1f3_4.add_child(g8f6_6)
-        g8f6_6.add_child(b1c3_4)
-
-        e2e4.add_child(e7e5) # 4 knights 
-        e7e5.add_child(g1f3)
-        g1f3.add_child(b8c6)
-        b8c6.add_child(f1c4)
-        f1c4.add_child(f8c5)
-        f8c5.add_child(e1g1)
-        e1g1.add_child(g8f6)
-        g8f6.add_child(f1e1)
-
-        b8c6.add_child(f1b5) # 4 knights bishop pin
-        f1b5.add_child(g8f6_5)
-        g8f6_5.add_child(d2d3)
-        d2d3.add_child(f8c5_2)
-        f8c5_2.add_child(c2c3)
-        c2c3.add_child(e8g8)
-        e8g8.add_child(e1g1_2)
-
-        e2e4.add_child(c7c6) # karo kan
-        c7c6.add_child(d2d4_2)
-        d2d4_2.add_child(d7d5)
-        d7d5.add_child(e4d5)
-        e4d5.add_child(c6d5)
-        c6d5.add_child(f1d3)
-        f1d3.add_child(b8c6_2)
-        b8c6_2.add_child(c2c3_2)
-        c2c3_2.add_child(g8f6_2)
-        g8f6_2.add_child(c1f4)
-
-        self.opening_book = Node(0)
-        self.opening_book.add_child(e2e4)
-        self.opening_book.add_child(d2d4)
-
-    def provisional_move(self, x1, y1, x2, y2):
+        self.phase = self.calc_phase()
+        self.num_pieces = self.count_pieces()
+        self.halfmove_clock = 0 # plies since the last capture or pawn move
+        self.hash_history = [] # hash before each move made, popped by partial_undo
+        self.castle_rights = 15
+        self.ep_file = -1 # file of a pawn that just moved two squares
+        self.hash = self.calc_hash()
+        self.tt = {} # transposition table, hash -> [depth, score, flag, move]
+        self.history = [0] * 4096 # history heuristic, indexed by from and to square
+        self.history_lock = None # set when the history table is shared between threads
+        self.shared_tt = None # Shared_TT used instead of self.tt when searching in a Search_Pool
+        self.stop = None # shared flag that aborts the search when set
+        self.nodes = 0 # nodes searched, counted for polling self.stop
+        self.bitbases = None # Bitbases probed once few enough pieces are left
+        self.terminal_states = {} # hash -> GAME_ONGOING, GAME_CHECKMATE or GAME_STALEMATE
+        self.stats = Search_Stats() # what the searches of this board did
+
+    def provisional_move(self, x1, y1, x2, y2, promote_type=2, trusted=False):
         '''Portion of making a move that does not check for game 
         ending board states like checkmate and stalemate. Done to prevent 
-        recursion when checking for checkmate and stalemate'''
+        recursion when checking for checkmate and stalemate. A pawn reaching 
+        the last rank becomes a piece of promote_type, a queen by default. 
+        trusted moves are known to be legal, such as moves replayed from lichess, 
+        so the piece's move rules and the king being left in check are not checked.'''
         piece = self.board[x1][y1]
         target = self.board[x2][y2]
 
@@ -651,7 +864,7 @@ class Chess_Board:
 
         if piece.type == 7: 
             return False
-        if not piece.valid_move(target, self.board, self.move_num):
+        if not trusted and not piece.valid_move(target, self.board, self.move_num):
             return False
         
         # used in castling to store empty square the king moves to
@@ -702,7 +915,18 @@ class Chess_Board:
         # loops that use provisional_move
         prev_piece = pickle.loads(pickle.dumps(piece))
         prev_target = pickle.loads(pickle.dumps(target))
-        self.undo_list.append([prev_piece, prev_target, prev_special_piece, prev_special_target])
+        self.undo_list.append([prev_piece, prev_target, prev_special_piece, prev_special_target, 
+                               self.phase, self.hash, self.castle_rights, self.ep_file,
+                               self.num_pieces, self.halfmove_clock])
+        self.hash_history.append(self.hash)
+        self.phase -= PHASE_VALUES[target.type]
+        capture = target.type != 7 or (prev_special_target != None and not castling)
+        if capture:
+            self.num_pieces -= 1
+        if capture or piece.type == 5: # the position can never be repeated
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
         if moving_double:
             piece.has_moved_double = True
             piece.double_move_num = self.move_num
@@ -714,20 +938,45 @@ class Chess_Board:
         piece.y = target.y
         self.board[target.x][target.y] = piece
 
-        if piece.color == 'w':
-            king = self.get_white_king()
-        else:
-            king = self.get_black_king()
-        if king.in_check(self.board, self.move_num):
-            self.partial_undo() 
-            return False
+        if not trusted:
+            if piece.color == 'w':
+                king = self.get_white_king()
+            else:
+                king = self.get_black_king()
+            if king.in_check(self.board, self.move_num):
+                self.partial_undo() 
+                return False
 
-        self.check_promote(piece)     
+        self.check_promote(piece, promote_type)
         piece.moved = True
+        self.update_hash(moving_double)
         self.move_num += 1
         self.turn = not self.turn
         return True
 
+    def update_hash(self, moving_double):
+        '''Updates the hash for the move just made from the pieces saved in the undo list. 
+        Every square the move touched has its previous piece removed from the hash, 
+        and whatever is on the square now added.'''
+        entry = self.undo_list[-1]
+        h = self.hash ^ ZOBRIST_TURN
+        for prev in entry[0:4]:
+            if prev != None:
+                h ^= piece_key(prev) ^ piece_key(self.board[prev.x][prev.y])
+        prev_piece = entry[0]
+        prev_target = entry[1]
+        rights = (self.castle_rights & CASTLE_MASKS[prev_piece.x * 8 + prev_piece.y] 
+                  & CASTLE_MASKS[prev_target.x * 8 + prev_target.y])
+        h ^= ZOBRIST_CASTLE[self.castle_rights] ^ ZOBRIST_CASTLE[rights]
+        self.castle_rights = rights
+        if self.ep_file != -1:
+            h ^= ZOBRIST_EP[self.ep_file]
+        self.ep_file = -1
+        if moving_double:
+            self.ep_file = prev_target.x
+            h ^= ZOBRIST_EP[self.ep_file]
+        self.hash = h
+
     def make_move(self, x1, y1, x2 ,y2):
         '''Move method that checks for checkmate and stalemate'''
         global game_over
@@ -739,10 +988,11 @@ class Chess_Board:
             else:
                 opp_color = 'w'
                 print_color = 'Black'
-            if self.in_checkmate(opp_color):
+            state = self.terminal_state(opp_color)
+            if state == GAME_CHECKMATE:
                 print(print_color,'Wins!')
                 game_over = True
-            if self.in_stalemate(opp_color):
+            elif state == GAME_STALEMATE:
                 print('Draw by stalemate')
                 game_over = True
             return True
@@ -750,17 +1000,24 @@ class Chess_Board:
 
     def partial_undo(self):
         '''Undo that does not revert move_num or player turn'''
-        prev_piece = self.undo_list[self.move_num][0]
-        prev_target = self.undo_list[self.move_num][1]
-        prev_special_piece = self.undo_list[self.move_num][2]
-        prev_special_target = self.undo_list[self.move_num][3]
+        entry = self.undo_list.pop()
+        prev_piece = entry[0]
+        prev_target = entry[1]
+        prev_special_piece = entry[2]
+        prev_special_target = entry[3]
         self.board[prev_piece.x][prev_piece.y] = prev_piece
         self.board[prev_target.x][prev_target.y] = prev_target
         if prev_special_piece != None:
             self.board[prev_special_piece.x][prev_special_piece.y] = prev_special_piece
         if prev_special_target != None:
             self.board[prev_special_target.x][prev_special_target.y] = prev_special_target
-        del self.undo_list[self.move_num]
+        self.phase = entry[4]
+        self.hash = entry[5]
+        self.castle_rights = entry[6]
+        self.ep_file = entry[7]
+        self.num_pieces = entry[8]
+        self.halfmove_clock = entry[9]
+        self.hash_history.pop()
 
     def get_white_king(self):
         for x in range(8):
@@ -774,73 +1031,389 @@ class Chess_Board:
                 if self.board[x][y].type == 1 and self.board[x][y].color == 'b':
                     return self.board[x][y]
 
+    def calc_phase(self):
+        '''Game phase from the non-pawn material on the board, MAX_PHASE being the 
+        starting material. Only used to initialise self.phase, which is then kept up 
+        to date by provisional_move and partial_undo'''
+        phase = 0
+        for x in range(8):
+            for y in range(8):
+                phase += PHASE_VALUES[self.board[x][y].type]
+        return phase
+
+    def calc_hash(self):
+        '''Zobrist hash of the position from scratch. Only used when a position is 
+        set up, provisional_move and partial_undo keep self.hash up to date.'''
+        h = 0
+        for x in range(8):
+            for y in range(8):
+                h ^= piece_key(self.board[x][y])
+        if not self.turn:
+            h ^= ZOBRIST_TURN
+        h ^= ZOBRIST_CASTLE[self.castle_rights]
+        if self.ep_file != -1:
+            h ^= ZOBRIST_EP[self.ep_file]
+        return h
+
+    def load_fen(self, fen, history=()):
+        '''Sets the board up from a FEN string. The move history is lost, so the 
+        position cannot be undone past this point. history is the hashes of the 
+        positions that came before it, see repetition_history, so repetitions of 
+        them are still seen.'''
+        fields = fen.split()
+        types = {'k': (King, 1), 'q': (Queen, 2), 'n': (Knight, 3), 
+                 'b': (Bishop, 4), 'p': (Pawn, 5), 'r': (Rook, 6)}
+        for y, row in enumerate(fields[0].split('/')):
+            x = 0
+            for letter in row:
+                if letter.isdigit():
+                    for i in range(int(letter)):
+                        self.board[x][y] = Piece('N', x, y, 7)
+                        x += 1
+                else:
+                    piece_class, type = types[letter.lower()]
+                    piece = piece_class('w' if letter.isupper() else 'b', x, y, type)
+                    # castling rights are given back below, every other piece counts 
+                    # as moved unless it is a pawn on its starting rank
+                    piece.moved = not (type == 5 and y == (6 if piece.color == 'w' else 1))
+                    self.board[x][y] = piece
+                    x += 1
+
+        self.turn = len(fields) < 2 or fields[1] == 'w'
+        self.castle_rights = 0
+        castling = fields[2] if len(fields) > 2 else '-'
+        for letter, bit, king_x, king_y, rook_x in (('K', 1, 4, 7, 7), ('Q', 2, 4, 7, 0), 
+                                                      ('k', 4, 4, 0, 7), ('q', 8, 4, 0, 0)):
+            king = self.board[king_x][king_y]
+            rook = self.board[rook_x][king_y]
+            if letter in castling and king.type == 1 and rook.type == 6:
+                king.moved = False
+                rook.moved = False
+                self.castle_rights |= bit
+
+        self.halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+        full_moves = int(fields[5]) if len(fields) > 5 else 1
+        self.move_num = (full_moves - 1) * 2 + (0 if self.turn else 1)
+        self.ep_file = -1
+        if len(fields) > 3 and fields[3] != '-':
+            x = ord(fields[3][0]) - 97
+            y = 3 if self.turn else 4 # square of the pawn that moved two squares
+            pawn = self.board[x][y]
+            if pawn.type == 5:
+                pawn.has_moved_double = True
+                pawn.double_move_num = self.move_num - 1
+                self.ep_file = x
+
+        self.undo_list = []
+        self.hash_history = list(history)
+        self.phase = self.calc_phase()
+        self.num_pieces = self.count_pieces()
+        self.hash = self.calc_hash()
+
+    def get_fen(self):
+        '''FEN string of the current position'''
+        letters = ['', 'k', 'q', 'n', 'b', 'p', 'r']
+        rows = []
+        for y in range(8):
+            row = ''
+            empty = 0
+            for x in range(8):
+                cur = self.board[x][y]
+                if cur.type == 7:
+                    empty += 1
+                    continue
+                if empty > 0:
+                    row += str(empty)
+                    empty = 0
+                row += letters[cur.type].upper() if cur.color == 'w' else letters[cur.type]
+            if empty > 0:
+                row += str(empty)
+            rows.append(row)
+        castling = ''
+        for letter, bit in (('K', 1), ('Q', 2), ('k', 4), ('q', 8)):
+            if self.castle_rights & bit:
+                castling += letter
+        ep = '-'
+        if self.ep_file != -1:
+            ep = chr(self.ep_file + 97) + ('6' if self.turn else '3')
+        return ' '.join(['/'.join(rows), 'w' if self.turn else 'b', castling or '-', ep, 
+                         str(self.halfmove_clock), str(self.move_num // 2 + 1)])
+
+    def repetition_history(self):
+        '''Hashes of the positions since the last capture or pawn move, the only ones 
+        the current position or any after it can repeat'''
+        return self.hash_history[max(len(self.hash_history) - self.halfmove_clock, 0):]
+
+    def is_draw(self):
+        '''True if the position is a draw by the fifty move rule, by insufficient 
+        material, a lone minor piece or less, or by repeating an earlier position. 
+        The search scores a position repeated once as a draw, as whatever was played 
+        from it the first time can be played again.'''
+        if self.halfmove_clock >= 100:
+            return True
+        if self.num_pieces == 2 or (self.num_pieces == 3 and self.phase == 1):
+            return True
+        # positions with the same side to move, back to the last capture or pawn move
+        i = len(self.hash_history) - 4
+        stop = max(len(self.hash_history) - self.halfmove_clock, 0)
+        while i >= stop:
+            if self.hash_history[i] == self.hash:
+                return True
+            i -= 2
+        return False
+
     def in_checkmate(self, color):
-        if color == 'w':
-            king = self.get_white_king()
-        else:
-            king = self.get_black_king()
-        if not king.in_check(self.board, self.move_num):
-            return False
-        for x1 in range(8):
-            for y1 in range(8):
-                cur = self.board[x1][y1]
-                if cur.color == color:
-                    for x2 in range(8):
-                        for y2 in range(8):
-                            if self.provisional_move(x1,y1,x2,y2):
-                                self.undo_move()
-                                return False
-        return True
+        return self.terminal_state(color) == GAME_CHECKMATE
 
     def in_stalemate(self, color):
-        if color == 'w':
-            king = self.get_white_king()
+        return self.terminal_state(color) == GAME_STALEMATE
+
+    def terminal_state(self, color):
+        '''GAME_CHECKMATE or GAME_STALEMATE if color, the side to move, has no legal 
+        moves, otherwise GAME_ONGOING. Found in one pass of has_legal_move, the king 
+        is only looked at once there are no moves, and kept by hash so each position 
+        is only worked out once.'''
+        key = self.hash ^ ZOBRIST_VIEW[color]
+        state = self.terminal_states.get(key)
+        self.stats.terminal_probes += 1
+        if state != None:
+            self.stats.terminal_hits += 1
+            return state
+        if self.has_legal_move(color):
+            state = GAME_ONGOING
         else:
-            king = self.get_black_king()
-        if king.in_check(self.board, self.move_num):
-            return False
+            if color == 'w':
+                king = self.get_white_king()
+            else:
+                king = self.get_black_king()
+            if king.in_check(self.board, self.move_num):
+                state = GAME_CHECKMATE
+            else:
+                state = GAME_STALEMATE
+        if len(self.terminal_states) >= TT_MAX_ENTRIES:
+            self.terminal_states.clear()
+        self.terminal_states[key] = state
+        return state
+
+    def has_legal_move(self, color):
+        '''True as soon as legal_moves finds a move for color'''
+        for move in self.legal_moves(color):
+            return True
+        return False
+
+    def attackers(self, x, y, color):
+        '''Pieces of color's opponent attacking the square x, y, found by looking out 
+        from the square, like see, instead of asking every piece on the board'''
+        board = self.board
+        found = []
+        for dirs, slider in ((ORTHO_DIRS, 6), (DIAG_DIRS, 4)):
+            for dx, dy in dirs:
+                x2 = x + dx
+                y2 = y + dy
+                while 0 <= x2 < 8 and 0 <= y2 < 8:
+                    cur = board[x2][y2]
+                    if cur.type != 7:
+                        if cur.color != color and (cur.type == slider or cur.type == 2 or
+                            (cur.type == 1 and abs(x2 - x) <= 1 and abs(y2 - y) <= 1)):
+                            found.append(cur)
+                        break
+                    x2 += dx
+                    y2 += dy
+        for dx, dy in KNIGHT_JUMPS:
+            if 0 <= x + dx < 8 and 0 <= y + dy < 8:
+                cur = board[x + dx][y + dy]
+                if cur.type == 3 and cur.color != color and cur.color != 'N':
+                    found.append(cur)
+        # pawns capture towards the opponent, so an attacking pawn is a rank behind
+        dy = -1 if color == 'w' else 1
+        if 0 <= y + dy < 8:
+            for dx in (-1, 1):
+                if 0 <= x + dx < 8:
+                    cur = board[x + dx][y + dy]
+                    if cur.type == 5 and cur.color != color and cur.color != 'N':
+                        found.append(cur)
+        return found
+
+    def legal_moves(self, color):
+        '''Yields the legal moves of color, the side to move, as (x1, y1, x2, y2). 
+        The checkers and the pinned pieces, with the squares along their pin they 
+        can still move to, are worked out once, so apart from en passant no move is 
+        made to see whether it leaves the king in check. In check, only king moves, 
+        captures of a single checker and blocks of a sliding checker are tried, and 
+        against a double check only king moves.'''
+        board = self.board
+        king = self.get_white_king() if color == 'w' else self.get_black_king()
+        checkers = self.attackers(king.x, king.y, color)
+
+        # the king is taken off the board while its squares are looked at, so a 
+        # slider checking it along a line still covers the square behind it
+        king_moves = []
+        board[king.x][king.y] = Piece('N', king.x, king.y, 7)
+        for dx, dy in ORTHO_DIRS + DIAG_DIRS:
+            x2 = king.x + dx
+            y2 = king.y + dy
+            if (0 <= x2 < 8 and 0 <= y2 < 8 and board[x2][y2].color != color and 
+                len(self.attackers(x2, y2, color)) == 0):
+                king_moves.append((king.x, king.y, x2, y2))
+        board[king.x][king.y] = king
+        if len(checkers) == 0 and not king.moved:
+            for x2 in (king.x - 2, king.x + 2):
+                if 0 <= x2 < 8 and king.valid_move(board[x2][king.y], board, self.move_num):
+                    king_moves.append((king.x, king.y, x2, king.y))
+        for move in king_moves:
+            yield move
+        if len(checkers) > 1:
+            return
+
+        blocks = None # squares a move has to go to when in check
+        en_passant = None
+        if len(checkers) == 1:
+            checker = checkers[0]
+            blocks = {(checker.x, checker.y)}
+            if checker.type in (2, 4, 6):
+                blocks.update(self.squares_between(king, checker))
+            elif checker.type == 5 and checker.has_moved_double:
+                # the checking pawn can also be taken from behind it, by en passant
+                en_passant = (checker.x, checker.y + (1 if checker.color == 'w' else -1))
+
+        # a piece between the king and an opposing slider can only move along the line
+        pins = {}
+        for dirs, slider in ((ORTHO_DIRS, 6), (DIAG_DIRS, 4)):
+            for dx, dy in dirs:
+                line = []
+                pinned = None
+                x = king.x + dx
+                y = king.y + dy
+                while 0 <= x < 8 and 0 <= y < 8:
+                    line.append((x, y))
+                    cur = board[x][y]
+                    if cur.type != 7:
+                        if pinned == None and cur.color == color:
+                            pinned = cur
+                        else:
+                            if (pinned != None and cur.color != color and 
+                                (cur.type == slider or cur.type == 2)):
+                                pins[(pinned.x, pinned.y)] = set(line)
+                            break
+                    x += dx
+                    y += dy
+
         for x1 in range(8):
             for y1 in range(8):
-                cur = self.board[x1][y1]
-                if cur.color == color:
-                    for x2 in range(8):
-                        for y2 in range(8):
-                            if self.provisional_move(x1,y1,x2,y2):
+                cur = board[x1][y1]
+                if cur.color != color or cur.type == 1:
+                    continue
+                pin = pins.get((x1, y1))
+                if pin != None and cur.type == 3:
+                    continue # a pinned knight can never stay on the line
+                for x2, y2 in self.target_squares(cur):
+                    square = (x2, y2)
+                    if pin != None and square not in pin:
+                        continue
+                    if blocks != None and square not in blocks and square != en_passant:
+                        continue
+                    target = board[x2][y2]
+                    if target.color == color:
+                        continue
+                    if cur.type == 5:
+                        if not cur.valid_move(target, board, self.move_num):
+                            continue
+                        if x2 != x1 and target.type == 7:
+                            # en passant takes two pieces off the rank at once, which 
+                            # can uncover a rook or queen, so the move is tried instead
+                            legal = self.provisional_move(x1, y1, x2, y2)
+                            if legal:
                                 self.undo_move()
-                                return False
-        return True
-
-    def check_promote(self, piece):
-        # Engine only promotes to queen for simplicity. 
-        # without further method implementation the player can also only promote to queen as of 
-        # now. Change would not be too difficult as lichess does convey what piece the player 
-        # promoted to, but this will be implemented in the future. 
-        if piece.type == 5:
+                            cur = board[x1][y1] # undoing puts back a copy of the pawn
+                            if legal:
+                                yield (x1, y1, x2, y2)
+                            continue
+                    elif square == en_passant:
+                        continue
+                    yield (x1, y1, x2, y2)
+
+    def squares_between(self, piece, other):
+        '''Squares strictly between piece and other on a rank, file or diagonal'''
+        dx = (other.x > piece.x) - (other.x < piece.x)
+        dy = (other.y > piece.y) - (other.y < piece.y)
+        squares = []
+        x = piece.x + dx
+        y = piece.y + dy
+        while x != other.x or y != other.y:
+            squares.append((x, y))
+            x += dx
+            y += dy
+        return squares
+
+    def target_squares(self, piece):
+        '''Squares piece could move to by how it moves, not counting whether its own 
+        king is left in check or, for the king and pawns, castling rights, en passant 
+        and whether a capture is there. Every move valid_move allows is among them.'''
+        x = piece.x
+        y = piece.y
+        type = piece.type
+        squares = []
+        if type == 3: # knight
+            for dx, dy in KNIGHT_JUMPS:
+                if 0 <= x + dx < 8 and 0 <= y + dy < 8:
+                    squares.append((x + dx, y + dy))
+        elif type == 1: # king, including the two squares it castles to
+            for dx, dy in ORTHO_DIRS + DIAG_DIRS:
+                if 0 <= x + dx < 8 and 0 <= y + dy < 8:
+                    squares.append((x + dx, y + dy))
+            if not piece.moved:
+                for x2 in (x - 2, x + 2):
+                    if 0 <= x2 < 8:
+                        squares.append((x2, y))
+        elif type == 5: # pawn, one or two squares forward or a diagonal capture
+            dy = -1 if piece.color == 'w' else 1
+            if 0 <= y + dy < 8:
+                for dx in (-1, 0, 1):
+                    if 0 <= x + dx < 8:
+                        squares.append((x + dx, y + dy))
+                if 0 <= y + 2 * dy < 8:
+                    squares.append((x, y + 2 * dy))
+        else: # sliding pieces, along each line until a piece is in the way
+            if type == 2:
+                dirs = ORTHO_DIRS + DIAG_DIRS
+            elif type == 6:
+                dirs = ORTHO_DIRS
+            else:
+                dirs = DIAG_DIRS
+            for dx, dy in dirs:
+                x2 = x + dx
+                y2 = y + dy
+                while 0 <= x2 < 8 and 0 <= y2 < 8:
+                    target = self.board[x2][y2]
+                    if target.color == piece.color:
+                        break
+                    squares.append((x2, y2))
+                    if target.type != 7:
+                        break
+                    x2 += dx
+                    y2 += dy
+        return squares
+
+    def count_pieces(self):
+        '''Pieces on the board, kings and pawns included. Kept up to date by 
+        provisional_move and partial_undo the same as self.phase'''
+        count = 0
+        for x in range(8):
+            for y in range(8):
+                if self.board[x][y].type != 7:
+                    count += 1
+        return count
+
+    def check_promote(self, piece, promote_type=2):
+        # The engine only promotes to queen for simplicity, and so does the player in the 
+        # GUI. The other pieces are for promotions of the opponent coming from lichess.
+        if piece.type == 5 and ((piece.y == 0 and piece.color == 'w') or 
+                                (piece.y == 7 and piece.color == 'b')):
             x = piece.x
             y = piece.y
-            if piece.y == 0 and piece.color == 'w':
-                self.board[x][y] = Queen('w',x,y,2)  
-                '''choice = input('choice Q, K, R, B')
-                self.board[x][y] = Queen('w',x,y,2)
-                if choice == 'Q':
-                    self.board[x][y] = Queen('w',x,y,2)
-                elif choice == 'K':
-                    self.board[x][y] = Knight('w',x,y,3)
-                elif choice == 'R':
-                    self.board[x][y] = Rook('w',x,y,6)
-                elif choice == 'B':
-                    self.board[x][y] = Bishop('w',x,y,4)'''
-            elif piece.y == 7 and piece.color == 'b':
-                self.board[x][y] = Queen('b',x,y,2) 
-                '''choice = input('choice Q, K, R, B')
-                if choice == 'Q':
-                    self.board[x][y] = Queen('b',x,y,2)
-                elif choice == 'K':
-                    self.board[x][y] = Knight('b',x,y,3)
-                elif choice == 'R':
-                    self.board[x][y] = Rook('b',x,y,6)
-                elif choice == 'B':
-                    self.board[x][y] = Bishop('b',x,y,4)'''
+            promote_class = {2: Queen, 3: Knight, 4: Bishop, 6: Rook}[promote_type]
+            self.board[x][y] = promote_class(piece.color, x, y, promote_type)
+            self.phase += PHASE_VALUES[promote_type]
 
     def print_board(self): 
         # useful for debugging. Does not provide the best model of the 
@@ -880,18 +1453,199 @@ class Chess_Board:
 
     def list_moves(self, color):
         '''Creates a list of moves, the index of each being a list in the form of 
-        [piece_x,piece_y,' ',target_x,target_y]. ' ' is added for ease of reading.'''
-        moves = []
-        for x1 in range(8):
-            for y1 in range(8):
-                cur = self.board[x1][y1]
-                if cur.color == color:
-                    for x2 in range(8):
-                        for y2 in range(8):
-                            if self.provisional_move(x1,y1,x2,y2):
-                                moves.append([x1,y1,' ',x2,y2])
-                                self.undo_move() 
-        return moves
+        [piece_x,piece_y,' ',target_x,target_y]. ' ' is added for ease of reading. 
+        Every move is legal, see legal_moves, so it can be made as trusted.'''
+        return [[x1,y1,' ',x2,y2] for x1, y1, x2, y2 in self.legal_moves(color)]
+
+    def is_capture(self, move):
+        target = self.board[move[3]][move[4]]
+        if target.type != 7:
+            return True
+        # en passant is the only capture onto an empty square
+        return self.board[move[0]][move[1]].type == 5 and move[0] != move[3]
+
+    def is_forcing(self, move, color):
+        '''True if move, a legal move of color, promotes or gives check'''
+        if self.board[move[0]][move[1]].type == 5 and move[4] in (0, 7):
+            return True
+        self.provisional_move(move[0],move[1],move[3],move[4],2,True)
+        king = self.get_black_king() if color == 'w' else self.get_white_king()
+        check = len(self.attackers(king.x, king.y, king.color)) > 0
+        self.undo_move()
+        return check
+
+    def see(self, x1, y1, x2, y2):
+        '''Static exchange evaluation of the capture x1,y1 -> x2,y2. Plays out every 
+        capture on the target square, least valuable attacker first, and returns the 
+        material the moving side comes out with assuming both sides may stop capturing 
+        whenever continuing would lose material.'''
+        board = self.board
+        piece = board[x1][y1]
+        target = board[x2][y2]
+        captured = target.value
+        if target.type == 7 and piece.type == 5: # en passant
+            captured = 100
+
+        # Each ray from the target square is kept as a queue of the pieces that can 
+        # capture along it, nearest first. A slider behind another attacker (an x-ray) 
+        # only gets its turn once the pieces in front of it have captured. 
+        rays = []
+        for dirs, slider in ((ORTHO_DIRS, 6), (DIAG_DIRS, 4)):
+            for dx, dy in dirs:
+                ray = []
+                x = x2 + dx
+                y = y2 + dy
+                step = 1
+                while 0 <= x < 8 and 0 <= y < 8:
+                    cur = board[x][y]
+                    if cur.type != 7 and not (x == x1 and y == y1):
+                        if cur.type == slider or cur.type == 2:
+                            ray.append(cur)
+                        elif step == 1 and cur.type == 1:
+                            ray.append(cur)
+                        elif (step == 1 and cur.type == 5 and slider == 4 and 
+                              dy == (1 if cur.color == 'w' else -1)):
+                            ray.append(cur)
+                        else:
+                            break
+                    x += dx
+                    y += dy
+                    step += 1
+                if ray:
+                    rays.append(ray)
+        knights = []
+        for dx, dy in KNIGHT_JUMPS:
+            x = x2 + dx
+            y = y2 + dy
+            if 0 <= x < 8 and 0 <= y < 8 and board[x][y].type == 3 and not (x == x1 and y == y1):
+                knights.append(board[x][y])
+
+        gain = [captured]
+        on_square = piece.value
+        side = 'b' if piece.color == 'w' else 'w'
+        while True:
+            # least valuable attacker of the side to capture next
+            best = None
+            best_ray = None
+            for knight in knights:
+                if knight.color == side:
+                    best = knight
+                    break
+            for ray in rays:
+                if ray[0].color == side and (best == None or ray[0].value < best.value):
+                    best = ray[0]
+                    best_ray = ray
+            if best == None:
+                break
+            if best.type == 1: # the king may only recapture if nothing can take it back
+                other = 'b' if side == 'w' else 'w'
+                if (any(knight.color == other for knight in knights) or 
+                    any(ray[0].color == other for ray in rays)):
+                    break
+            gain.append(on_square - gain[-1])
+            on_square = best.value
+            if best_ray != None:
+                del best_ray[0]
+                if not best_ray:
+                    rays.remove(best_ray)
+            else:
+                knights.remove(best)
+            side = 'b' if side == 'w' else 'w'
+
+        for i in range(len(gain) - 1, 0, -1):
+            if -gain[i] < gain[i - 1]:
+                gain[i - 1] = -gain[i]
+        return gain[0]
+
+    def order_moves(self, moves, hash_move=None):
+        '''Orders moves for the search: the transposition table move, winning and even 
+        captures best first by SEE, quiet moves by history score, then losing captures. 
+        Returns the ordered moves along with the index of the first losing capture so 
+        the search can skip them near the leaves.'''
+        good = []
+        quiet = []
+        bad = []
+        first = []
+        for move in moves:
+            if move == hash_move:
+                first.append(move)
+            elif self.is_capture(move):
+                score = self.see(move[0], move[1], move[3], move[4])
+                if score >= 0:
+                    good.append((score, move))
+                else:
+                    bad.append((score, move))
+            else:
+                quiet.append(move)
+        good.sort(key=lambda item: item[0], reverse=True)
+        bad.sort(key=lambda item: item[0], reverse=True)
+        history = self.history
+        quiet.sort(key=lambda move: history[(move[0] * 8 + move[1]) * 64 + move[3] * 8 + move[4]], 
+                   reverse=True)
+        ordered = first + [item[1] for item in good] + quiet
+        first_bad = len(ordered)
+        return ordered + [item[1] for item in bad], first_bad
+
+    def probe_tt(self, key, remain_depth, alpha, beta):
+        '''Returns a score usable as the result of the node, or None, along with the 
+        best move stored for the position. Scores are returned fail-hard, within 
+        alpha and beta, like maximize and minimize.'''
+        stats = self.stats
+        stats.tt_probes += 1
+        if self.shared_tt != None:
+            entry = self.shared_tt.get(key)
+        else:
+            entry = self.tt.get(key)
+        if entry == None:
+            return None, None
+        stats.tt_hits += 1
+        depth, score, flag, move = entry
+        if score >= TT_MATE_BOUND:
+            score -= len(self.undo_list)
+        elif score <= -TT_MATE_BOUND:
+            score += len(self.undo_list)
+        if depth >= remain_depth:
+            stats.tt_cutoffs += 1 # taken back below if the bound is no use
+            if flag == TT_EXACT:
+                if score >= beta:
+                    return beta, move
+                if score <= alpha:
+                    return alpha, move
+                return score, move
+            if flag == TT_LOWER and score >= beta:
+                return beta, move
+            if flag == TT_UPPER and score <= alpha:
+                return alpha, move
+            stats.tt_cutoffs -= 1
+        return None, move
+
+    def store_tt(self, key, remain_depth, score, flag, move):
+        self.stats.tt_stores += 1
+        if score >= TT_MATE_BOUND: # see probe_tt
+            score += len(self.undo_list)
+        elif score <= -TT_MATE_BOUND:
+            score -= len(self.undo_list)
+        if self.shared_tt != None:
+            self.shared_tt.store(key, remain_depth, score, flag, move)
+            return
+        if len(self.tt) >= TT_MAX_ENTRIES:
+            self.tt.clear()
+        self.tt[key] = [remain_depth, score, flag, move]
+
+    def add_history(self, move, remain_depth):
+        '''Rewards a quiet move that caused a cutoff, so it is tried earlier elsewhere'''
+        if not self.is_capture(move):
+            i = (move[0] * 8 + move[1]) * 64 + move[3] * 8 + move[4]
+            if self.history_lock != None:
+                with self.history_lock:
+                    self.history[i] += remain_depth * remain_depth
+            else:
+                self.history[i] += remain_depth * remain_depth
+
+    def age_history(self):
+        '''Halves the history scores between searches, so older results count for less'''
+        for i in range(4096):
+            self.history[i] //= 2
 
     def undo_move(self):
         '''Undo method that returns turn and move_num to prev values'''
@@ -908,144 +1662,162 @@ class Chess_Board:
         the value of a pawn, not -100 as commonly associated with chess engines. 
         Given the same situation with white, 100 would also be returned. 
         If black/white was down a pawn, -100 would be returned. 
+
+        The king piece square tables are tapered, a linear interpolation between the 
+        middlegame and endgame tables weighted by self.phase, so the score changes 
+        smoothly as material comes off rather than jumping at a fixed threshold.
         '''
-        opp_color = 'b'
-        if color == 'b':
-            opp_color = 'w'
-        eval = 0
-        opp_eval = 0
-        piece_eval = 0
-        opp_piece_eval = 0
-        king_loc = []
-        opp_king_loc = []
+        eval = 0 # from white's perspective, flipped at the end if needed
+        king_mid = 0
+        king_end = 0
         for x in range(8):
             for y in range(8):
                 cur = self.board[x][y]
-                if cur.color == color:
-                    piece_eval += cur.value
-                    eval += cur.value
-                    if cur.color == 'w':
-                        if cur.type == 4:
-                            eval += self.w_bishop_table[x][y]
-                        if cur.type == 1:
-                            king_loc = [cur.x, cur.y]
-                        if cur.type == 3:
-                            eval += self.w_knight_table[x][y]
-                        if cur.type == 5:
-                            piece_eval -= 100
-                            eval += self.w_pawn_table[x][y]
-                        if cur.type == 2:
-                            eval += self.w_queen_table[x][y]
-                        else:
-                            eval += self.w_rook_table[x][y]
+                if cur.color == 'w':
+                    if cur.type == 1:
+                        king_mid += self.w_king_table[x][y]
+                        king_end += self.w_king_end_table[x][y]
                     else:
-                        if cur.type == 4:
-                            eval += self.b_bishop_table[x][y]
-                        if cur.type == 1:
-                            king_loc = [cur.x, cur.y]
-                        if cur.type == 3:
-                            eval += self.b_knight_table[x][y]
-                        if cur.type == 5:
-                            piece_eval -= 100
-                            eval += self.b_pawn_table[x][y]
-                        if cur.type == 2:
-                            eval += self.b_queen_table[x][y]
-                        else:
-                            eval += self.b_rook_table[x][y]
-                elif cur.color == opp_color:
-                    opp_piece_eval += cur.value
-                    opp_eval += cur.value
-                    if cur.color == 'w':
-                        if cur.type == 4:
-                            opp_eval += self.w_bishop_table[x][y]
-                        if cur.type == 1:
-                            opp_king_loc = [cur.x, cur.y]
-                        if cur.type == 3:
-                            opp_eval += self.w_knight_table[x][y]
-                        if cur.type == 5:
-                            opp_piece_eval -= 100
-                            opp_eval += self.w_pawn_table[x][y]
-                        if cur.type == 2:
-                            opp_eval += self.w_queen_table[x][y]
-                        else:
-                            opp_eval += self.w_rook_table[x][y]
+                        eval += cur.value + self.w_tables[cur.type][x][y]
+                elif cur.color == 'b':
+                    if cur.type == 1:
+                        king_mid -= self.b_king_table[x][y]
+                        king_end -= self.b_king_end_table[x][y]
                     else:
-                        if cur.type == 4:
-                            opp_eval += self.b_bishop_table[x][y]
-                        if cur.type == 1:
-                            opp_king_loc = [cur.x, cur.y]
-                        if cur.type == 3:
-                            opp_eval += self.b_knight_table[x][y]
-                        if cur.type == 5:
-                            opp_piece_eval -= 100
-                            opp_eval += self.b_pawn_table[x][y]
-                        if cur.type == 2:
-                            opp_eval += self.b_queen_table[x][y]
-                        else:
-                            opp_eval += self.b_rook_table[x][y]
-        if piece_eval < 21331 and opp_eval < 21331: 
-            # If both player have at maximum, 2 rooks and a bishop excluding pawns,
-            # I consider it the endgame. This comes out to be 500 + 500 + 330 + 20000 (king)
-            # = 21330. This switched the king piece square tables to the endgame focused one. 
-            if color == 'w':
-                eval += self.w_king_end_table[king_loc[0]][king_loc[1]]
-                opp_eval += self.b_king_end_table[opp_king_loc[0]][opp_king_loc[1]]
-            else:
-                eval += self.b_king_end_table[king_loc[0]][king_loc[1]]
-                opp_eval += self.w_king_end_table[opp_king_loc[0]][opp_king_loc[1]]
-        else:
-            if color == 'w':
-                eval += self.w_king_table[king_loc[0]][king_loc[1]]
-                opp_eval += self.b_king_table[opp_king_loc[0]][opp_king_loc[1]]
-            else:
-                eval += self.b_king_table[king_loc[0]][king_loc[1]]
-                opp_eval += self.w_king_table[opp_king_loc[0]][opp_king_loc[1]]
-        return eval - opp_eval
+                        eval -= cur.value + self.b_tables[cur.type][x][y]
+        phase = self.phase
+        if phase > MAX_PHASE: # possible after promotions
+            phase = MAX_PHASE
+        eval += (king_mid * phase + king_end * (MAX_PHASE - phase)) // MAX_PHASE
+        if color == 'b':
+            return -eval
+        return eval
 
-    def minimax(self, alpha, beta, remain_depth, color, moves, best_moves, procnum):
+    def minimax(self, alpha, beta, remain_depth, color, moves, shared_alpha=None):
         # The entry point of the minimax algorithm. Useful to separate 
         # from maximize for easier incorporation of processes, but generally the 
-        # same purpose as maximize. 
+        # same purpose as maximize. shared_alpha is a multiprocessing.Value holding 
+        # the best score any process has found at the root. It is read before every 
+        # move and raised as soon as a better move is found, so every process 
+        # searches with the tightest bound known.
         best_move = None
         opp_color = 'w'
         if color == 'w':
             opp_color = 'b'
         for move in moves:
-            for i in range(1, 5, 1):
-                if best_moves[i] != [] and best_moves[i][0] > alpha:
-                    alpha = best_moves[i][0]
-                    best_move = best_moves[i][1]
-            self.provisional_move(move[0],move[1],move[3],move[4])
+            if shared_alpha != None and shared_alpha.value > alpha:
+                alpha = shared_alpha.value
+            self.provisional_move(move[0],move[1],move[3],move[4],2,True)
             score = self.minimize(alpha, beta, remain_depth - 1, opp_color)[0]
             self.undo_move()
             if score >= beta:
-                best_moves[procnum] = beta, best_move
                 return beta, best_move
             if score > alpha:
                 alpha = score
                 best_move = move
-                best_moves[procnum] = alpha, best_move
-        best_moves[procnum] = alpha, best_move
+                if shared_alpha != None:
+                    with shared_alpha.get_lock():
+                        if score > shared_alpha.value:
+                            shared_alpha.value = score
         return alpha, best_move
 
+    def lazy_smp_search(self, color, max_depth, moves, procnum, first_depth=1):
+        # Search run by every process in Lazy SMP mode. Each process searches all of 
+        # the root moves by iterative deepening, and they help each other only through 
+        # the shared transposition table. So that the processes do not all search the 
+        # same tree in lockstep, helpers (procnum > 1) search the root moves in a rotated 
+        # order and every other helper searches a ply deeper. If the search is stopped 
+        # the result of the last completed depth is returned, along with that depth. 
+        # Depths below first_depth were already searched by an earlier search.
+        moves = list(moves)
+        if procnum > 1:
+            shift = (procnum - 1) % len(moves)
+            moves = moves[shift:] + moves[:shift]
+            if procnum % 2 == 0:
+                max_depth += 1
+        result = (-1000000, None, 0)
+        for depth in range(first_depth, max_depth + 1):
+            start = time.perf_counter()
+            nodes = self.nodes
+            try:
+                score, move = self.minimax(-1000000, 1000000, depth, color, moves)
+            except Search_Stopped:
+                break
+            self.stats.iterations.append([depth, time.perf_counter() - start, self.nodes - nodes])
+            result = (score, move, depth)
+            if move != None: # search the best move first in the next iteration
+                moves.remove(move)
+                moves.insert(0, move)
+        return result
+
+    def probe_bitbases(self):
+        '''Exact score of the position for the side to move from the bitbases, or None 
+        if it is not in them. Like a mate found by the search, a quicker mate scores
+        higher, counting the plies from the root of the search to this position.'''
+        probe = self.bitbases.probe(self)
+        if probe == None:
+            return None
+        result, plies = probe
+        return result * (BITBASE_WIN - plies - len(self.undo_list))
+
     def maximize(self, alpha, beta, remain_depth, color):
         # return the best move and the accompaning score with said move
         best_move = None
         opp_color = 'w'
         if color == 'w':
             opp_color = 'b'
+        self.nodes += 1
+        if self.stop != None and self.nodes % STOP_CHECK_NODES == 0 and self.stop.value:
+            raise Search_Stopped
+        stats = self.stats
+        if len(self.undo_list) > stats.seldepth:
+            stats.seldepth = len(self.undo_list)
+        if self.is_draw():
+            return 0, best_move
+        if self.num_pieces <= BITBASE_MAX_PIECES and self.bitbases != None:
+            score = self.probe_bitbases()
+            if score != None:
+                stats.bitbase_hits += 1
+                return score, best_move
         if remain_depth == 0:
+            stats.leaf_nodes += 1
             return self.evaluate(color), best_move
-        moves = self.list_moves(color)  
-        for move in moves:
-            self.provisional_move(move[0],move[1],move[3],move[4])
+        key = self.hash ^ ZOBRIST_VIEW[color]
+        score, hash_move = self.probe_tt(key, remain_depth, alpha, beta)
+        if score != None:
+            return score, hash_move
+        moves = self.list_moves(color)
+        if len(moves) == 0: # the engine is mated or stalemated, a later mate is better
+            if self.terminal_state(color) == GAME_STALEMATE:
+                score = 0
+            else:
+                score = -1000000 + len(self.undo_list)
+            return min(max(score, alpha), beta), best_move
+        stats.interior_nodes += 1
+        moves, first_bad = self.order_moves(moves, hash_move)
+        for i, move in enumerate(moves):
+            if remain_depth == 1 and i >= first_bad and i > 0 and not self.is_forcing(move, color):
+                # a losing capture at the last ply only looks good to the static 
+                # evaluation because the recapture is never seen, but one that checks
+                # or promotes may still be the move, ex. Qxf7#
+                continue
+            self.provisional_move(move[0],move[1],move[3],move[4],2,True)
             score = self.minimize(alpha, beta, remain_depth - 1, opp_color)[0]
             self.undo_move()
             if score >= beta:
+                stats.cutoffs += 1
+                if i == 0:
+                    stats.first_move_cutoffs += 1
+                self.add_history(move, remain_depth)
+                self.store_tt(key, remain_depth, beta, TT_LOWER, move)
                 return beta, best_move
             if score > alpha:
                 alpha = score
                 best_move = move
+        if best_move == None:
+            self.store_tt(key, remain_depth, alpha, TT_UPPER, None)
+        else:
+            self.store_tt(key, remain_depth, alpha, TT_EXACT, best_move)
         return alpha, best_move
 
     def minimize(self, alpha, beta, remain_depth, color):
@@ -1057,25 +1829,553 @@ class Chess_Board:
         opp_color = 'w'
         if color == 'w':
             opp_color = 'b'
+        self.nodes += 1
+        if self.stop != None and self.nodes % STOP_CHECK_NODES == 0 and self.stop.value:
+            raise Search_Stopped
+        stats = self.stats
+        if len(self.undo_list) > stats.seldepth:
+            stats.seldepth = len(self.undo_list)
+        if self.is_draw():
+            return 0, best_move
+        if self.num_pieces <= BITBASE_MAX_PIECES and self.bitbases != None:
+            score = self.probe_bitbases()
+            if score != None:
+                stats.bitbase_hits += 1
+                return -score, best_move
         if remain_depth == 0:
+            stats.leaf_nodes += 1
             return -self.evaluate(color), best_move
+        key = self.hash ^ ZOBRIST_VIEW[opp_color]
+        score, hash_move = self.probe_tt(key, remain_depth, alpha, beta)
+        if score != None:
+            return score, hash_move
         moves = self.list_moves(color)
-        for move in moves:
-            self.provisional_move(move[0],move[1],move[3],move[4])
+        if len(moves) == 0: # the opponent is mated or stalemated
+            if self.terminal_state(color) == GAME_STALEMATE:
+                score = 0 # don't stalemate the opponent
+            else:
+                score = 1000000 - len(self.undo_list) # prefer a checkmate in less moves
+            return min(max(score, alpha), beta), best_move
+        stats.interior_nodes += 1
+        moves, first_bad = self.order_moves(moves, hash_move)
+        for i, move in enumerate(moves):
+            if remain_depth == 1 and i >= first_bad and i > 0 and not self.is_forcing(move, color):
+                continue
+            self.provisional_move(move[0],move[1],move[3],move[4],2,True)
             score = self.maximize(alpha, beta, remain_depth - 1, opp_color)[0]
             self.undo_move()
             if score <= alpha:
+                stats.cutoffs += 1
+                if i == 0:
+                    stats.first_move_cutoffs += 1
+                self.add_history(move, remain_depth)
+                self.store_tt(key, remain_depth, alpha, TT_UPPER, move)
                 return alpha, best_move
             if score < beta:
                 beta = score
                 best_move = move
-        if best_move == None and beta == 1000000: # game ending move
-            if self.in_stalemate(color): # don't stalemate the opponent
-                return alpha, best_move
-            beta -= 10 - remain_depth # prefer a checkmate in less moves
+        if best_move == None and beta == 1000000: # every reply is mated
+            beta = 1000000 - len(self.undo_list) # prefer a checkmate in less moves
+            self.store_tt(key, remain_depth, beta, TT_EXACT, None)
+            return beta, best_move
+        if best_move == None:
+            self.store_tt(key, remain_depth, beta, TT_LOWER, None)
+        else:
+            self.store_tt(key, remain_depth, beta, TT_EXACT, best_move)
         return beta, best_move
 
 
+def piece_key(piece):
+    '''Zobrist key of a piece on its square, 0 for an empty square'''
+    if piece.type == 7:
+        return 0
+    if piece.color == 'w':
+        return ZOBRIST_PIECES[piece.type][piece.x * 8 + piece.y]
+    return ZOBRIST_PIECES[piece.type + 8][piece.x * 8 + piece.y]
+
+
+class Search_Stopped(Exception):
+    '''Raised inside the search when the stop flag of a Search_Pool is set'''
+    pass
+
+
+class Search_Stats:
+
+    '''Counts of what a search did, kept by the board of every worker and merged at the
+    root by the Search_Lane, see as_dict for the rates worked out from them. The engine
+    has no quiescence search or evaluation cache, so the leaves evaluated and the cache
+    of terminal_state are counted in their place. A cutoff is a move scoring at least
+    beta in maximize, or at most alpha in minimize.'''
+
+    COUNTERS = ['nodes', 'leaf_nodes', 'interior_nodes', 'cutoffs', 'first_move_cutoffs',
+                'tt_probes', 'tt_hits', 'tt_cutoffs', 'tt_stores', 'terminal_probes',
+                'terminal_hits', 'bitbase_hits']
+
+    def __init__(self):
+        for name in self.COUNTERS:
+            setattr(self, name, 0)
+        self.depth = 0 # deepest iteration completed
+        self.seldepth = 0 # deepest ply reached from the root
+        self.seconds = 0.0
+        self.iterations = [] # [depth, seconds, nodes] of each completed iteration
+
+    def merge(self, other):
+        '''Adds the counts of other, the stats of another worker of the same search'''
+        for name in self.COUNTERS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.seldepth = max(self.seldepth, other.seldepth)
+
+    def as_dict(self):
+        # not round(), which the GUI replaces with its own for snapping to squares
+        def decimals(value):
+            return float('%.4f' % value)
+        def rate(count, total):
+            return decimals(count / total) if total > 0 else 0.0
+        stats = {name: getattr(self, name) for name in self.COUNTERS}
+        stats.update({
+            'depth': self.depth,
+            'seldepth': self.seldepth,
+            'seconds': decimals(self.seconds),
+            'nps': int(self.nodes / self.seconds + 0.5) if self.seconds > 0 else 0,
+            'cutoff_rate': rate(self.cutoffs, self.interior_nodes),
+            'first_move_cutoff_rate': rate(self.first_move_cutoffs, self.cutoffs),
+            'tt_hit_rate': rate(self.tt_hits, self.tt_probes),
+            'tt_cutoff_rate': rate(self.tt_cutoffs, self.tt_probes),
+            'tt_store_rate': rate(self.tt_stores, self.nodes),
+            'terminal_hit_rate': rate(self.terminal_hits, self.terminal_probes),
+            'iterations': [[depth, decimals(seconds), nodes]
+                           for depth, seconds, nodes in self.iterations]})
+        return stats
+
+    def to_json(self):
+        return json.dumps(self.as_dict())
+
+
+class Shared_TT:
+
+    '''Transposition table in shared memory, used by every process of a Search_Pool 
+    without any locking. Each slot is two 64 bit words, the key XORed with the entry 
+    and then the entry itself. If two processes write the same slot at once the words 
+    no longer match the key when read back, so a torn slot is simply a miss.'''
+
+    def __init__(self, num_slots=1 << 20, name=None):
+        # num_slots must be a power of 2
+        if name == None:
+            self.shm = shared_memory.SharedMemory(create=True, size=num_slots * 16)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.owner = name == None
+        self.name = self.shm.name
+        self.num_slots = num_slots
+        self.mask = num_slots - 1
+        self.table = self.shm.buf.cast('Q')
+
+    def get(self, key):
+        '''Returns the [depth, score, flag, move] entry for key, or None'''
+        i = (key & self.mask) * 2
+        data = self.table[i + 1]
+        if self.table[i] ^ data != key:
+            return None
+        # entry layout: depth 8 bits, flag 2 bits, score + 2^21 22 bits, move 13 bits
+        move = data >> 32
+        if move != 0:
+            move -= 1
+            move = [move >> 9, (move >> 6) & 7, ' ', (move >> 3) & 7, move & 7]
+        else:
+            move = None
+        return [data & 0xFF, ((data >> 10) & 0x3FFFFF) - (1 << 21), (data >> 8) & 3, move]
+
+    def store(self, key, depth, score, flag, move):
+        i = (key & self.mask) * 2
+        old = self.table[i + 1]
+        if self.table[i] ^ old == key and (old & 0xFF) > depth:
+            return # keep the deeper result for the same position
+        data = depth | (flag << 8) | ((score + (1 << 21)) << 10)
+        if move != None:
+            data |= ((move[0] * 8 + move[1]) * 64 + move[3] * 8 + move[4] + 1) << 32
+        self.table[i] = key ^ data
+        self.table[i + 1] = data
+
+    def close(self):
+        self.table.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def search_worker(conn, procnum, tasks, results, alphas, stops, tt_name, tt_slots):
+    '''Entry point of a search process. The process keeps its board and history table
+    for as long as it lives, and the transposition table is shared between all of the
+    processes through shared memory.'''
+    chess_board = Chess_Board()
+    chess_board.shared_tt = Shared_TT(tt_slots, tt_name)
+    chess_board.bitbases = Bitbases()
+    serve_searches(chess_board, conn, procnum, tasks, results, alphas, stops)
+    chess_board.shared_tt.close()
+    chess_board.bitbases.close()
+
+
+def search_thread(conn, procnum, tasks, results, alphas, stops, tt, history, history_lock):
+    '''Entry point of a search thread. Each thread has its own board, but the
+    transposition table dict and the history table are the same objects in every thread.'''
+    chess_board = Chess_Board()
+    chess_board.tt = tt
+    chess_board.history = history
+    chess_board.history_lock = history_lock
+    chess_board.bitbases = Bitbases()
+    serve_searches(chess_board, conn, procnum, tasks, results, alphas, stops)
+    chess_board.bitbases.close()
+
+
+def serve_searches(chess_board, conn, procnum, tasks, results, alphas, stops):
+    '''Request loop of a search process or thread. Each request only has to carry the
+    position as a FEN string and the hashes of the positions before it that it could
+    repeat, as the worker keeps its board and tables between moves.
+    Every request names the channel of the search, which picks the tasks and results
+    queue, shared alpha and stop flag used, and the worker's rank among the workers of
+    that search.
+
+    For a 'split' request the worker takes (depth, move) tasks from the tasks queue,
+    putting (score, move, improved, completed, nodes) on the results queue for each,
+    until it gets None. completed is False if the stop flag cut the move's search short.
+    It then sends its Search_Stats back over conn, so no worker is still waiting on the
+    queue when the next search starts. A 'lazy' request runs lazy_smp_search and sends
+    the result back over conn along with the Search_Stats.'''
+    fen = None
+    while True:
+        request = conn.recv()
+        if request == None:
+            break
+        kind, new_fen, history, color, channel, rank = request[:6]
+        stop = stops[channel]
+        chess_board.stop = stop
+        if new_fen != fen: # a new position, rather than another search of the same one
+            fen = new_fen
+            chess_board.load_fen(fen, history)
+            if chess_board.history_lock == None: # a shared table is aged by Search_Lane
+                chess_board.age_history()
+        chess_board.nodes = 0
+        chess_board.stats = Search_Stats()
+        if kind == 'split':
+            task = tasks[channel].get()
+            while task != None:
+                depth, move = task
+                if stop.value: # drain the queue without starting any more searches
+                    results[channel].put((-1000000, move, False, False, 0))
+                    task = tasks[channel].get()
+                    continue
+                nodes = chess_board.nodes
+                try:
+                    result = chess_board.minimax(-1000000, 1000000, depth, color, [move],
+                                                 alphas[channel])
+                    results[channel].put((result[0], move, result[1] != None, True,
+                                          chess_board.nodes - nodes))
+                except Search_Stopped:
+                    chess_board.load_fen(fen, history) # the stop can leave moves made on the board
+                    results[channel].put((-1000000, move, False, False, chess_board.nodes - nodes))
+                task = tasks[channel].get()
+            chess_board.stats.nodes = chess_board.nodes
+            conn.send(chess_board.stats)
+        else:
+            max_depth, moves, first_depth = request[6:]
+            result = chess_board.lazy_smp_search(color, max_depth, moves, rank, first_depth)
+            chess_board.load_fen(fen, history) # the stop can leave moves made on the board
+            chess_board.stats.nodes = chess_board.nodes
+            conn.send((result, chess_board.stats))
+
+
+class Search_Lane:
+
+    '''Runs one search at a time on some of the workers of a Search_Pool, through one of
+    the pool's channels. Search_Pool is itself a lane using every worker. To play
+    several games at once each game gets a lane of its own, and the workers and
+    channel of each of its searches are handed out by a Search_Scheduler.
+
+    By default the root is searched by iterative deepening, with the root moves of each
+    depth put on a queue in the order of the previous depth's scores. Idle workers
+    take the next move from the queue, so no worker sits waiting on a fixed share of
+    the moves, and the best score so far is shared through a multiprocessing.Value.
+    With lazy_smp every worker searches the whole tree and the first to finish gives
+    the move.
+
+    A search can be cut short with abort(), or by giving start_search a time limit.
+    The workers poll a shared stop flag every STOP_CHECK_NODES nodes and the best
+    result of the deepest completed iteration is returned.
+
+    The transposition table, history scores and principal variation are kept from one
+    search to the next. The position after the opponent's reply was already searched
+    two plies down by the last search, so its best move is searched first and the
+    depths it was searched to are skipped.
+
+    The Search_Stats of every worker are merged into self.stats once the search ends.'''
+
+    def __init__(self, pool, lazy_smp=False):
+        self.pool = pool
+        self.lazy_smp = lazy_smp
+        self.channel = 0
+        self.workers = list(range(len(pool.conns))) # indexes of the pool's workers used
+        self.thread = None # runs the search in the background so the caller is not blocked
+        self.timer = None
+        self.result = None
+        self.end_time = 0.0 # time.perf_counter() the last search finished
+        self.start_time = 0.0
+        self.stats = Search_Stats() # of the last search, complete once it has finished
+        self.board = Chess_Board() # for following the principal variation
+        self.pv = [] # principal variation of the last search
+        self.pv_keys = [] # root transposition table key before each move of self.pv
+
+    def start_search(self, chess_board, color, max_depth, moves, time_limit=None):
+        '''Starts searching the position of chess_board in the background. If time_limit,
+        in seconds, is given the search is aborted once it runs out.'''
+        fen = chess_board.get_fen()
+        history = tuple(chess_board.repetition_history())
+        self.start_time = time.perf_counter()
+        self.stats = Search_Stats()
+        self.pool.stops[self.channel].value = 0
+        if self.pool.backend == 'thread':
+            # the thread workers share one history table, aged here before any of them
+            # starts, under the lock as the workers of other lanes may be searching
+            with self.pool.history_lock:
+                for i in range(4096):
+                    self.pool.history[i] //= 2
+        moves = list(moves)
+        self.result = [0, moves[0]]
+        first_depth = 1
+        key = chess_board.hash ^ ZOBRIST_VIEW[color]
+        entry = self.pool.tt.get(key)
+        if entry != None and entry[3] in moves:
+            # searched before, as the root of a ponder search or further down the last
+            # search, so iterations that would only repeat an exact result are skipped
+            moves.remove(entry[3])
+            moves.insert(0, entry[3])
+            self.result = [entry[1], entry[3]]
+            if entry[2] == TT_EXACT:
+                first_depth = min(entry[0] + 1, max_depth)
+        elif key in self.pv_keys and self.pv[self.pv_keys.index(key)] in moves:
+            # the entry was replaced, but the move is still known from the last search
+            move = self.pv[self.pv_keys.index(key)]
+            moves.remove(move)
+            moves.insert(0, move)
+            self.result = [0, move]
+        if self.lazy_smp:
+            target = self.run_lazy_smp
+        else:
+            target = self.run_split
+        self.thread = threading.Thread(target=target,
+                                       args=(fen, history, color, max_depth, moves, first_depth),
+                                       daemon=True)
+        self.thread.start()
+        if time_limit != None:
+            self.set_time_limit(time_limit)
+
+    def set_time_limit(self, time_limit):
+        '''Aborts the running search time_limit seconds from now'''
+        if self.timer != None:
+            self.timer.cancel()
+        self.timer = threading.Timer(time_limit, self.stop_search)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def run_split(self, fen, history, color, max_depth, moves, first_depth):
+        conns = [self.pool.conns[i] for i in self.workers]
+        tasks = self.pool.tasks[self.channel]
+        results = self.pool.results[self.channel]
+        alpha = self.pool.alphas[self.channel]
+        stop = self.pool.stops[self.channel]
+        for rank, conn in enumerate(conns, 1):
+            conn.send(('split', fen, history, color, self.channel, rank))
+        for depth in range(first_depth, max_depth + 1):
+            start = time.perf_counter()
+            alpha.value = -1000000
+            for move in moves:
+                tasks.put((depth, move))
+            depth_results = [results.get() for move in moves]
+            best = None
+            first_completed = False
+            for score, move, improved, completed, nodes in depth_results:
+                if move == moves[0]:
+                    first_completed = completed
+                if improved and (best == None or score > best[0]):
+                    best = [score, move]
+            # A depth cut short is only used if the previous best move, which is searched
+            # first, was completed, as then any move scored higher really is better
+            if best != None and (depth == 1 or first_completed):
+                self.result = best
+            if stop.value:
+                break
+            self.stats.depth = depth
+            self.stats.iterations.append([depth, time.perf_counter() - start,
+                                          sum(result[4] for result in depth_results)])
+            if best != None:
+                self.store_root(fen, color, depth, best)
+            # moves that raised alpha have exact scores, the rest only an upper bound
+            depth_results.sort(key=lambda result: (result[0], result[2]), reverse=True)
+            moves = [result[1] for result in depth_results]
+        for conn in conns: # one None for each worker to stop on
+            tasks.put(None)
+        for conn in conns:
+            self.stats.merge(conn.recv())
+        self.end_time = time.perf_counter()
+        self.stats.seconds = self.end_time - self.start_time
+
+    def run_lazy_smp(self, fen, history, color, max_depth, moves, first_depth):
+        conns = [self.pool.conns[i] for i in self.workers]
+        for rank, conn in enumerate(conns, 1):
+            conn.send(('lazy', fen, history, color, self.channel, rank, max_depth, moves,
+                       first_depth))
+        # the first worker to finish gives the move, the rest are stopped. If the search
+        # was aborted instead, the deepest result between the workers is used
+        first = connection.wait(conns)[0]
+        replies = [first.recv()]
+        self.pool.stops[self.channel].value = 1
+        for conn in conns:
+            if conn != first:
+                replies.append(conn.recv())
+        best, best_stats = replies[0]
+        for result, stats in replies:
+            self.stats.merge(stats)
+            if result[2] > best[2]:
+                best, best_stats = result, stats
+        if best[1] != None:
+            self.result = [best[0], best[1]]
+            self.store_root(fen, color, best[2], self.result)
+        # the iterations are those of the worker that gave the move
+        self.stats.depth = best[2]
+        self.stats.iterations = best_stats.iterations
+        self.end_time = time.perf_counter()
+        self.stats.seconds = self.end_time - self.start_time
+
+    def store_root(self, fen, color, depth, result):
+        '''Stores the [score, move] of a completed depth at the root in the transposition
+        table and follows the table from there for the principal variation'''
+        self.board.load_fen(fen)
+        key = self.board.hash ^ ZOBRIST_VIEW[color]
+        if self.pool.backend == 'thread':
+            self.pool.tt[key] = [depth, result[0], TT_EXACT, result[1]]
+        else:
+            self.pool.tt.store(key, depth, result[0], TT_EXACT, result[1])
+        self.pv = []
+        self.pv_keys = []
+        while len(self.pv) < depth:
+            # every node of a search is stored from the view of the side searching
+            key = self.board.hash ^ ZOBRIST_VIEW[color]
+            entry = self.pool.tt.get(key)
+            if entry == None or entry[3] == None or key in self.pv_keys:
+                break
+            move = entry[3]
+            if not self.board.provisional_move(move[0], move[1], move[3], move[4]):
+                break
+            self.pv.append(move)
+            self.pv_keys.append(key)
+
+    def search_done(self):
+        return self.thread == None or not self.thread.is_alive()
+
+    def predicted_reply(self, chess_board, color):
+        '''The reply the last search expects from the opponent of color, who is to move
+        on chess_board, or None if the transposition table does not have one'''
+        key = chess_board.hash ^ ZOBRIST_VIEW[color]
+        if key in self.pv_keys:
+            return self.pv[self.pv_keys.index(key)]
+        entry = self.pool.tt.get(key)
+        if entry == None:
+            return None
+        return entry[3]
+
+    def stop_search(self):
+        '''Signals the workers to stop, without waiting for them'''
+        self.pool.stops[self.channel].value = 1
+
+    def abort(self):
+        '''Stops the search and returns the best [score, move] found so far'''
+        self.stop_search()
+        return self.get_result()
+
+    def get_result(self):
+        '''Waits for the search to finish and returns the best [score, move]'''
+        if self.thread != None:
+            self.thread.join()
+            self.thread = None
+        if self.timer != None:
+            self.timer.cancel()
+            self.timer = None
+        self.pool.stops[self.channel].value = 0
+        return self.result
+
+    def search(self, chess_board, color, max_depth, moves, time_limit=None):
+        self.start_search(chess_board, color, max_depth, moves, time_limit)
+        return self.get_result()
+
+
+class Search_Pool(Search_Lane):
+
+    '''Search workers that are started once and reused for every engine move, one per
+    core unless num_procs is given. Used directly the pool searches one position at a
+    time with all of its workers, see Search_Lane.
+
+    To search several positions at once, the pool is made with more than one channel,
+    each with its own tasks and results queue, shared alpha and stop flag, and a lane
+    is made for each of them. The transposition table is shared by every lane.
+
+    backend is 'process' or 'thread'. Threads share one transposition table dict and
+    history table instead of going through shared memory, but only run in parallel on
+    a free-threaded build of python, so by default they are used only when the GIL is
+    disabled.'''
+
+    def __init__(self, num_procs=None, lazy_smp=False, tt_slots=1 << 20, backend=None,
+                 channels=1):
+        if num_procs == None:
+            num_procs = multiprocessing.cpu_count()
+        if backend == None:
+            backend = 'thread' if gil_disabled() else 'process'
+        self.backend = backend
+        self.alphas = [multiprocessing.Value('i', -1000000) for i in range(channels)]
+        self.stops = [multiprocessing.Value('b', 0, lock=False) for i in range(channels)]
+        if backend == 'thread':
+            self.tasks = [queue.Queue() for i in range(channels)]
+            self.results = [queue.Queue() for i in range(channels)]
+            self.tt = {}
+            self.history = [0] * 4096
+            self.history_lock = threading.Lock()
+        else:
+            self.tasks = [multiprocessing.Queue() for i in range(channels)]
+            self.results = [multiprocessing.Queue() for i in range(channels)]
+            self.tt = Shared_TT(tt_slots)
+        self.conns = []
+        self.procs = []
+        for procnum in range(1, num_procs + 1):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            if backend == 'thread':
+                proc = threading.Thread(target=search_thread,
+                                        args=(child_conn, procnum, self.tasks, self.results,
+                                              self.alphas, self.stops, self.tt, self.history,
+                                              self.history_lock),
+                                        daemon=True)
+            else:
+                proc = multiprocessing.Process(target=search_worker,
+                                               args=(child_conn, procnum, self.tasks, self.results,
+                                                     self.alphas, self.stops, self.tt.name, tt_slots),
+                                               daemon=True)
+            proc.start()
+            self.conns.append(parent_conn)
+            self.procs.append(proc)
+        Search_Lane.__init__(self, self, lazy_smp)
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(None)
+        for proc in self.procs:
+            proc.join()
+        if self.backend == 'process':
+            self.tt.close()
+
+
+def gil_disabled():
+    '''True when running on a free-threaded build of python with the GIL turned off'''
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    return is_gil_enabled != None and not is_gil_enabled()
+
+
 def lich_to_index(move):
     '''Converts a move in lichess, ex. e2e4 to the form this program uses [4,6,' ',4,4]'''
     x1 = str(ord(move[0]) - 97)
@@ -1093,202 +2393,638 @@ def index_to_lich(move):
     y2 = str(abs(8 - int(move[4])))
     return x1 + y1 + x2 + y2
 
+# Network errors when talking to lichess are retried this many times, waiting
+# RETRY_DELAY seconds before the first retry and twice as long after each failure
+NETWORK_RETRIES = 5
+RETRY_DELAY = 0.5
+PROMOTE_TYPES = {'q': 2, 'n': 3, 'b': 4, 'r': 6} # last letter of a lichess promotion, ex. e7e8q
+
+
+def clock_seconds(clock):
+    '''Seconds left on a clock of a lichess gameState. Depending on the berserk version
+    clocks come as milliseconds, a timedelta or a datetime counted from the epoch'''
+    if isinstance(clock, datetime.timedelta):
+        return clock.total_seconds()
+    if isinstance(clock, datetime.datetime):
+        return clock.replace(tzinfo=datetime.timezone.utc).timestamp()
+    return clock / 1000
+
+
+# Spans a move of the bot is timed in, in the order they happen. total runs from the
+# opponent's move arriving on the stream to the bot's move being accepted by lichess
+LATENCY_SPANS = ['event', 'sync', 'book', 'dispatch', 'search', 'collect', 'post', 'total']
+LATENCY_WINDOW = 1000 # moves kept for the percentiles of each span
+LATENCY_BUCKETS = [0.001, 0.01, 0.1, 0.5, 1, 2, 5, 10, 30, 60] # histogram upper bounds, seconds
+
+
+class Move_Latency:
+
+    '''Times where the seconds go between the opponent's move arriving and the bot's
+    move being posted:
+    event - waiting on the event loop after the stream thread received the move
+    sync - applying the move to the board
+    book - looking up the opening book
+    dispatch - waiting for workers from the scheduler and starting the search
+    search - the search itself
+    collect - from the search finishing to its result being back on the event loop
+    post - client.bots.make_move, including retries
+
+    Each move is written as a line of JSON to log_path, if given, and the spans of the
+    last LATENCY_WINDOW moves are kept for summary().'''
+
+    def __init__(self, game_id, log_path=None):
+        self.game_id = game_id
+        self.log_path = log_path
+        self.samples = {span: collections.deque(maxlen=LATENCY_WINDOW) for span in LATENCY_SPANS}
+        self.received = None
+        self.spans = None
+
+    def start_move(self, received):
+        '''Starts timing a move of the bot, received being the time.perf_counter() the
+        event that made it the bot's turn was read from the stream'''
+        self.received = received
+        self.spans = {span: 0.0 for span in LATENCY_SPANS}
+
+    def add(self, span, seconds):
+        if self.spans != None:
+            self.spans[span] += max(seconds, 0.0)
+
+    def end_move(self, move, clock, time_limit):
+        if self.spans == None:
+            return
+        self.spans['total'] = time.perf_counter() - self.received
+        for span in LATENCY_SPANS:
+            self.samples[span].append(self.spans[span])
+        if self.log_path != None:
+            record = {'game': self.game_id, 'move': move, 'time': time.time(), 'clock': clock,
+                      'time_limit': time_limit}
+            for span in LATENCY_SPANS:
+                record[span] = round(self.spans[span], 4)
+            with open(self.log_path, 'a') as log:
+                log.write(json.dumps(record) + '\n')
+        self.spans = None
+
+    def percentile(self, span, percent):
+        '''Nearest rank percentile of span over the kept moves, in seconds'''
+        samples = sorted(self.samples[span])
+        if len(samples) == 0:
+            return 0.0
+        rank = max((len(samples) * percent + 99) // 100, 1) # rounded up
+        return samples[rank - 1]
+
+    def histogram(self, span):
+        '''Count of the kept moves in each of LATENCY_BUCKETS, and past the last one'''
+        counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        for seconds in self.samples[span]:
+            i = 0
+            while i < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[i]:
+                i += 1
+            counts[i] += 1
+        return counts
+
+    def summary(self):
+        lines = ['move latency of game %s over %d moves, seconds' %
+                 (self.game_id, len(self.samples['total'])),
+                 '%-8s %8s %8s %8s %8s' % ('span', 'p50', 'p95', 'p99', 'max')]
+        for span in LATENCY_SPANS:
+            lines.append('%-8s %8.3f %8.3f %8.3f %8.3f' %
+                         (span, self.percentile(span, 50), self.percentile(span, 95),
+                          self.percentile(span, 99), self.percentile(span, 100)))
+        labels = ['<=%gs' % bound for bound in LATENCY_BUCKETS] + ['>%gs' % LATENCY_BUCKETS[-1]]
+        lines.append('total histogram: ' + ' '.join('%s:%d' % (label, count) for label, count
+                                                    in zip(labels, self.histogram('total'))))
+        return '\n'.join(lines)
+
+
+class Search_Scheduler:
+
+    '''Shares the workers of a Search_Pool between the games being played at once.
+    Before each search a game asks for a channel and some of the workers, and gets a
+    share of all of the workers weighted by 1 / the time left on its clock, as a game
+    short on time has to reach its depth in less time. When the workers are busy,
+    the waiting game with the least time left is served first.'''
+
+    def __init__(self, search_pool):
+        self.num_workers = len(search_pool.conns)
+        self.free_workers = list(range(self.num_workers))
+        self.free_channels = list(range(len(search_pool.stops)))
+        self.games = [] # every game being played, searching or not
+        self.waiting = [] # games waiting for workers
+        self.changed = asyncio.Condition()
+
+    def share(self, game):
+        '''Number of workers game should search with'''
+        weight = 1 / max(game.clock(), 1)
+        total = weight + sum(1 / max(other.clock(), 1) for other in self.games if other != game)
+        return max(round(self.num_workers * weight / total), 1)
+
+    async def acquire(self, game):
+        '''Waits for free workers and returns the channel and workers game can search with'''
+        async with self.changed:
+            self.waiting.append(game)
+            await self.changed.wait_for(lambda: len(self.free_workers) > 0 and
+                                        min(self.waiting, key=lambda other: other.clock()) == game)
+            self.waiting.remove(game)
+            count = min(self.share(game), len(self.free_workers))
+            workers = self.free_workers[:count]
+            del self.free_workers[:count]
+            channel = self.free_channels.pop()
+            self.changed.notify_all() # the next waiting game may be able to go
+            return channel, workers
+
+    async def release(self, channel, workers):
+        async with self.changed:
+            self.free_workers += workers
+            self.free_channels.append(channel)
+            self.changed.notify_all()
+
+
+class Lichess_Game:
+
+    '''Plays one game on lichess. The blocking berserk game stream is read by a thread
+    of its own that puts the events on an asyncio queue, and the search and posting of
+    moves run in the default executor, so events such as a resign or abort are still
+    handled while the engine is searching.
+
+    search_pool can be a Search_Lane of a pool shared with other games, in which case 
+    the workers of each search are asked for from scheduler. The timing of every move 
+    is appended to latency_log, if given, see Move_Latency, and the Search_Stats of
+    every move searched to stats_log as a line of JSON. Moves are played from
+    opening_book, an Opening_Book, until the game leaves it.'''
+
+    def __init__(self, client, game_id, bot_name, search_pool, max_depth, max_move_time,
+                 ponder, scheduler=None, latency_log=None, opening_book=None, stats_log=None):
+        self.client = client
+        self.game_id = game_id
+        self.bot_name = bot_name
+        self.search_pool = search_pool
+        self.scheduler = scheduler
+        self.max_depth = max_depth
+        self.max_move_time = max_move_time
+        self.ponder = ponder
+        self.chess_board = Chess_Board()
+        self.events = None
+        self.bot_color = None
+        self.bot_move = False
+        self.game_over = False
+        self.clocks = {} # seconds left for 'w' and 'b', from the last gameState
+        self.latency = Move_Latency(game_id, latency_log)
+        self.stats_log = stats_log
+        self.move_time_limit = None # time limit given to the search of the current move
+
+        self.move_list = [] # lichess moves made on chess_board, ex. 'e2e4'
+        self.list_chars = 0 # length of the lichess moves string that move_list makes up
+        self.posted_chars = None # list_chars before the bot's move, until lichess shows it
+        self.initial_fen = None # the game's starting position, if not the usual one
+        self.prev_move = None
+        self.opening_book = opening_book
+        self.check_obook = opening_book != None
+        self.pondering = False
+        self.ponder_move = None
+        self.ponder_hit = False
+
+    def read_stream(self, loop):
+        '''Puts the events of the game stream on self.events, run in its own thread.
+        A dropped stream is opened again, lichess starts every stream with the full
+        game so nothing is missed. None is put on the queue once the stream ends.'''
+        failures = 0
+        while failures < NETWORK_RETRIES:
+            try:
+                for event in self.client.bots.stream_game_state(self.game_id):
+                    failures = 0
+                    loop.call_soon_threadsafe(self.events.put_nowait, 
+                                              (time.perf_counter(), event))
+                break # lichess closes the stream once the game is over
+            except Exception as error:
+                print('Error: game stream lost, reconnecting.', error)
+                time.sleep(RETRY_DELAY * 2 ** failures)
+                failures += 1
+        loop.call_soon_threadsafe(self.events.put_nowait, (time.perf_counter(), None))
+
+    async def run(self):
+        self.events = asyncio.Queue()
+        stream_thread = threading.Thread(target=self.read_stream,
+                                         args=(asyncio.get_running_loop(),), daemon=True)
+        stream_thread.start()
+        while not self.game_over:
+            if self.bot_move:
+                await self.play_move()
+            else:
+                self.handle_event(*await self.events.get())
+        if not self.search_pool.search_done(): # a ponder search may still be running
+            self.search_pool.abort()
+        print('Game Over')
+        if len(self.latency.samples['total']) > 0:
+            print(self.latency.summary())
+
+    async def wait_with_events(self, future):
+        '''Waits for future while handling the events that come in. If the game ends in
+        the meantime the search is stopped, so future finishes straight away'''
+        while not future.done():
+            get_event = asyncio.ensure_future(self.events.get())
+            done, pending = await asyncio.wait({future, get_event},
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if get_event in done:
+                self.handle_event(*get_event.result())
+                if self.game_over and not self.search_pool.search_done():
+                    self.search_pool.stop_search()
+            else:
+                get_event.cancel()
+        return future.result()
+
+    def handle_event(self, received, event):
+        '''received is the time.perf_counter() the stream thread read event at'''
+        if event == None: # the stream could not be opened again
+            self.game_over = True
+        elif event['type'] == 'gameFull':
+            if self.bot_color == None: # the first event, determine if bot is black or white
+                if len(event['white']) > 0 and event['white'].get('name') == self.bot_name:
+                # must check if len(event['white']) > 0 as if white is an anon account,
+                # ['name'] does not exist as event['white'] is empty
+                    self.bot_color = 'w'
+                else:
+                    self.bot_color = 'b'
+                if event.get('initialFen', 'startpos') != 'startpos':
+                    self.initial_fen = event['initialFen']
+                # a game that started from a position or is already being played, such as 
+                # after the bot was restarted, is picked up from where it is
+                if self.initial_fen != None or len(event['state']['moves']) > 0:
+                    self.rebuild(event['state']['moves'])
+            # whose move it is comes from the board
+            self.handle_game_state(received, event['state'])
+        elif event['type'] == 'gameState':
+            self.handle_game_state(received, event)
+
+    def update_clocks(self, event):
+        for color, clock in (('w', 'wtime'), ('b', 'btime')):
+            if clock in event:
+                self.clocks[color] = clock_seconds(event[clock])
+
+    def handle_game_state(self, received, event):
+        self.update_clocks(event)
+        start = time.perf_counter()
+        self.sync_moves(event['moves'])
+        bot_move = self.chess_board.turn == (self.bot_color == 'w')
+        if bot_move and not self.bot_move: # the opponent has moved, or the bot starts
+            self.bot_move = True
+            if len(self.move_list) > 0:
+                self.opponent_moved()
+            self.latency.start_move(received)
+            self.latency.add('event', start - received)
+            self.latency.add('sync', time.perf_counter() - start)
+        if event['status'] != 'started': # mate, resign, abort, out of time...
+            self.game_over = True
+
+    def sync_moves(self, moves):
+        '''Brings chess_board up to date with the moves string of a gameState. Only the 
+        moves past the ones already made are read. If the start of the string does not 
+        match the moves made, the board is rebuilt from the whole string.'''
+        n = self.list_chars
+        if self.posted_chars != None:
+            if len(moves) == self.posted_chars:
+                return # sent before the bot's move reached lichess
+            if len(moves) >= n:
+                self.posted_chars = None
+        last = self.move_list[-1] if n > 0 else ''
+        if (len(moves) < n or moves[n - len(last):n] != last or 
+            (n > 0 and len(moves) > n and moves[n] != ' ')):
+            self.resync(moves)
+            return
+        for uci in moves[n:].split():
+            if not self.make_lichess_move(uci):
+                self.resync(moves)
+                return
+
+    def make_lichess_move(self, uci, trusted=False):
+        '''Makes a move in the form lichess uses, ex. e7e8n, on chess_board. Returns False 
+        if the move is not legal on the board'''
+        move = lich_to_index(uci[:4])
+        promote_type = PROMOTE_TYPES.get(uci[4:], 2)
+        if not self.chess_board.provisional_move(int(move[0]), int(move[1]), int(move[3]), 
+                                                 int(move[4]), promote_type, trusted):
+            return False
+        if len(self.move_list) > 0:
+            self.list_chars += 1 # the space before the move
+        self.move_list.append(uci)
+        self.list_chars += len(uci)
+        return True
+
+    def resync(self, moves):
+        print('Board out of step with lichess, rebuilding it from the move list')
+        self.rebuild(moves)
+
+    def rebuild(self, moves):
+        '''Rebuilds chess_board from the starting position and the whole moves string. 
+        lichess has already checked the moves, so they are made as trusted moves, which 
+        takes a few milliseconds even for long games.'''
+        self.chess_board = Chess_Board()
+        if self.initial_fen != None:
+            self.chess_board.load_fen(self.initial_fen)
+        self.move_list = []
+        self.list_chars = 0
+        self.posted_chars = None
+        for uci in moves.split():
+            if not self.make_lichess_move(uci, True):
+                print('Error: could not make', uci)
+                break
+
+    def opponent_moved(self):
+        uci = self.move_list[-1]
+        move = lich_to_index(uci[:4])
+        self.prev_move = [int(move[0]), int(move[1]), ' ',int(move[3]), int(move[4])]
+        if self.pondering:
+            self.pondering = False
+            # the ponder move was made promoting to a queen, so an underpromotion on the
+            # same squares leads to a different position than the one searched
+            if self.prev_move == self.ponder_move and PROMOTE_TYPES.get(uci[4:], 2) == 2:
+                self.ponder_hit = True
+            else: # the transposition table is still warm for the real search
+                self.search_pool.stop_search()
+
+    def book_move(self):
+        '''A move from the opening book, or None once the game has left it'''
+        move = self.opening_book.choose(self.chess_board)
+        if move == None:
+            self.check_obook = False
+            return None
+        return [0,move]
+
+    def clock(self):
+        '''Seconds left on the bot's clock, taken as 20 moves of max_move_time if the 
+        game has no clock'''
+        return self.clocks.get(self.bot_color, self.max_move_time * 20)
+
+    def time_limit(self):
+        '''max_move_time, or less once the clock runs low'''
+        return max(min(self.max_move_time, self.clock() / 20), 0.1)
+
+    async def play_move(self):
+        loop = asyncio.get_running_loop()
+        start = time.time()
+
+        move = None
+        searched = False
+        self.move_time_limit = None
+        if self.check_obook:
+            book_start = time.perf_counter()
+            move = self.book_move()
+            self.latency.add('book', time.perf_counter() - book_start)
+        if move == None:
+            moves = self.chess_board.list_moves(self.bot_color)
+            if not self.ponder_hit and not self.search_pool.search_done():
+                # the ponder search of a missed reply, which has already been stopped
+                await loop.run_in_executor(None, self.search_pool.get_result)
+            if self.ponder_hit or len(moves) > 1:
+                move = await self.search(moves, start)
+                searched = True
+            else:
+                move = [0,moves[0]] # if there is only one legal move, do said move
+            if self.game_over:
+                return
+
+        eval = move[0]
+        x1, y1, x2, y2 = move[1][0], move[1][1], move[1][3], move[1][4]
+        move = index_to_lich(str(x1) + str(y1) + ' ' + str(x2) + str(y2))
+        if self.chess_board.board[x1][y1].type == 5 and y2 in (0, 7):
+            move += 'q' # the engine only promotes to queen
+        # provisional moves are used as they are slightly faster and lichess can deal
+        # with checkmate detection
+        posted_chars = self.list_chars
+        self.make_lichess_move(move)
+        self.posted_chars = posted_chars
+        self.bot_move = False
+        print(eval, move)
+        if searched:
+            self.log_stats(move, eval)
+        post_start = time.perf_counter()
+        if not await self.post_move(move):
+            self.game_over = True
+            return
+        self.latency.add('post', time.perf_counter() - post_start)
+        self.latency.end_move(move, self.clock(), self.move_time_limit)
+        print(time.time()-start,'\n')
+
+        # the opponent may have already replied while the move was being posted
+        if self.ponder and not self.check_obook and not self.bot_move:
+            self.start_ponder()
+
+    def log_stats(self, move, eval):
+        '''Appends the Search_Stats of the search that chose move to self.stats_log'''
+        if self.stats_log == None:
+            return
+        record = {'game': self.game_id, 'move': move, 'eval': eval, 'time': time.time()}
+        record.update(self.search_pool.stats.as_dict())
+        with open(self.stats_log, 'a') as log:
+            log.write(json.dumps(record) + '\n')
+
+    async def search(self, moves, start):
+        dispatch_start = time.perf_counter()
+        if self.ponder_hit:
+            # the search started on the opponent's time is already searching this
+            # position, so it only needs to be given the time limit and finished
+            self.ponder_hit = False
+            self.move_time_limit = self.time_limit()
+            self.search_pool.set_time_limit(self.move_time_limit)
+            return await self.collect(dispatch_start)
+        if self.scheduler == None:
+            self.move_time_limit = self.time_limit()
+            self.search_pool.start_search(self.chess_board, self.bot_color,
+                                          self.max_depth, moves, self.move_time_limit)
+            return await self.collect(dispatch_start)
+
+        channel, workers = await self.wait_with_events(
+            asyncio.ensure_future(self.scheduler.acquire(self)))
+        try:
+            if self.game_over:
+                return None
+            self.search_pool.channel = channel
+            self.search_pool.workers = workers
+            # time spent waiting on the other games comes off the time limit
+            self.move_time_limit = max(self.time_limit() - (time.time() - start), 0.1)
+            self.search_pool.start_search(self.chess_board, self.bot_color,
+                                          self.max_depth, moves, self.move_time_limit)
+            return await self.collect(dispatch_start)
+        finally:
+            await self.scheduler.release(channel, workers)
+
+    async def collect(self, dispatch_start):
+        '''Waits for the result of the search, which has just been started'''
+        loop = asyncio.get_running_loop()
+        dispatched = time.perf_counter()
+        self.latency.add('dispatch', dispatched - dispatch_start)
+        result = await self.wait_with_events(loop.run_in_executor(None, self.search_pool.get_result))
+        # a ponder search may have finished before it was dispatched
+        finished = max(self.search_pool.end_time, dispatched)
+        self.latency.add('search', finished - dispatched)
+        self.latency.add('collect', time.perf_counter() - finished)
+        return result
+
+    async def post_move(self, move):
+        '''Posts move to lichess, retrying with a growing delay while the connection is
+        lost. Returns False if it could not be posted.'''
+        loop = asyncio.get_running_loop()
+        for attempt in range(NETWORK_RETRIES):
+            try:
+                await self.wait_with_events(
+                    loop.run_in_executor(None, self.client.bots.make_move, self.game_id, move))
+                return True
+            except Exception as error:
+                print('Error: Connection Lost temporarily, or game over. Retrying.', error)
+                await self.wait_with_events(
+                    asyncio.ensure_future(asyncio.sleep(RETRY_DELAY * 2 ** attempt)))
+                if self.game_over: # the move was refused as the game has ended
+                    return False
+        return False
+
+    def start_ponder(self):
+        self.ponder_move = self.search_pool.predicted_reply(self.chess_board, self.bot_color)
+        if (self.ponder_move != None and
+            self.chess_board.provisional_move(self.ponder_move[0], self.ponder_move[1],
+                                              self.ponder_move[3], self.ponder_move[4])):
+            ponder_moves = self.chess_board.list_moves(self.bot_color)
+            if len(ponder_moves) > 1:
+                # the search reads the position when started, so the board can be
+                # put back straight away
+                self.search_pool.start_search(self.chess_board, self.bot_color,
+                                              self.max_depth, ponder_moves)
+                self.pondering = True
+            self.chess_board.undo_move()
+
+
+class Bot_Server:
+
+    '''Plays every game of the bot account, as many at once as max_games. Listens on the
+    stream of incoming events, answers challenges by the policy in accept_challenge and
+    plays each game that starts as a Lichess_Game task. With max_games above 1 the games
+    share the search workers through a Search_Scheduler, otherwise the one game uses
+    the whole pool and can ponder. Every game plays from the one opening_book.'''
+
+    def __init__(self, client, bot_name, search_pool, max_depth, max_move_time, ponder,
+                 max_games, speeds, latency_log=None, opening_book=None, stats_log=None):
+        self.client = client
+        self.bot_name = bot_name
+        self.search_pool = search_pool
+        self.max_depth = max_depth
+        self.max_move_time = max_move_time
+        if ponder and max_games > 1: # a game of a shared pool has no workers to spare
+            print('Warning: ponder is ignored, the bot only ponders with max_games = 1')
+        self.ponder = ponder and max_games == 1
+        self.max_games = max_games
+        self.speeds = speeds # time controls challenges are accepted for, ex. 'blitz'
+        self.latency_log = latency_log
+        self.stats_log = stats_log
+        self.opening_book = opening_book
+        self.games = {} # game id: task playing it, or None until an accepted game starts
+        self.events = None
+        self.scheduler = None
+
+    def read_events(self, loop):
+        '''Puts the incoming events of the account on self.events, run in its own thread.
+        The stream is opened again whenever it drops.'''
+        failures = 0
+        while True:
+            try:
+                for event in self.client.bots.stream_incoming_events():
+                    failures = 0
+                    loop.call_soon_threadsafe(self.events.put_nowait, event)
+            except Exception as error:
+                print('Error: event stream lost, reconnecting.', error)
+            time.sleep(min(RETRY_DELAY * 2 ** failures, 60))
+            failures += 1
+
+    def accept_challenge(self, challenge):
+        '''Standard chess at one of self.speeds, while there is room for another game'''
+        return (challenge['variant']['key'] == 'standard' and
+                challenge['speed'] in self.speeds and
+                len(self.games) < self.max_games)
+
+    async def answer_challenge(self, challenge):
+        if challenge['challenger'] != None and challenge['challenger']['name'] == self.bot_name:
+            return # a challenge sent by the bot itself
+        loop = asyncio.get_running_loop()
+        try:
+            if self.accept_challenge(challenge):
+                self.games[challenge['id']] = None # the game takes the id of the challenge
+                await loop.run_in_executor(None, self.client.bots.accept_challenge,
+                                           challenge['id'])
+            else:
+                await loop.run_in_executor(None, self.client.bots.decline_challenge,
+                                           challenge['id'])
+        except Exception as error: # the challenge may have been taken back in the meantime
+            print('Error: could not answer challenge', challenge['id'], error)
+            if self.games.get(challenge['id'], 0) == None:
+                del self.games[challenge['id']]
+
+    async def play_game(self, game_id):
+        if self.max_games == 1:
+            game = Lichess_Game(self.client, game_id, self.bot_name, self.search_pool,
+                                self.max_depth, self.max_move_time, self.ponder,
+                                latency_log=self.latency_log, opening_book=self.opening_book,
+                                stats_log=self.stats_log)
+        else:
+            lane = Search_Lane(self.search_pool, self.search_pool.lazy_smp)
+            game = Lichess_Game(self.client, game_id, self.bot_name, lane, self.max_depth,
+                                self.max_move_time, False, self.scheduler, self.latency_log,
+                                self.opening_book, self.stats_log)
+        self.scheduler.games.append(game)
+        try:
+            await game.run()
+        finally:
+            self.scheduler.games.remove(game)
+            del self.games[game_id]
+
+    async def run(self):
+        self.events = asyncio.Queue()
+        self.scheduler = Search_Scheduler(self.search_pool)
+        event_thread = threading.Thread(target=self.read_events,
+                                        args=(asyncio.get_running_loop(),), daemon=True)
+        event_thread.start()
+        while True:
+            event = await self.events.get()
+            if event['type'] == 'challenge':
+                await self.answer_challenge(event['challenge'])
+            elif event['type'] == 'challengeCanceled':
+                if self.games.get(event['challenge']['id'], 0) == None:
+                    del self.games[event['challenge']['id']]
+            elif event['type'] == 'gameStart':
+                game_id = event['game']['id']
+                if self.games.get(game_id) == None:
+                    print('Game started:', game_id)
+                    self.games[game_id] = asyncio.create_task(self.play_game(game_id))
+
+
 def main():
     # ***********************************************************************************************
     #                             Update these values for your account
-    session = berserk.TokenSession('Your Token Here') # lichess bot account token   
+    session = berserk.TokenSession('Your Token Here') # lichess bot account token
     bot_name = 'Bot Name Here'
     max_depth = 4 # number of moves the engine looks ahead, 4 = w -> b -> w - > b
     # For 10 min games, a depth of 4 has always finished within the time limit.
     # For any shorter game, a depth of 3 should be plenty fast with an avg move time of ~1 or so seconds
+    num_procs = multiprocessing.cpu_count() # number of search processes
+    lazy_smp = False # True to have every process search the whole tree (Lazy SMP)
+    max_move_time = 30 # seconds, the best move found so far is played once this runs out
+    ponder = True # search on the opponent's time, ignored with a warning unless max_games is 1
+    max_games = num_procs # games played at once, the search processes are shared between them
+    speeds = ['blitz', 'rapid', 'classical'] # challenges at other time controls are declined
+    latency_log = 'move_latency.jsonl' # timing of every move is appended here, None to not log
+    stats_log = 'search_stats.jsonl' # search statistics of every move, None to not log
+    book_path = BOOK_PATH # opening book file, None to not use an opening book
     # ***********************************************************************************************
-    
-    client = berserk.Client(session)
-    chess_board = Chess_Board()
-    end = berserk.utils.to_millis(datetime.datetime.now())
-    start = end - 600000
-    games = client.games.export_by_player(bot_name, since=start, until=end, max=1, finished=False)
-
-    for game in games:
-        game_id = game['id'] # find game
-    stream = client.bots.stream_game_state(game_id)
-    
-    for event in stream: # determine if bot is black or white
-        if len(event['white']) > 0 and event['white']['name'] == bot_name:
-        # must check if len(event['white']) > 0 as if white is an anon account, ['name'] does not 
-        # exist and causes the program to crash as event['white'] is empty
-            bot_move = True
-            bot_color = 'w'
-            break
-        else:
-            bot_move = False
-            bot_color = 'b'
-            break
-
-    length = 0
-    num_promotes = 0
-    prev_move = None
-    check_obook = True
-    cur_node = chess_board.opening_book
-    promote_letters = ['q','b','r','k']
 
-    while True:
-        if bot_move == True:
-            start = time.time()
-
-            move = None
-            if check_obook:
-                if prev_move == None:
-                    # randomly choose an opening variation
-                    choice = random.randint(0,len(chess_board.opening_book.children)-1) 
-                    cur_node = chess_board.opening_book.children[choice]
-                    move = [0,cur_node.data]
-                else:
-                    for node in cur_node.children: # continue opening from prev node
-                        if node.data == prev_move:
-                            if len(node.children) > 0:
-                                choice = random.randint(0,len(node.children)-1)
-                                cur_node = node.children[choice]
-                                move = [0,cur_node.data]
-                                break
-                            check_obook = False
-                    else:
-                            check_obook = False
-
-            if move == None:
-                moves = chess_board.list_moves(bot_color)
-                if len(moves) > 1: # divide moves between the processes if there are 2 or more moves
-                    first = []
-                    second = []
-                    third = []
-                    fourth = []
-                    count = 0
-                    for i in range(len(moves)):
-                        if count == 0:
-                            first.append(moves[i])
-                        elif count == 1:
-                            second.append(moves[i])
-                        elif count == 2:
-                            third.append(moves[i])
-                        if count == 3:
-                            fourth.append(moves[i])
-                            count = 0
-                        else:
-                            count += 1
-
-                    manager = multiprocessing.Manager()
-                    best_moves = manager.dict() # best move from each process is stored here
-                    best_moves[1] = best_moves[2] = best_moves[3] = best_moves[4] = []
-
-                    first_eval = multiprocessing.Process(target=chess_board.minimax, 
-                                                         args=(-1000000, 1000000, max_depth, 
-                                                         bot_color, first, best_moves, 1))
-                    second_eval = multiprocessing.Process(target=chess_board.minimax, 
-                                                          args=(-1000000, 1000000, max_depth, 
-                                                          bot_color, second, best_moves, 2))
-                    third_eval = multiprocessing.Process(target=chess_board.minimax, 
-                                                         args=(-1000000, 1000000, max_depth, 
-                                                         bot_color, third, best_moves, 3))
-                    fourth_eval = multiprocessing.Process(target=chess_board.minimax, 
-                                                          args=(-1000000, 1000000, max_depth, 
-                                                          bot_color, fourth, best_moves, 4))
-
-                    first_eval.start()
-                    second_eval.start()
-                    third_eval.start()
-                    fourth_eval.start()
-
-                    first_eval.join()
-                    second_eval.join()
-                    third_eval.join()
-                    fourth_eval.join()
-
-                    print(best_moves)
-
-                    move = [-1000000, None]
-                    for i in best_moves: # find the best move between each process
-                        if best_moves[i][0] > move[0] and best_moves[i][1] != None:
-                            move = best_moves[i]
-                else:
-                    move = [0,moves[0]] # if there is only one legal move, do said move
-
-            # provisional moves are used as they are slightly faster and lichess can deal 
-            # with checkmate detection
-            chess_board.provisional_move(move[1][0],move[1][1],move[1][3],move[1][4]) 
-            eval = move[0]
-            move = index_to_lich(str(move[1][0]) + str(move[1][1]) + ' ' + str(move[1][3]) + str(move[1][4]))
-            print(eval, move)
-            move_made = False
-            recconnect_count = 0
-            while not move_made:
-                try:
-                    client.bots.make_move(game_id, move)
-                    move_made = True
-                except:
-                    if recconnect_count > 0:
-                        print('Game Over')
-                        exit(0)
-                    recconnect_count += 1
-                    print('Error: Connection Lost temporarily, or game over. Retrying.')
-                    # exception occurs when the computer the engine is running on loses connection.
-                    # This continues running until a valid move can be made when connection is restored.
-            bot_move = not bot_move
-            
-            for event in stream:
-                if event['status'] != 'started':
-                    print('Game Over')
-                    exit(0) 
-                else:
-                    break # there is only 1 event, break stops program from waiting for future events
-
-            print(time.time()-start,'\n')
-
-        else:   
-            for event in stream:
-                if event['type'] == 'gameState': 
-                    moves = event['moves']
-                    new_len = len(moves) 
-
-                    end = moves[new_len-1]
-                    moves = moves.replace(' ','') # remove all spaces for accurate move count
-                    moves_len = len(moves) - num_promotes
-                    # promotes on lichess come in the form of e6e7q for example, 5 letters.
-                    # To keep an accurate account of the number of moves, these letters are
-                    # kept track of
-
-                    if end in promote_letters: # keeping track of promotions
-                        num_promotes += 1
-                        moves = moves[0:-1] 
-                        moves_len -= 1
-                    if moves_len > 5:
-                        prev_end = moves[-5]
-                        if moves_len % 8 != 0 and prev_end in promote_letters:
-                            moves_len -= 1
-                            num_promotes += 1
-
-                    if bot_color == 'b':
-                        moves_len += 4
-
-                    if new_len != length and moves_len % 8 == 0:  
-                    # As this code is reached every 2 turns, the difference in the move list
-                    # should be 8 characters (two 4 character moves) when adjusted for spaces 
-                    # and promotion numbers. If this is not the case, only one move has 
-                    # been updated in the Lichess move list, so this code should not yet execute. 
-                        length = new_len
-                        move = lich_to_index(moves[-4:])
-                        prev_move = [int(move[0]), int(move[1]), ' ',int(move[3]), int(move[4])]
-                        #  prev_moeve used for keeping track of opening line
-                        chess_board.provisional_move(int(move[0]), int(move[1]), int(move[3]), int(move[4])) 
-                        bot_move = not bot_move
-                        if event['status'] != 'started':
-                            print('Game Over') 
-                            exit(0) 
-                        break
-                else:
-                    break 
-                    # break is required to reenter the begenning of the while loop,
-                    # in the advent connection is lost at a weird time, so the stream can update
+    client = berserk.Client(session)
+    # started once, reused for every move of every game
+    search_pool = Search_Pool(num_procs, lazy_smp, channels=min(max_games, num_procs))
+    opening_book = Opening_Book(book_path) if book_path != None else None
+    server = Bot_Server(client, bot_name, search_pool, max_depth, max_move_time, ponder,
+                        max_games, speeds, latency_log, opening_book, stats_log)
+    try:
+        asyncio.run(server.run())
+    finally:
+        search_pool.close()
+        if opening_book != None:
+            opening_book.close()
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,144 @@
+'''The KQvK, KRvK and KPvK bitbases in res/bitbases against known distances to mate,
+under every mirror and with the colors swapped'''
+import os
+import random
+from ordinary_engine import Bitbases, Chess_Board, bitbase_symmetry, BITBASE_WIN
+
+BITBASES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'res', 'bitbases')
+
+# fen: (result, plies) for the side to move, as Bitbases.probe returns it
+KNOWN = {'k7/8/1K6/8/8/8/7Q/8 w - - 0 1': (1, 1), # Qh8#
+         'k7/8/1K6/8/8/8/7Q/8 b - - 0 1': (0, 0), # stalemate
+         'k7/1Q6/1K6/8/8/8/8/8 b - - 0 1': (-1, 0), # mated
+         'k7/8/1K6/8/8/8/8/7R w - - 0 1': (1, 1), # Rh8#
+         'k7/1R6/1K6/8/8/8/8/8 b - - 0 1': (0, 0), # stalemate, the rook is guarded
+         'k7/2P5/1K6/8/8/8/8/8 w - - 0 1': (1, 1), # c8=Q#
+         '4k3/4P3/4K3/8/8/8/8/8 b - - 0 1': (0, 0), # stalemate
+         'k7/P7/K7/8/8/8/8/8 b - - 0 1': (0, 0)} # stalemate
+
+# the longest wins with white to move, 10, 16 and 28 moves
+LONGEST = {'KQvK': 19, 'KRvK': 31, 'KPvK': 55}
+
+TYPES = {'K': 1, 'Q': 2, 'R': 6, 'P': 5}
+
+
+def pieces_of(fen):
+    chess_board = Chess_Board()
+    chess_board.load_fen(fen)
+    pieces = []
+    for x in range(8):
+        for y in range(8):
+            piece = chess_board.board[x][y]
+            if piece.type != 7:
+                pieces.append((piece.color, piece.type, x * 8 + y))
+    return pieces, 'w' if chess_board.turn else 'b'
+
+
+def variants(pieces, stm):
+    '''The position under each mirror that keeps it the same, then each of those with
+    the colors swapped and the board turned around'''
+    pawns = any(piece[1] == 5 for piece in pieces)
+    mirrored = []
+    for t in ([0, 1] if pawns else range(8)):
+        mirrored.append(([(color, type, bitbase_symmetry(sq >> 3, sq & 7, t))
+                          for color, type, sq in pieces], stm))
+    swapped = [([('b' if color == 'w' else 'w', type, sq ^ 7) for color, type, sq in position],
+                'b' if mirrored_stm == 'w' else 'w') for position, mirrored_stm in mirrored]
+    return mirrored + swapped
+
+
+def test_known_positions():
+    bitbases = Bitbases(BITBASES)
+    for fen, known in KNOWN.items():
+        pieces, stm = pieces_of(fen)
+        for position, variant_stm in variants(pieces, stm):
+            assert bitbases.probe_pieces(position, variant_stm) == known, (fen, position)
+    bitbases.close()
+
+
+def test_longest_wins():
+    for name, plies in LONGEST.items():
+        with open(os.path.join(BITBASES, name + '.bin'), 'rb') as file:
+            table = file.read()
+        white_to_move = table[:len(table) // 2]
+        assert max(white_to_move) - 1 == plies, name
+
+
+def random_position(rng, letters):
+    '''pieces for letters, upper case white and lower case black, on random squares
+    with no pawn on the first or last rank'''
+    while True:
+        squares = rng.sample(range(64), len(letters))
+        if all(letter != 'P' or sq & 7 not in (0, 7) for letter, sq in zip(letters, squares)):
+            return [('w' if letter.isupper() else 'b', TYPES[letter.upper()], sq)
+                    for letter, sq in zip(letters, squares)]
+
+
+def test_mirrors_probe_the_same():
+    rng = random.Random(43)
+    bitbases = Bitbases(BITBASES)
+    for letters in (['K', 'Q', 'k'], ['K', 'R', 'k'], ['K', 'P', 'k']):
+        for i in range(200):
+            pieces = random_position(rng, letters)
+            for stm in ('w', 'b'):
+                expected = bitbases.probe_pieces(pieces, stm)
+                for position, variant_stm in variants(pieces, stm):
+                    assert bitbases.probe_pieces(position, variant_stm) == expected
+    bitbases.close()
+
+
+def test_distance_follows_from_the_replies():
+    '''A win is one ply longer than the quickest reply the opponent loses, a loss one
+    longer than the slowest reply that wins'''
+    rng = random.Random(7)
+    bitbases = Bitbases(BITBASES)
+    chess_board = Chess_Board()
+    for letters in (['K', 'Q', 'k'], ['K', 'R', 'k'], ['K', 'P', 'k']):
+        checked = 0
+        while checked < 40:
+            pieces = random_position(rng, letters)
+            fen_rows = [['1'] * 8 for y in range(8)]
+            for color, type, sq in pieces:
+                letter = 'KQNBPR'[type - 1]
+                fen_rows[sq & 7][sq >> 3] = letter if color == 'w' else letter.lower()
+            stm = rng.choice('wb')
+            chess_board.load_fen('/'.join(''.join(row) for row in fen_rows) + ' ' + stm + ' - - 0 1')
+            opp_king = chess_board.get_black_king() if stm == 'w' else chess_board.get_white_king()
+            if opp_king.in_check(chess_board.board, chess_board.move_num):
+                continue # not a position a game can reach
+            checked += 1
+            result, plies = bitbases.probe(chess_board)
+            replies = []
+            for move in chess_board.list_moves(stm):
+                promote = chess_board.board[move[0]][move[1]].type == 5 and move[4] in (0, 7)
+                for promote_type in ([2, 6, 4, 3] if promote else [2]):
+                    chess_board.provisional_move(move[0], move[1], move[3], move[4], promote_type)
+                    replies.append(bitbases.probe(chess_board) or (0, 0)) # KBvK, KNvK draw
+                    chess_board.undo_move()
+            if not replies:
+                expected = (-1, 0) if chess_board.in_checkmate(stm) else (0, 0)
+            elif any(reply[0] == -1 for reply in replies):
+                expected = (1, min(reply[1] for reply in replies if reply[0] == -1) + 1)
+            elif all(reply[0] == 1 for reply in replies):
+                expected = (-1, max(reply[1] for reply in replies) + 1)
+            else:
+                expected = (0, 0)
+            assert (result, plies) == expected, chess_board.get_fen()
+    bitbases.close()
+
+
+def test_board_probe_scores():
+    chess_board = Chess_Board()
+    chess_board.bitbases = Bitbases(BITBASES)
+    chess_board.load_fen('k7/8/1K6/8/8/8/7Q/8 w - - 0 1')
+    assert chess_board.probe_bitbases() == BITBASE_WIN - 1
+    chess_board.load_fen('k7/1Q6/1K6/8/8/8/8/8 b - - 0 1')
+    assert chess_board.probe_bitbases() == -BITBASE_WIN
+    chess_board.load_fen('k7/8/1K6/8/8/8/7Q/8 b - - 0 1')
+    assert chess_board.probe_bitbases() == 0
+    chess_board.load_fen('k7/8/1K6/8/8/8/7Q/8 w - - 0 1')
+    chess_board.provisional_move(7, 6, 7, 0) # Qh8#, one ply deeper than the root
+    assert chess_board.probe_bitbases() == -BITBASE_WIN + 1
+    chess_board.load_fen('K7/8/1k6/8/8/8/7q/8 b - - 0 1') # KvKQ is KQvK turned around
+    assert chess_board.probe_bitbases() == BITBASE_WIN - 1
+    chess_board.bitbases.close()
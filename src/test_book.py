@@ -0,0 +1,86 @@
+'''The binary opening book: record layout, move codes, keys and lookups'''
+import os
+from ordinary_engine import (Chess_Board, Opening_Book, BOOK_RECORD, BOOK_PATH, book_key,
+                             book_from_lines, decode_book_move, encode_book_move, write_book)
+
+BOOK = os.path.join(os.path.dirname(os.path.abspath(__file__)), BOOK_PATH)
+
+
+def board_after(line):
+    chess_board = Chess_Board()
+    for uci in line.split():
+        x1, y1, x2, y2 = ord(uci[0]) - 97, 8 - int(uci[1]), ord(uci[2]) - 97, 8 - int(uci[3])
+        assert chess_board.provisional_move(x1, y1, x2, y2)
+    return chess_board
+
+
+def test_record_layout():
+    # big endian key, move, weight and learn, 16 bytes as in a polyglot book
+    assert BOOK_RECORD.size == 16
+    record = BOOK_RECORD.pack(0x0123456789ABCDEF, 0x031C, 7, 0)
+    assert record == bytes.fromhex('0123456789abcdef' '031c' '0007' '00000000')
+
+
+def test_move_codes():
+    # e2e4 is 0x031c in polyglot, to file and rank in the low bits and from above them
+    assert encode_book_move(4, 6, 4, 4) == 0x031C
+    assert decode_book_move(0x031C) == ([4, 6, ' ', 4, 4], 2)
+    for promote_type in (None, 2, 3, 4, 6):
+        code = encode_book_move(0, 1, 1, 0, promote_type)
+        assert decode_book_move(code) == ([0, 1, ' ', 1, 0], promote_type or 2)
+    for x1 in range(8):
+        for y1 in range(8):
+            move, promote_type = decode_book_move(encode_book_move(x1, y1, 7 - x1, y1))
+            assert move == [x1, y1, ' ', 7 - x1, y1]
+
+
+def test_key_ignores_en_passant_that_cannot_be_taken():
+    assert book_key(board_after('d2d4 d7d5 c2c4')) == book_key(board_after('c2c4 d7d5 d2d4'))
+    chess_board = board_after('d2d4 d7d5 c2c4')
+    assert book_key(chess_board) != chess_board.hash
+    # after e5 d5 the pawn on d5 can be taken, so the en passant file is part of the key
+    chess_board = board_after('e2e4 a7a6 e4e5 d7d5')
+    assert book_key(chess_board) == chess_board.hash
+
+
+def test_written_book_round_trip(tmp_path):
+    path = str(tmp_path / 'book.bin')
+    write_book(path, book_from_lines(['e2e4 e7e5 g1f3', 'e2e4 c7c5', 'd2d4 d7d5']))
+    assert os.path.getsize(path) == BOOK_RECORD.size * 6
+    book = Opening_Book(path)
+    assert sorted(book.entries(book_key(Chess_Board()))) == [([3, 6, ' ', 3, 4], 2, 1),
+                                                             ([4, 6, ' ', 4, 4], 2, 2)]
+    assert sorted(book.entries(book_key(board_after('e2e4')))) == [([2, 1, ' ', 2, 3], 2, 1),
+                                                                   ([4, 1, ' ', 4, 3], 2, 1)]
+    assert book.entries(book_key(board_after('a2a3'))) == []
+    for i in range(20):
+        assert book.choose(Chess_Board()) in ([3, 6, ' ', 3, 4], [4, 6, ' ', 4, 4])
+    assert book.choose(board_after('a2a3')) == None
+    book.close()
+
+
+def test_empty_book(tmp_path):
+    path = str(tmp_path / 'book.bin')
+    write_book(path, {})
+    book = Opening_Book(path)
+    assert book.entries(book_key(Chess_Board())) == []
+    assert book.choose(Chess_Board()) == None
+    book.close()
+
+
+def test_records_are_sorted_for_the_binary_search(tmp_path):
+    path = str(tmp_path / 'book.bin')
+    weights = book_from_lines(['e2e4 e7e5 g1f3 b8c6 f1b5', 'd2d4 g8f6 c2c4 e7e6 b1c3'])
+    write_book(path, weights)
+    book = Opening_Book(path)
+    for key, move in weights:
+        assert (decode_book_move(move) + (weights[(key, move)],)) in book.entries(key)
+    book.close()
+
+
+def test_shipped_book():
+    book = Opening_Book(BOOK)
+    chess_board = Chess_Board()
+    move = book.choose(chess_board)
+    assert move != None and chess_board.provisional_move(move[0], move[1], move[3], move[4])
+    book.close()
@@ -0,0 +1,148 @@
+'''SAN and PGN parsing of build_book.py, and a book built from a small PGN file'''
+from build_book import build_book, parse_san, read_games, san_moves
+from ordinary_engine import Chess_Board, Opening_Book, book_key
+
+GAMES = '''[Event "one"]
+[Result "1-0"]
+
+1. e4 {best by test} e5 2. Nf3 (2. f4 exf4 (2... d5)) Nc6 $1 3. Bb5 a6 1-0
+
+[Event "two"]
+[Result "1-0"]
+
+1. e4 e5 2. Nf3 Nf6 ; the petrov
+3. Nxe5 1-0
+
+[Event "three"]
+[Result "1/2-1/2"]
+
+1. e4 c5 2. Nf3 1/2-1/2
+
+[Event "four"]
+[Result "0-1"]
+
+1. d4 d5 0-1
+
+[Event "unfinished"]
+[Result "*"]
+
+1. e4 e5 *
+
+[Event "promotion"]
+[SetUp "1"]
+[FEN "8/1P6/8/8/8/2k5/8/4K3 w - - 0 1"]
+[Result "1-0"]
+
+1. b8=N c2 2. Nc6 1-0
+[Event "promotion again, no blank line before it"]
+[SetUp "1"]
+[FEN "8/1P6/8/8/8/2k5/8/4K3 w - - 0 1"]
+[Result "1/2-1/2"]
+
+1. b8=N+ Kd3 1/2-1/2
+'''
+
+
+def board_from(fen):
+    chess_board = Chess_Board()
+    chess_board.load_fen(fen)
+    return chess_board
+
+
+def test_san_moves():
+    assert san_moves('1. e4 {a comment (with a bracket)} e5 2. Nf3 (2. f4 exf4 (2... d5 3. exd5)) '
+                     'Nc6 $1 ; to the end of the line\n3. Bb5 1-0') == ['e4', 'e5', 'Nf3', 'Nc6', 'Bb5']
+    assert san_moves('12... Qxd8+ 13. Kxd8 1/2-1/2') == ['Qxd8+', 'Kxd8']
+    assert san_moves('1. e4 *') == ['e4']
+
+
+def test_parse_pawn_and_piece_moves():
+    chess_board = Chess_Board()
+    assert parse_san(chess_board, 'e4') == (4, 6, 4, 4, 2)
+    assert parse_san(chess_board, 'Nf3') == (6, 7, 5, 5, 2)
+    assert parse_san(chess_board, 'Nf3+!?') == (6, 7, 5, 5, 2)
+    assert parse_san(chess_board, 'e5') == None
+    assert parse_san(chess_board, 'Ke2') == None
+    assert parse_san(chess_board, 'Xe4') == None
+
+
+def test_parse_disambiguation():
+    # knights on b1 and f3 both reach d2, the file tells them apart
+    chess_board = board_from('4k3/8/8/8/8/5N2/8/1N2K3 w - - 0 1')
+    assert parse_san(chess_board, 'Nbd2') == (1, 7, 3, 6, 2)
+    assert parse_san(chess_board, 'Nfd2') == (5, 5, 3, 6, 2)
+    assert parse_san(chess_board, 'Nd2') == None
+    # rooks on a1 and a5, the rank tells them apart
+    chess_board = board_from('4k3/8/8/R7/8/8/8/R3K3 w - - 0 1')
+    assert parse_san(chess_board, 'R1a3') == (0, 7, 0, 5, 2)
+    assert parse_san(chess_board, 'R5a3') == (0, 3, 0, 5, 2)
+    assert parse_san(chess_board, 'Ra1a3') == (0, 7, 0, 5, 2)
+    # the knight on e2 is pinned, so Nc3 can only be the one on b1
+    chess_board = board_from('4r1k1/8/8/8/8/8/4N3/1N2K3 w - - 0 1')
+    assert parse_san(chess_board, 'Nc3') == (1, 7, 2, 5, 2)
+
+
+def test_parse_promotions():
+    chess_board = board_from('3r1k2/2P5/8/8/8/8/8/4K3 w - - 0 1')
+    assert parse_san(chess_board, 'c8=Q') == (2, 1, 2, 0, 2)
+    assert parse_san(chess_board, 'c8=N+') == (2, 1, 2, 0, 3)
+    assert parse_san(chess_board, 'cxd8=R') == (2, 1, 3, 0, 6)
+    assert parse_san(chess_board, 'cxd8B') == (2, 1, 3, 0, 4)
+
+
+def test_parse_castling():
+    chess_board = board_from('r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1')
+    assert parse_san(chess_board, 'O-O') == (4, 7, 6, 7, 2)
+    assert parse_san(chess_board, 'O-O-O') == (4, 7, 2, 7, 2)
+    assert parse_san(chess_board, '0-0+') == (4, 7, 6, 7, 2)
+    chess_board = board_from('r3k2r/8/8/8/8/8/8/R3K2R b KQkq - 0 1')
+    assert parse_san(chess_board, 'O-O-O') == (4, 0, 2, 0, 2)
+
+
+def test_read_games(tmp_path):
+    path = tmp_path / 'games.pgn'
+    path.write_text(GAMES)
+    games = list(read_games([str(path)]))
+    assert [result for fen, result, movetext in games] == ['1-0', '1-0', '1/2-1/2', '0-1', '*',
+                                                          '1-0', '1/2-1/2']
+    assert games[5][0] == '8/1P6/8/8/8/2k5/8/4K3 w - - 0 1'
+
+
+def test_build_book_round_trip(tmp_path):
+    path = tmp_path / 'games.pgn'
+    path.write_text(GAMES)
+    out = str(tmp_path / 'book.bin')
+    used, positions, moves = build_book([str(path)], out, max_plies=4, min_count=2, workers=1)
+    assert used == 6 # the unfinished game is left out
+
+    book = Opening_Book(out)
+    # e4 was played 3 times, d4 once, which is less than min_count
+    assert book.entries(book_key(Chess_Board())) == [([4, 6, ' ', 4, 4], 2, 3)]
+    chess_board = Chess_Board()
+    chess_board.provisional_move(4, 6, 4, 4)
+    assert book.entries(book_key(chess_board)) == [([4, 1, ' ', 4, 3], 2, 2)]
+    chess_board.provisional_move(4, 1, 4, 3)
+    assert book.entries(book_key(chess_board)) == [([6, 7, ' ', 5, 5], 2, 2)]
+    chess_board.provisional_move(6, 7, 5, 5)
+    # Nc6 and Nf6 were played once each
+    assert book.entries(book_key(chess_board)) == []
+    # the knight promotion is kept as one
+    promotion = board_from('8/1P6/8/8/8/2k5/8/4K3 w - - 0 1')
+    assert book.entries(book_key(promotion)) == [([1, 1, ' ', 1, 0], 3, 2)]
+    assert book.choose(promotion) == [1, 1, ' ', 1, 0]
+    assert (positions, moves) == (4, 4)
+    book.close()
+
+
+def test_build_book_min_score(tmp_path):
+    path = tmp_path / 'games.pgn'
+    path.write_text(GAMES)
+    out = str(tmp_path / 'book.bin')
+    # e4 scored 2.5 of 3, e5 nothing of 2 for black
+    build_book([str(path)], out, max_plies=4, min_count=2, min_score=0.5, workers=1)
+    book = Opening_Book(out)
+    assert book.entries(book_key(Chess_Board())) == [([4, 6, ' ', 4, 4], 2, 3)]
+    chess_board = Chess_Board()
+    chess_board.provisional_move(4, 6, 4, 4)
+    assert book.entries(book_key(chess_board)) == []
+    book.close()
@@ -0,0 +1,55 @@
+'''Moves out of check: only evasions are generated, and the same ones provisional_move
+accepts'''
+from ordinary_engine import Chess_Board
+from test_movegen import board_from, brute_force_moves, generated_moves
+
+
+def test_single_check():
+    # the knight on d3 checks, nothing can take it so the king has to move
+    chess_board, color = board_from('4k3/8/8/8/8/3n4/8/R3K3 w - - 0 1')
+    moves = generated_moves(chess_board, color)
+    assert moves and all(move[:2] == (4, 7) for move in moves)
+    assert moves == brute_force_moves(chess_board, color)
+
+    # the rook takes the checking knight
+    chess_board, color = board_from('4k3/8/8/8/8/3n4/8/3RK3 w - - 0 1')
+    moves = generated_moves(chess_board, color)
+    assert [move for move in moves if move[:2] != (4, 7)] == [(3, 7, ' ', 3, 5)]
+    assert moves == brute_force_moves(chess_board, color)
+
+
+def test_double_check_king_moves_only():
+    # the rook on d1 could take the knight, but the rook on e8 checks too
+    chess_board, color = board_from('k3r3/8/8/8/8/3n4/8/3RK3 w - - 0 1')
+    moves = generated_moves(chess_board, color)
+    assert moves and all(move[:2] == (4, 7) for move in moves)
+    assert moves == brute_force_moves(chess_board, color)
+
+
+def test_block_a_slider():
+    # the rook on a1 checks along the first rank, the knight and rook block on b1 or d1
+    chess_board, color = board_from('k7/3R4/8/8/8/2N5/7P/r3K3 w - - 0 1')
+    moves = generated_moves(chess_board, color)
+    assert moves == sorted([(2, 5, ' ', 1, 7), (2, 5, ' ', 3, 7), (3, 1, ' ', 3, 7),
+                            (4, 7, ' ', 3, 6), (4, 7, ' ', 4, 6), (4, 7, ' ', 5, 6)])
+    assert moves == brute_force_moves(chess_board, color)
+
+
+def test_capture_checking_pawn_en_passant():
+    # d7-d5 checks the king on e4, exd6 takes the pawn off
+    chess_board, color = board_from('k7/8/8/3pP3/4K3/8/8/8 w - d6 0 2')
+    moves = generated_moves(chess_board, color)
+    assert (4, 3, ' ', 3, 2) in moves
+    assert moves == brute_force_moves(chess_board, color)
+
+    chess_board.provisional_move(4, 3, 3, 2)
+    assert chess_board.board[3][3].type == 7 # the d5 pawn is gone
+    king = chess_board.get_white_king()
+    assert not king.in_check(chess_board.board, chess_board.move_num)
+
+
+def test_no_evasion_is_checkmate():
+    chess_board = Chess_Board()
+    chess_board.load_fen('R5k1/5ppp/8/8/8/8/8/6K1 b - - 0 1')
+    assert chess_board.list_moves('b') == []
+    assert chess_board.in_checkmate('b')
@@ -0,0 +1,140 @@
+'''Move generation: perft counts, and legal_moves checked square by square against
+provisional_move, which tries a move on the board and takes it back if it is illegal'''
+import random
+from ordinary_engine import Chess_Board
+
+START = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+KIWIPETE = 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1'
+POSITION_3 = '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1'
+POSITION_4 = 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1'
+POSITION_5 = 'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8'
+
+
+def board_from(fen):
+    chess_board = Chess_Board()
+    chess_board.load_fen(fen)
+    return chess_board, 'w' if chess_board.turn else 'b'
+
+
+def opposite(color):
+    return 'b' if color == 'w' else 'w'
+
+
+def promotes(chess_board, move):
+    return chess_board.board[move[0]][move[1]].type == 5 and move[4] in (0, 7)
+
+
+def perft(chess_board, depth, color):
+    '''The leaves depth moves away. The engine only promotes to a queen, so a promotion
+    on the last move counts for the four promotions perft counts'''
+    moves = chess_board.list_moves(color)
+    if depth == 1:
+        return sum(4 if promotes(chess_board, move) else 1 for move in moves)
+    nodes = 0
+    for move in moves:
+        chess_board.provisional_move(move[0], move[1], move[3], move[4], 2, True)
+        nodes += perft(chess_board, depth - 1, opposite(color))
+        chess_board.undo_move()
+    return nodes
+
+
+def brute_force_moves(chess_board, color):
+    '''Every move provisional_move accepts for a piece of color'''
+    moves = []
+    for x1 in range(8):
+        for y1 in range(8):
+            if chess_board.board[x1][y1].color != color:
+                continue
+            for x2 in range(8):
+                for y2 in range(8):
+                    if chess_board.provisional_move(x1, y1, x2, y2):
+                        moves.append((x1, y1, ' ', x2, y2))
+                        chess_board.undo_move()
+    return sorted(moves)
+
+
+def generated_moves(chess_board, color):
+    return sorted(tuple(move) for move in chess_board.list_moves(color))
+
+
+def test_perft_start():
+    chess_board, color = board_from(START)
+    assert [perft(chess_board, depth, color) for depth in (1, 2, 3)] == [20, 400, 8902]
+
+
+def test_perft_kiwipete():
+    chess_board, color = board_from(KIWIPETE)
+    assert [perft(chess_board, depth, color) for depth in (1, 2, 3)] == [48, 2039, 97862]
+
+
+def test_perft_position_3():
+    chess_board, color = board_from(POSITION_3)
+    assert [perft(chess_board, depth, color) for depth in (1, 2, 3, 4)] == [14, 191, 2812, 43238]
+
+
+def test_perft_position_4():
+    # promotions are made from the second move on, so no deeper than that
+    chess_board, color = board_from(POSITION_4)
+    assert [perft(chess_board, depth, color) for depth in (1, 2)] == [6, 264]
+
+
+def test_perft_position_5():
+    chess_board, color = board_from(POSITION_5)
+    assert perft(chess_board, 1, color) == 44
+
+
+def test_pinned_piece_stays_on_the_pin():
+    chess_board, color = board_from('4k3/4r3/8/8/8/8/4B3/4K3 w - - 0 1')
+    moves = generated_moves(chess_board, color)
+    assert not [move for move in moves if move[:2] == (4, 6)] # the bishop on e2
+    assert moves == brute_force_moves(chess_board, color)
+
+    # a pinned rook can still move along the pin
+    chess_board, color = board_from('4k3/4r3/8/8/8/8/4R3/4K3 w - - 0 1')
+    moves = generated_moves(chess_board, color)
+    assert sorted(move[3:] for move in moves if move[:2] == (4, 6)) == [(4, 1), (4, 2), (4, 3),
+                                                                        (4, 4), (4, 5)]
+    assert moves == brute_force_moves(chess_board, color)
+
+
+def test_en_passant_discovered_check():
+    # bxc6 would take both pawns off the fifth rank and leave the king to the rook
+    chess_board, color = board_from('8/8/8/KPp4r/8/8/8/4k3 w - c6 0 2')
+    moves = generated_moves(chess_board, color)
+    assert (1, 3, ' ', 2, 2) not in moves
+    assert moves == brute_force_moves(chess_board, color)
+
+    # without the rook it is legal
+    chess_board, color = board_from('8/8/8/KPp5/8/8/8/4k3 w - c6 0 2')
+    assert (1, 3, ' ', 2, 2) in generated_moves(chess_board, color)
+
+
+def test_castling_through_check():
+    # the rook on f8 covers f1, so only the long castle is left
+    chess_board, color = board_from('4kr2/8/8/8/8/8/8/R3K2R w KQ - 0 1')
+    moves = generated_moves(chess_board, color)
+    assert (4, 7, ' ', 6, 7) not in moves
+    assert (4, 7, ' ', 2, 7) in moves
+    assert moves == brute_force_moves(chess_board, color)
+
+    # no castling out of check
+    chess_board, color = board_from('4r1k1/8/8/8/8/8/8/R3K2R w KQ - 0 1')
+    moves = generated_moves(chess_board, color)
+    assert (4, 7, ' ', 6, 7) not in moves and (4, 7, ' ', 2, 7) not in moves
+    assert moves == brute_force_moves(chess_board, color)
+
+
+def test_legal_moves_match_provisional_move():
+    '''Random games from positions full of pins, checks, castling and en passant'''
+    rng = random.Random(20)
+    for fen in (START, KIWIPETE, POSITION_3, POSITION_4, POSITION_5):
+        for game in range(3):
+            chess_board, color = board_from(fen)
+            for ply in range(40):
+                moves = brute_force_moves(chess_board, color)
+                assert generated_moves(chess_board, color) == moves, chess_board.get_fen()
+                if not moves:
+                    break
+                move = rng.choice(moves)
+                chess_board.provisional_move(move[0], move[1], move[3], move[4])
+                color = opposite(color)
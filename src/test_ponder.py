@@ -0,0 +1,57 @@
+'''Pondering in the lichess loop without lichess or a search: hits and misses of
+Lichess_Game.opponent_moved, and when Bot_Server ponders at all'''
+from ordinary_engine import Bot_Server, Lichess_Game, lich_to_index
+
+
+class Stub_Pool:
+    def __init__(self):
+        self.stopped = False
+
+    def stop_search(self):
+        self.stopped = True
+
+
+def pondering_game(predicted):
+    pool = Stub_Pool()
+    game = Lichess_Game(None, 'test', 'bot', pool, 4, 5, True)
+    move = lich_to_index(predicted[:4])
+    game.ponder_move = [int(move[0]), int(move[1]), ' ', int(move[3]), int(move[4])]
+    game.pondering = True
+    return game, pool
+
+
+def opponent_plays(game, uci):
+    game.move_list.append(uci)
+    game.opponent_moved()
+
+
+def test_predicted_move_is_a_hit():
+    game, pool = pondering_game('e2e4')
+    opponent_plays(game, 'e2e4')
+    assert game.ponder_hit and not pool.stopped and not game.pondering
+
+
+def test_other_move_is_a_miss():
+    game, pool = pondering_game('e2e4')
+    opponent_plays(game, 'd2d4')
+    assert not game.ponder_hit and pool.stopped and not game.pondering
+
+
+def test_queen_promotion_is_a_hit():
+    game, pool = pondering_game('a7a8q')
+    opponent_plays(game, 'a7a8q')
+    assert game.ponder_hit and not pool.stopped
+
+
+def test_underpromotion_is_a_miss():
+    for uci in ['a7a8n', 'a7a8b', 'a7a8r']:
+        game, pool = pondering_game('a7a8q')
+        opponent_plays(game, uci)
+        assert not game.ponder_hit and pool.stopped, uci
+
+
+def test_ponder_only_with_one_game(capsys):
+    assert Bot_Server(None, 'bot', None, 4, 5, True, 1, ['blitz']).ponder
+    assert capsys.readouterr().out == ''
+    assert not Bot_Server(None, 'bot', None, 4, 5, True, 4, ['blitz']).ponder
+    assert 'ponder is ignored' in capsys.readouterr().out
@@ -0,0 +1,64 @@
+'''The search: mates count the plies from the root of each search, also when they come
+out of the transposition table of an earlier search, and the last ply only skips the
+losing captures that neither check nor promote'''
+from ordinary_engine import Chess_Board
+
+MATE_IN_2 = 'k7/8/8/2K5/8/8/8/1Q6 w - - 0 1' # 1. Kc6 Ka7 2. Qb7#
+
+
+def search(chess_board, depth):
+    '''lazy_smp_search of a single worker. The leaves are only evaluated, so a mate is
+    found at a depth of one more than its plies.'''
+    color = 'w' if chess_board.turn else 'b'
+    score, move, reached = chess_board.lazy_smp_search(color, depth, chess_board.list_moves(color), 1)
+    return score, move
+
+
+def test_mate_scores_count_plies_from_the_root():
+    chess_board = Chess_Board()
+    chess_board.load_fen(MATE_IN_2)
+    for depth in (4, 5):
+        chess_board.tt = {}
+        score, move = search(chess_board, depth)
+        assert score == 1000000 - 3 and move == [2, 3, ' ', 2, 2], depth
+
+
+def test_table_mate_scores_carry_over_to_the_next_search():
+    chess_board = Chess_Board()
+    chess_board.load_fen(MATE_IN_2)
+    assert search(chess_board, 5)[0] == 1000000 - 3
+    # the next move is searched from a new root, as the search workers do, with the
+    # table of the last search
+    chess_board.provisional_move(2, 3, 2, 2)
+    chess_board.provisional_move(0, 0, 0, 1)
+    chess_board.load_fen(chess_board.get_fen())
+    for depth in (2, 3, 4):
+        score, move = search(chess_board, depth)
+        assert score == 1000000 - 1 and move == [1, 7, ' ', 1, 1], depth
+
+    # mated in 2 plies from black's side
+    chess_board.load_fen(MATE_IN_2)
+    chess_board.provisional_move(2, 3, 2, 2)
+    chess_board.load_fen(chess_board.get_fen())
+    for depth in (3, 4):
+        assert search(chess_board, depth)[0] == -1000000 + 2, depth
+
+
+def test_last_ply_searches_losing_captures_that_check():
+    # Qxf7+ and Qxh7+ lose the queen by SEE, but a check is kept at the last ply
+    chess_board = Chess_Board()
+    chess_board.load_fen('6k1/5ppp/5n2/7Q/8/8/5PPP/6K1 w - - 0 1')
+    score, move = chess_board.maximize(-1000000, 1000000, 1, 'w')
+    assert move in ([7, 3, ' ', 5, 1], [7, 3, ' ', 7, 1])
+    # the same for black, searched by minimize
+    chess_board.load_fen('6k1/5ppp/8/8/7q/5N2/5PPP/6K1 b - - 0 1')
+    score, move = chess_board.minimize(-1000000, 1000000, 1, 'b')
+    assert move in ([7, 4, ' ', 5, 6], [7, 4, ' ', 7, 6])
+
+
+def test_last_ply_skips_other_losing_captures():
+    # Qxb7 loses the queen to the rook without a check
+    chess_board = Chess_Board()
+    chess_board.load_fen('1r4k1/1p3ppp/8/8/1Q6/8/5PPP/6K1 w - - 0 1')
+    score, move = chess_board.maximize(-1000000, 1000000, 1, 'w')
+    assert move != None and move != [1, 4, ' ', 1, 1]
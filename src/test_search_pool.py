@@ -0,0 +1,16 @@
+'''Search_Pool with the thread backend, which runs without a free-threaded python'''
+from ordinary_engine import Chess_Board, Search_Pool
+
+
+def test_shared_history_ages_once_per_search():
+    search_pool = Search_Pool(3, backend='thread')
+    try:
+        search_pool.history[0] = 64
+        chess_board = Chess_Board()
+        search_pool.start_search(chess_board, 'w', 1, chess_board.list_moves('w'))
+        score, move = search_pool.get_result()[:2]
+        assert move in chess_board.list_moves('w')
+        # halved once by the lane, not again by each of the 3 workers
+        assert search_pool.history[0] == 32
+    finally:
+        search_pool.close()